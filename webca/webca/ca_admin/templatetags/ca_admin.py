@@ -7,6 +7,7 @@ import pytz
 from django import template
 from django.contrib.admin.utils import display_for_value
 
+from webca.certstore import CertificateInfo
 from webca.crypto.utils import components_to_name, int_to_hex
 from webca.utils import subject_display
 
@@ -40,14 +41,19 @@ def sort_apps(app_list):
 
 @register.filter
 def subject(x509):
-    """Return the subject of the certificate."""
-    value = components_to_name(x509.get_subject().get_components())
+    """Return the subject of the certificate or `CertificateInfo`."""
+    if isinstance(x509, CertificateInfo):
+        value = x509.subject
+    else:
+        value = components_to_name(x509.get_subject().get_components())
     return subject_display(value).replace('/', ' ').strip()
 
 
 @register.filter
 def serial(x509):
-    """Return the serial of the certificate."""
+    """Return the serial of the certificate or `CertificateInfo`."""
+    if isinstance(x509, CertificateInfo):
+        return x509.serial
     return int_to_hex(x509.get_serial_number())
 
 
@@ -17,8 +17,7 @@ from webca.certstore import CertificateExistsError, CertStore
 from webca.config import constants as parameters
 from webca.config.models import ConfigurationObject as Config
 from webca.crypto import constants as c
-from webca.crypto.utils import (asn1_to_datetime, components_to_name,
-                                export_certificate, int_to_hex,
+from webca.crypto.utils import (components_to_name, export_certificate,
                                 private_key_type)
 from webca.utils import subject_display
 
@@ -40,50 +39,23 @@ class CertificatesView(View):
         else:
             certs = {}
             for name, store in CertStore.all():
-                for usage in [c.KU_KEYCERTSIGN, c.KU_CRLSIGN]:
-                    usage_name = c.KEY_USAGE[usage]
-                    for cert in store().get_certificates(key_usage=[usage]):
-                        serial = int_to_hex(cert.get_serial_number())
-                        if serial not in certs.keys():
-                            # TODO: this is ugly!
-                            subject = subject_display(components_to_name(
-                                cert.get_subject().get_components()))
-                            cert = {
-                                'store': name,
-                                'serial': serial,
-                                'subject': subject,
-                                'valid_from': asn1_to_datetime(cert.get_notBefore().decode('utf-8')),
-                                'valid_until': asn1_to_datetime(cert.get_notAfter().decode('utf-8')),
-                                c.KEY_USAGE[c.KU_KEYCERTSIGN]: False,
-                                c.KEY_USAGE[c.KU_CRLSIGN]: False,
-                                c.EXT_KEY_USAGE[c.EKU_OCSPSIGNING]: False,
-                            }
-                        else:
-                            cert = certs[serial]
-                        cert[usage_name] = True
-                        certs[serial] = cert
-                for usage in [c.EKU_OCSPSIGNING]:
-                    usage_name = c.EXT_KEY_USAGE[usage]
-                    for cert in store().get_certificates(ext_key_usage=[usage]):
-                        serial = int_to_hex(cert.get_serial_number())
-                        if serial not in certs.keys():
-                            # TODO: this is ugly!
-                            subject = subject_display(components_to_name(
-                                cert.get_subject().get_components()))
-                            cert = {
-                                'store': name,
-                                'serial': serial,
-                                'subject': subject,
-                                'valid_from': asn1_to_datetime(cert.get_notBefore().decode('utf-8')),
-                                'valid_until': asn1_to_datetime(cert.get_notAfter().decode('utf-8')),
-                                c.KEY_USAGE[c.KU_KEYCERTSIGN]: False,
-                                c.KEY_USAGE[c.KU_CRLSIGN]: False,
-                                c.EXT_KEY_USAGE[c.EKU_OCSPSIGNING]: False,
-                            }
-                        else:
-                            cert = certs[serial]
-                        cert[usage_name] = True
-                        certs[serial] = cert
+                infos = store().find_certificates(
+                    key_usage=[c.KU_KEYCERTSIGN, c.KU_CRLSIGN],
+                    ext_key_usage=[c.EKU_OCSPSIGNING],
+                )
+                for info in infos:
+                    if info.serial in certs.keys():
+                        continue
+                    certs[info.serial] = {
+                        'store': name,
+                        'serial': info.serial,
+                        'subject': subject_display(info.subject),
+                        'valid_from': info.valid_from,
+                        'valid_until': info.valid_to,
+                        c.KEY_USAGE[c.KU_KEYCERTSIGN]: c.KU_KEYCERTSIGN in info.key_usage,
+                        c.KEY_USAGE[c.KU_CRLSIGN]: c.KU_CRLSIGN in info.key_usage,
+                        c.EXT_KEY_USAGE[c.EKU_OCSPSIGNING]: c.EKU_OCSPSIGNING in info.ext_key_usage,
+                    }
             context['certificates'] = certs
         return TemplateResponse(request, self.template, context)
 
@@ -134,19 +106,19 @@ class CertificateSetupView(View):
         # list of tuples ('store_id,serial', certificate)
         ca_certificates = []
         for store in CertStore.stores():
-            for cert in store.get_ca_certificates():
+            for cert in store.find_certificates(key_usage=[c.KU_KEYCERTSIGN]):
                 value = '{},{}'.format(store.STORE_ID, admin_tags.serial(cert))
                 ca_certificates.append((value, cert))
 
         crl_certificates = []
         for store in CertStore.stores():
-            for cert in store.get_crl_certificates():
+            for cert in store.find_certificates(key_usage=[c.KU_CRLSIGN]):
                 value = '{},{}'.format(store.STORE_ID, admin_tags.serial(cert))
                 crl_certificates.append((value, cert))
 
         ocsp_certificates = []
         for store in CertStore.stores():
-            for cert in store.get_ocsp_certificates():
+            for cert in store.find_certificates(ext_key_usage=[c.EKU_OCSPSIGNING]):
                 value = '{},{}'.format(store.STORE_ID, admin_tags.serial(cert))
                 ocsp_certificates.append((value, cert))
 
@@ -11,7 +11,7 @@ from django.urls import reverse
 from django.views import View
 
 from webca.ca_admin import admin
-from webca.config import new_crl_config
+from webca.config import get_crl_config
 from webca.config.constants import CRL_CONFIG
 from webca.config.models import ConfigurationObject as Config
 from webca.web.models import CRLLocation, Revoked
@@ -50,7 +50,7 @@ class CRLView(View):
 
     def get_context(self, request, **kwargs):
         """Get a default context."""
-        locations = CRLLocation.objects.all()
+        locations = CRLLocation.with_counts()
         crl_list = [(x.id, x.url) for x in locations.filter(deleted=False)]
         crl_historic = [(x.url, x.count) for x in locations]
 
@@ -122,10 +122,15 @@ class CRLConfigForm(forms.Form):
     days = forms.IntegerField(
         min_value=1,
     )
-    # FUTURE: Delta CRL not supported
-    # delta_days = forms.IntegerField(
-    #     min_value=1,
-    # )
+    # 0 disables delta CRLs
+    delta_days = forms.IntegerField(
+        min_value=0,
+    )
+    # 0 disables partitioned CRLs
+    partitions = forms.IntegerField(
+        min_value=0,
+        max_value=1000,
+    )
     path = forms.CharField(
     )
 
@@ -135,12 +140,12 @@ class CRLStatusView(View):
     form_class = CRLConfigForm
 
     def get_context(self, request):
-        value = Config.get_value(CRL_CONFIG) or json.dumps(new_crl_config())
-        crl_config = json.loads(value)
+        crl_config = get_crl_config()
         initial = {
             'path': crl_config['path'],
             'days': crl_config['days'],
             'delta_days': crl_config['delta_days'],
+            'partitions': crl_config['partitions'],
         }
         context = dict(
             admin.admin_site.each_context(request),
@@ -178,6 +183,9 @@ class CRLStatusView(View):
                     ) + timedelta(days=form.cleaned_data['days'])
                     # Update next_update, even though it's just a note in the admin site
                     context['config']['next_update'] = new_next.timestamp()
+                if 'partitions' in form.changed_data:
+                    # Publish all the partitions again
+                    context['config']['last_update'] = 0
                 value = json.dumps(context['config'])
                 Config.set_value(CRL_CONFIG, value)
                 messages.add_message(
@@ -197,9 +205,8 @@ class CRLRefreshView(View):
         return HttpResponseRedirect(reverse('admin:crl_status'))
 
     def post(self, request, *args, **kwargs):
-        value = Config.get_value(CRL_CONFIG) or json.dumps(new_crl_config())
         try:
-            crl_config = json.loads(value)
+            crl_config = get_crl_config()
             crl_config.update({
                 'last_update': 0
             })
@@ -0,0 +1,371 @@
+"""
+Caches used by the OCSP responder.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from OpenSSL import crypto
+from oscrypto import asymmetric
+
+from webca.certstore import material_cache
+from webca.config import constants as p
+from webca.config.models import ConfigurationObject as Config
+from webca.crypto import utils as crypto_utils
+
+
+class SigningMaterial:
+    """The issuer certificate and the OCSP certificate and key,
+    already loaded as `oscrypto.asymmetric` objects.
+
+    The key is a `webca.certstore.agent.RemoteKey` when the signing
+    agent is used."""
+
+    def __init__(self, issuer_cert, ocsp_cert, ocsp_key):
+        self.issuer_cert = issuer_cert
+        self.ocsp_cert = ocsp_cert
+        self.ocsp_key = ocsp_key
+
+
+def load_signing_material(keysign, ocspsign):
+    """Load the signing material from the certificate stores.
+
+    Arguments
+    ---------
+    `keysign` - value of the CERT_KEYSIGN parameter ('store_id,serial')
+    `ocspsign` - value of the CERT_OCSPSIGN parameter ('store_id,serial')
+    """
+    # TODO: the cert must have the EKU of OCSPSigning and cannot be self signed
+    key_store, keysign_serial = (keysign or ',').split(',')
+    if not keysign_serial:
+        raise ValueError('No CA certificate configured.')
+    ca_x509 = material_cache.get_certificate(key_store, keysign_serial)
+    if not ca_x509:
+        raise ValueError('The CA certificates are not correctly configured.')
+    ca_x509_der = crypto_utils.export_certificate(ca_x509, pem=False)
+    issuer_cert = asymmetric.load_certificate(ca_x509_der)
+
+    key_store, ocspsign_serial = (ocspsign or ',').split(',')
+    if not ocspsign_serial:
+        raise ValueError('No OCSP certificate configured.')
+    ocsp_key = material_cache.get_private_key(key_store, ocspsign_serial)
+    if not ocsp_key:
+        raise ValueError('Cannot find the OCSP key')
+    if isinstance(ocsp_key, crypto.PKey):
+        ocsp_key_der = crypto_utils.export_private_key(ocsp_key, pem=False)
+        ocsp_key = asymmetric.load_private_key(ocsp_key_der)
+    # else the key is held by the signing agent
+
+    ocsp_x509 = material_cache.get_certificate(key_store, ocspsign_serial)
+    if not ocsp_x509:
+        raise ValueError('Cannot find the OCSP certificate')
+    ocsp_x509_der = crypto_utils.export_certificate(ocsp_x509, pem=False)
+    ocsp_cert = asymmetric.load_certificate(ocsp_x509_der)
+
+    return SigningMaterial(issuer_cert, ocsp_cert, ocsp_key)
+
+
+class SignerCache:
+    """Process-wide cache of the OCSP signing material.
+
+    The material is loaded the first time it's needed and it is kept
+    until the value of the CERT_KEYSIGN or CERT_OCSPSIGN parameters changes
+    or the certificate stores are modified.
+    Since the values are compared on every access, changes made by
+    other processes (i.e. the admin site) are noticed too.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._material = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        """Return the current `SigningMaterial`."""
+        key = (
+            Config.get_value(p.CERT_KEYSIGN),
+            Config.get_value(p.CERT_OCSPSIGN),
+            material_cache.get_version(),
+        )
+        with self._lock:
+            if self._material is not None and self._key == key:
+                self.hits += 1
+                return self._material
+        # Load outside the lock so that a slow store doesn't block readers
+        material = load_signing_material(*key[:2])
+        with self._lock:
+            self.misses += 1
+            self._key = key
+            self._material = material
+        return material
+
+    def invalidate(self):
+        """Forget the cached material."""
+        with self._lock:
+            self._key = None
+            self._material = None
+
+    def stats(self):
+        """Return a dictionary with the hit/miss counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+signer_cache = SignerCache()
+
+
+class ResponseCache:
+    """Base class for the caches of signed OCSP responses.
+
+    Responses are stored as DER bytes and are identified by the issuer
+    of the CertId they answer (see `webca.ca_ocsp.responses.cert_id_issuer`)
+    and the serial number of the certificate.
+
+    Evicting a certificate leaves a mark so that a response signed
+    before the eviction, but stored after it, is discarded. The marks
+    are kept for `freshness` seconds, since older responses are not
+    served anyway.
+
+    `shared` tells if the responses stored by a process can be found
+    by the other processes.
+    """
+    shared = False
+
+    def __init__(self, freshness=None):
+        if freshness is None:
+            freshness = settings.OCSP_RESPONSE_FRESHNESS
+        self.freshness = freshness
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(issuer, serial):
+        """Return the (issuer, serial) key as a tuple of strings."""
+        if isinstance(issuer, bytes):
+            issuer = issuer.hex()
+        if isinstance(serial, int):
+            serial = crypto_utils.int_to_hex(serial)
+        return issuer.lower(), serial.lower()
+
+    def is_fresh(self, this_update, next_update, now=None):
+        """Return if a response can still be served without signing it again."""
+        now = now or time.time()
+        return now < this_update + self.freshness and now < next_update
+
+    def get(self, issuer, serial, revoked=None):
+        """Return the DER of a fresh response or None.
+
+        If `revoked` is not None, responses that don't agree with it
+        about the revocation of the certificate are not returned.
+        """
+        key = self.make_key(issuer, serial)
+        entry = self._get(key)
+        if entry is not None:
+            der, this_update, next_update, entry_revoked = entry
+            if (self.is_fresh(this_update, next_update) and
+                    (revoked is None or revoked == entry_revoked)):
+                self.hits += 1
+                return der
+        self.misses += 1
+        return None
+
+    def set(self, issuer, serial, der, this_update, next_update, revoked=False):
+        """Store a signed response.
+
+        `this_update` and `next_update` are the datetimes of the response.
+        `revoked` is whether the response says that the certificate is revoked.
+        The response is not stored if the certificate has been evicted
+        since `this_update`.
+        """
+        key = self.make_key(issuer, serial)
+        self._set(key, (der, this_update.timestamp(), next_update.timestamp(),
+                        bool(revoked)))
+
+    def evict(self, serial):
+        """Remove the responses of the certificate with this `serial`."""
+        _, serial = self.make_key('', serial)
+        self._evict(serial, time.time())
+
+    def stats(self):
+        """Return a dictionary with the hit/miss counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, entry):
+        raise NotImplementedError
+
+    def _evict(self, serial, now):
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove all the responses."""
+        raise NotImplementedError
+
+
+class LRUResponseCache(ResponseCache):
+    """In-memory cache of responses. Each process has its own cache."""
+
+    def __init__(self, size=10000, **kwargs):
+        super().__init__(**kwargs)
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # serial -> set of keys, so that all the responses
+        # for a certificate can be found quickly
+        self._serials = {}
+        # serial -> when it was evicted
+        self._evicted = {}
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _set(self, key, entry):
+        with self._lock:
+            if self._evicted.get(key[1], -1) >= entry[1]:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._serials.setdefault(key[1], set()).add(key)
+            while len(self._entries) > self.size:
+                old_key, _ = self._entries.popitem(last=False)
+                self._discard(old_key)
+
+    def _discard(self, key):
+        keys = self._serials.get(key[1])
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self._serials[key[1]]
+
+    def _evict(self, serial, now):
+        with self._lock:
+            for key in self._serials.pop(serial, set()):
+                self._entries.pop(key, None)
+            self._evicted = {
+                evicted: when
+                for evicted, when in self._evicted.items()
+                if when > now - self.freshness
+            }
+            self._evicted[serial] = now
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._serials.clear()
+            self._evicted.clear()
+
+
+class SQLiteResponseCache(ResponseCache):
+    """Cache of responses stored in a SQLite file.
+
+    The file can be shared by several responder processes so that a
+    response only has to be signed once.
+    """
+    shared = True
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(responses)')]
+            if columns and 'issuer' not in columns:
+                # Made by an older version, the responses are signed again
+                conn.execute('DROP TABLE responses')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'issuer TEXT NOT NULL, '
+                'serial TEXT NOT NULL, '
+                'der BLOB NOT NULL, '
+                'this_update REAL NOT NULL, '
+                'next_update REAL NOT NULL, '
+                'revoked INTEGER NOT NULL, '
+                'PRIMARY KEY (issuer, serial))'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS responses_serial ON responses (serial)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS evictions ('
+                'serial TEXT NOT NULL PRIMARY KEY, '
+                'evicted_at REAL NOT NULL)'
+            )
+            self._local.connection = conn
+        return conn
+
+    def _get(self, key):
+        row = self._connection().execute(
+            'SELECT der, this_update, next_update, revoked FROM responses '
+            'WHERE issuer = ? AND serial = ?', key).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0]), row[1], row[2], bool(row[3])
+
+    def _set(self, key, entry):
+        # A single statement, so that an eviction can't happen in between
+        self._connection().execute(
+            'INSERT OR REPLACE INTO responses '
+            'SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS ('
+            'SELECT 1 FROM evictions WHERE serial = ? AND evicted_at >= ?)',
+            key + entry + (key[1], entry[1]))
+
+    def _evict(self, serial, now):
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT OR REPLACE INTO evictions VALUES (?, ?)', (serial, now))
+            conn.execute('DELETE FROM responses WHERE serial = ?', (serial,))
+            conn.execute(
+                'DELETE FROM evictions WHERE evicted_at <= ?', (now - self.freshness,))
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute('DELETE FROM responses')
+        conn.execute('DELETE FROM evictions')
+
+
+RESPONSE_CACHES = {
+    'lru': LRUResponseCache,
+    'sqlite': SQLiteResponseCache,
+}
+
+_response_cache = None
+
+
+def get_response_cache():
+    """Return the response cache configured in `settings.OCSP_RESPONSE_CACHE`."""
+    global _response_cache
+    if _response_cache is None:
+        options = dict(settings.OCSP_RESPONSE_CACHE)
+        backend = RESPONSE_CACHES[options.pop('BACKEND', 'lru')]
+        kwargs = {name.lower(): value for name, value in options.items()}
+        if backend is not SQLiteResponseCache:
+            kwargs.pop('path', None)
+        else:
+            kwargs.pop('size', None)
+            if not kwargs.get('path'):
+                raise ImproperlyConfigured(
+                    "OCSP_RESPONSE_CACHE needs a PATH with the 'sqlite' backend")
+        _response_cache = backend(**kwargs)
+    return _response_cache
@@ -0,0 +1,175 @@
+"""
+Functions to build signed OCSP responses.
+
+They are used by the responder and by the CA service, which can sign
+the responses in advance.
+"""
+import hashlib
+from datetime import datetime, timedelta
+
+from asn1crypto import core, ocsp
+from asn1crypto.util import timezone
+from django.conf import settings
+from oscrypto import asymmetric
+
+from webca.crypto import constants as c
+from webca.web.models import Certificate
+
+# Missing: revoked, remove_from_crl, privilege_withdrawn
+REASONS = c.REV_REASON_ASN1
+
+SIGN_FUNCTIONS = {
+    'rsa': asymmetric.rsa_pkcs1v15_sign,
+    'dsa': asymmetric.dsa_sign,
+    'ec': asymmetric.ecdsa_sign,
+}
+
+def build_cert_id(signer, serial, hash_algo='sha1'):
+    """Build the `asn1crypto.ocsp.CertId` of a certificate issued by the CA."""
+    issuer = signer.issuer_cert.asn1
+    return ocsp.CertId({
+        'hash_algorithm': {'algorithm': hash_algo},
+        'issuer_name_hash': getattr(issuer.subject, hash_algo),
+        'issuer_key_hash': getattr(issuer.public_key, hash_algo),
+        'serial_number': serial,
+    })
+
+
+def cert_id_issuer(cert_id):
+    """Return everything but the serial number of an `asn1crypto.ocsp.CertId`
+    as a string: the hash algorithm and the issuer name and key hashes.
+
+    Responses are cached by this and the serial number, so a response is
+    only served to requests with the same CertId it was signed for.
+    """
+    return '%s:%s:%s' % (
+        cert_id['hash_algorithm']['algorithm'].native,
+        cert_id['issuer_name_hash'].native.hex(),
+        cert_id['issuer_key_hash'].native.hex(),
+    )
+
+
+def _cert_status(status):
+    """Return the `asn1crypto.ocsp.CertStatus` of a
+    `webca.web.models.CertificateStatus`."""
+    if status.status != Certificate.STATUS_REVOKED:
+        return ocsp.CertStatus(name=status.status, value=core.Null())
+    return ocsp.CertStatus(
+        name='revoked',
+        value={
+            'revocation_time': status.revocation_date,
+            'revocation_reason': REASONS[status.reason],
+        }
+    )
+
+
+def _response_data(signer, answers, this_update):
+    """Return the `asn1crypto.ocsp.ResponseData` about several certificates
+    and its thisUpdate and nextUpdate."""
+    produced_at = datetime.now(timezone.utc)
+    this_update = this_update or produced_at
+    next_update = this_update + timedelta(seconds=settings.OCSP_RESPONSE_VALIDITY)
+    responder_cert = signer.ocsp_cert.asn1
+
+    responses = []
+    for cert_id, status in answers:
+        responses.append({
+            'cert_id': cert_id,
+            'cert_status': _cert_status(status),
+            'this_update': this_update,
+            'next_update': next_update,
+        })
+    response_data = ocsp.ResponseData({
+        'responder_id': ocsp.ResponderId(
+            name='by_key',
+            value=responder_cert.public_key.sha1,
+        ),
+        'produced_at': produced_at,
+        'responses': responses,
+    })
+    return response_data, this_update, next_update
+
+
+def _signed_response(signer, response_data, signature):
+    """Return the DER of the OCSPResponse with `response_data` and its `signature`."""
+    responder_cert = signer.ocsp_cert.asn1
+    issuer_cert = signer.issuer_cert.asn1
+    algorithm = signer.ocsp_key.algorithm
+    if algorithm == 'ec':
+        algorithm = 'ecdsa'
+
+    certs = None
+    if responder_cert.subject != issuer_cert.subject:
+        # Delegated responder: include its certificate
+        certs = [responder_cert]
+
+    response = ocsp.OCSPResponse({
+        'response_status': 'successful',
+        'response_bytes': {
+            'response_type': 'basic_ocsp_response',
+            'response': {
+                'tbs_response_data': response_data,
+                'signature_algorithm': {'algorithm': 'sha256_%s' % algorithm},
+                'signature': signature,
+                'certs': certs,
+            }
+        }
+    })
+    return response.dump()
+
+
+def _sign(signer, datas):
+    """Sign a list of TBS `datas` with the OCSP key.
+
+    If the key is held by the signing agent, they are signed in one request.
+    """
+    key = signer.ocsp_key
+    if hasattr(key, 'sign_digests'):
+        return key.sign_digests([hashlib.sha256(data).digest() for data in datas])
+    sign_func = SIGN_FUNCTIONS[key.algorithm]
+    return [sign_func(key, data, 'sha256') for data in datas]
+
+
+def sign_responses(signer, answers, this_update=None):
+    """Build and sign a successful OCSP response about several certificates.
+
+    All the answers are included in a single BasicOCSPResponse
+    so there is only one signature.
+
+    Arguments
+    ---------
+    `signer` - `webca.ca_ocsp.cache.SigningMaterial`
+    `answers` - list of (`asn1crypto.ocsp.CertId`,
+        `webca.web.models.CertificateStatus`) tuples
+    `this_update` - datetime of the response, now by default
+
+    Returns: a tuple (DER, this_update, next_update)
+    """
+    response_data, this_update, next_update = _response_data(
+        signer, answers, this_update)
+    signature = _sign(signer, [response_data.dump()])[0]
+    return _signed_response(signer, response_data, signature), this_update, next_update
+
+
+def sign_response(signer, cert_id, status, this_update=None):
+    """Build and sign a successful OCSP response about one certificate.
+
+    See `sign_responses`.
+    """
+    return sign_responses(signer, [(cert_id, status)], this_update)
+
+
+def sign_response_batch(signer, answers, this_update=None):
+    """Build and sign one OCSP response for each certificate.
+
+    The signatures are requested at once, so that the signing agent
+    can make them in parallel.
+
+    Returns: a list of (DER, this_update, next_update) in the order of `answers`.
+    """
+    responses = [_response_data(signer, [answer], this_update) for answer in answers]
+    signatures = _sign(signer, [data.dump() for data, _, _ in responses])
+    return [
+        (_signed_response(signer, data, signature), this, next_)
+        for (data, this, next_), signature in zip(responses, signatures)
+    ]
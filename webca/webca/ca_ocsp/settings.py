@@ -4,17 +4,23 @@ from webca.ca_ocsp import settings_local
 # https://www.grc.com/passwords.htm
 SECRET_KEY = 'jZ;{5M0p{t#2<gv+8%6RUK$c`6-ES+zfju>{CKTr.Z.3Tg9(F}u}3\epP4h/n4='
 
-INSTALLED_APPS.append('webca.certstore_db')
+if hasattr(settings_local, 'SIGNING_AGENT_SOCKET'):
+    SIGNING_AGENT_SOCKET = settings_local.SIGNING_AGENT_SOCKET
 
-ROOT_URLCONF = 'webca.ca_ocsp.urls'
-APPEND_SLASH = False
+# With a signing agent the responder reads the certificates and signs
+# through it, so it has no access to the certificate stores.
+if not SIGNING_AGENT_SOCKET:
+    INSTALLED_APPS.append('webca.certstore_db')
 
-DATABASES['certstore_db'] = {
-    'ENGINE': 'django.db.backends.sqlite3',
-    'NAME': os.path.join(BASE_DIR, 'db_certs.sqlite3'),
-}
+    DATABASES['certstore_db'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_certs.sqlite3'),
+    }
 
-DATABASE_ROUTERS = ['webca.certstore_db.CertStoreDBRouter']
+    DATABASE_ROUTERS = ['webca.certstore_db.CertStoreDBRouter']
+
+ROOT_URLCONF = 'webca.ca_ocsp.urls'
+APPEND_SLASH = False
 
 TEMPLATES[0]['DIRS'].append(os.path.join(
     BASE_DIR, 'webca', 'ca_admin', 'templates'))
@@ -29,3 +35,18 @@ if hasattr(settings_local, 'DATABASES'):
 
 if hasattr(settings_local, 'ALLOWED_HOSTS'):
     ALLOWED_HOSTS.extend(settings_local.ALLOWED_HOSTS)
+
+if hasattr(settings_local, 'OCSP_RESPONSE_CACHE'):
+    OCSP_RESPONSE_CACHE.update(settings_local.OCSP_RESPONSE_CACHE)
+
+if hasattr(settings_local, 'CRL_DEBOUNCE'):
+    CRL_DEBOUNCE = settings_local.CRL_DEBOUNCE
+
+if hasattr(settings_local, 'CRL_MIN_INTERVAL'):
+    CRL_MIN_INTERVAL = settings_local.CRL_MIN_INTERVAL
+
+if hasattr(settings_local, 'CONFIG_GENERATION_FILE'):
+    CONFIG_GENERATION_FILE = settings_local.CONFIG_GENERATION_FILE
+
+if hasattr(settings_local, 'REVOCATION_INDEX_INTERVAL'):
+    REVOCATION_INDEX_INTERVAL = settings_local.REVOCATION_INDEX_INTERVAL
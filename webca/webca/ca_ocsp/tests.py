@@ -1,11 +1,38 @@
 """
 Test the OCSP responder.
 """
+import heapq
+import json
+import os
+import tempfile
+import time
 from base64 import b64encode
+from datetime import datetime, timedelta
 from urllib.parse import quote
 
+from asn1crypto import crl as asn1_crl
 from asn1crypto.ocsp import OCSPRequest, OCSPResponse, TBSRequest
-from django.test import TestCase
+from asn1crypto.util import timezone
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from webca.ca_ocsp import cache as response_caches
+from webca.ca_ocsp.cache import (LRUResponseCache, SQLiteResponseCache,
+                                 signer_cache)
+from webca.ca_ocsp.responses import build_cert_id, cert_id_issuer
+from webca.ca_service.presign import REFRESH_AT, ResponsePresigner
+from webca.ca_service.service import CAService, ServiceError
+from webca.config import constants as p
+from webca.config import new_crl_config
+from webca.config.models import ConfigurationObject as Config
+from webca.crypto import certs, crl
+from webca.crypto import constants as c
+from webca.crypto.utils import pad_serial
+from webca.web.models import (Certificate, CRLLocation, Request, Revoked,
+                              Template)
+
+# Cache of responses that doesn't outlive the tests
+THROWAWAY_CACHE = {'BACKEND': 'lru', 'SIZE': 100}
 
 
 def build_request_good():
@@ -54,6 +81,36 @@ def build_request_revoked():
     })
     return ocsp
 
+def build_request_many():
+    tbs_request = TBSRequest({
+        'request_list': [
+            {
+                'req_cert': {
+                    'hash_algorithm': {
+                        'algorithm': 'sha1'
+                    },
+                    'issuer_name_hash': b'379276ADE1846D5A1D184BC135A2D3D23B221DA2',
+                    'issuer_key_hash': b'C7BA089932AE7ABE29D136723E5FF49F480F68F3',
+                    'serial_number': serial,
+                },
+                'single_request_extensions': []
+            }
+            for serial in [
+                221578034377984887419532563643305653706,
+                43335495160811514204812512316928417740,
+                1,
+            ]
+        ],
+        'request_extensions': []
+    })
+    ocsp = OCSPRequest({
+        'tbs_request': tbs_request,
+        'optional_signature': None
+    })
+    return ocsp
+
+
+@override_settings(OCSP_RESPONSE_CACHE=THROWAWAY_CACHE)
 class OCSP(TestCase):
     """Test the OCSP responder."""
     fixtures = [
@@ -63,6 +120,13 @@ class OCSP(TestCase):
     ]
     multi_db = True
 
+    def setUp(self):
+        # Responses signed by other tests are not served
+        response_caches._response_cache = None
+
+    def tearDown(self):
+        response_caches._response_cache = None
+
     def test_get_empty(self):
         """Empty GET."""
         response = self.client.get('/')
@@ -101,3 +165,344 @@ class OCSP(TestCase):
         self.assertEqual(response.status_code, 200)
         ocsp = OCSPResponse.load(response.content)
         self.assertEqual(ocsp.native['response_status'], 'successful')
+
+    def test_post_many(self):
+        """Several certificates are answered in one response."""
+        ocsp = build_request_many()
+        response = self.client.post('/', data=ocsp.dump(), content_type='application/ocsp-request')
+        self.assertEqual(response.status_code, 200)
+        ocsp = OCSPResponse.load(response.content)
+        self.assertEqual(ocsp.native['response_status'], 'successful')
+        responses = ocsp.basic_ocsp_response['tbs_response_data']['responses']
+        self.assertEqual(len(responses), 3)
+        self.assertEqual(responses[2]['cert_id']['serial_number'].native, 1)
+        self.assertEqual(responses[2]['cert_status'].name, 'unknown')
+
+    def test_lookup_status(self):
+        """All the serials are looked up with one query."""
+        with self.assertNumQueries(1):
+            statuses = Certificate.lookup_status([1, 'A1', 'ff'])
+        self.assertEqual(sorted(statuses.keys()), ['1', 'a1', 'ff'])
+        for status in statuses.values():
+            self.assertEqual(status.status, Certificate.STATUS_UNKNOWN)
+            self.assertIsNone(status.der)
+
+    def test_lookup_status_issued(self):
+        """Issued serials are found however they are written."""
+        user = User.objects.create_user('test', 'test@test.net')
+        template = Template.objects.create(
+            name='test', days=1, enabled=True, key_usage=['digitalSignature'])
+        # bulk_create doesn't call save() so no CSR or PEM is needed
+        Request.objects.bulk_create([
+            Request(user=user, subject='/CN=test', template=template)
+            for _ in range(2)
+        ])
+        now = datetime.now(timezone.utc)
+        Certificate.objects.bulk_create([
+            Certificate(user=user, csr=request, subject='/CN=test',
+                        serial='%x' % serial, serial_number=pad_serial(serial),
+                        der=b'\x00', valid_from=now,
+                        valid_to=now + timedelta(days=1))
+            for request, serial in zip(Request.objects.order_by('id'),
+                                       [0xabc, 0xdef0])
+        ])
+        Revoked.objects.create(
+            certificate=Certificate.objects.get(serial='def0'),
+            reason=c.REV_KEYCOMPROMISE)
+        with self.assertNumQueries(1):
+            statuses = Certificate.lookup_status(['ABC', '0000DEF0', 0x123])
+        self.assertEqual(sorted(statuses.keys()), ['123', 'abc', 'def0'])
+        self.assertEqual(statuses['abc'].status, Certificate.STATUS_GOOD)
+        self.assertEqual(statuses['abc'].der, b'\x00')
+        self.assertEqual(statuses['def0'].status, Certificate.STATUS_REVOKED)
+        self.assertEqual(statuses['def0'].reason, c.REV_KEYCOMPROMISE)
+        self.assertEqual(statuses['123'].status, Certificate.STATUS_UNKNOWN)
+        statuses = Certificate.lookup_status([0xabc, 'aBc', '0abc'])
+        self.assertEqual(list(statuses.keys()), ['abc'])
+
+
+class SignerCache(TestCase):
+    """Test the cache of the OCSP signing material."""
+    fixtures = [
+        'config',
+        'certstore_db',
+    ]
+    multi_db = True
+
+    def test_hit(self):
+        """The material is loaded only once."""
+        signer_cache.invalidate()
+        misses = signer_cache.misses
+        hits = signer_cache.hits
+        first = signer_cache.get()
+        second = signer_cache.get()
+        self.assertIs(first, second)
+        self.assertEqual(signer_cache.misses, misses + 1)
+        self.assertEqual(signer_cache.hits, hits + 1)
+
+    def test_config_change(self):
+        """Changing the CERT_* parameters invalidates the cache."""
+        first = signer_cache.get()
+        misses = signer_cache.misses
+        Config.set_value(p.CERT_OCSPSIGN, Config.get_value(p.CERT_KEYSIGN))
+        second = signer_cache.get()
+        self.assertIsNot(first, second)
+        self.assertEqual(signer_cache.misses, misses + 1)
+
+
+class ResponseCache(TestCase):
+    """Test the caches of signed responses."""
+
+    def check_cache(self, cache):
+        now = datetime.now(timezone.utc)
+        later = now + timedelta(days=1)
+        self.assertIsNone(cache.get(b'\x01\x02', 10))
+        cache.set(b'\x01\x02', 10, b'response', now, later)
+        cache.set(b'\x03\x04', 10, b'other', now, later)
+        self.assertEqual(cache.get(b'\x01\x02', 10), b'response')
+        self.assertEqual(cache.get('0102', 'a'), b'response')
+        cache.evict(10)
+        self.assertIsNone(cache.get(b'\x01\x02', 10))
+        self.assertIsNone(cache.get(b'\x03\x04', 10))
+        # Not fresh anymore
+        cache.set(b'\x01\x02', 11, b'response', now - timedelta(hours=2), later)
+        self.assertIsNone(cache.get(b'\x01\x02', 11))
+        # Signed before the eviction but stored after it
+        cache.set(b'\x01\x02', 10, b'response', now, later)
+        self.assertIsNone(cache.get(b'\x01\x02', 10))
+        cache.set(b'\x01\x02', 10, b'response', datetime.now(timezone.utc), later)
+        self.assertEqual(cache.get(b'\x01\x02', 10), b'response')
+        # Responses that don't agree with the revocation status
+        self.assertIsNone(cache.get(b'\x01\x02', 10, revoked=True))
+        self.assertEqual(cache.get(b'\x01\x02', 10, revoked=False), b'response')
+        cache.set(b'\x01\x02', 12, b'revoked', datetime.now(timezone.utc), later,
+                  revoked=True)
+        self.assertEqual(cache.get(b'\x01\x02', 12, revoked=True), b'revoked')
+        self.assertIsNone(cache.get(b'\x01\x02', 12, revoked=False))
+
+    def test_lru(self):
+        """LRU backend."""
+        self.check_cache(LRUResponseCache(freshness=3600))
+
+    def test_lru_size(self):
+        """The least recently used responses are discarded."""
+        cache = LRUResponseCache(size=2, freshness=3600)
+        now = datetime.now(timezone.utc)
+        later = now + timedelta(days=1)
+        cache.set(b'\x01', 1, b'1', now, later)
+        cache.set(b'\x01', 2, b'2', now, later)
+        cache.get(b'\x01', 1)
+        cache.set(b'\x01', 3, b'3', now, later)
+        self.assertIsNone(cache.get(b'\x01', 2))
+        self.assertEqual(cache.get(b'\x01', 1), b'1')
+        self.assertEqual(cache.get(b'\x01', 3), b'3')
+
+    def test_sqlite(self):
+        """SQLite backend."""
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        try:
+            cache = SQLiteResponseCache(path, freshness=3600)
+            self.check_cache(cache)
+            cache._connection().close()
+        finally:
+            os.remove(path)
+
+
+@override_settings(OCSP_RESPONSE_CACHE=THROWAWAY_CACHE)
+class Presigner(TestCase):
+    """Test the OCSP responses signed in advance."""
+    fixtures = [
+        'config',
+        'certstore_db',
+    ]
+    multi_db = True
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.net')
+        self.template = Template.objects.create(
+            name='test', days=1, enabled=True, key_usage=['digitalSignature'])
+        self.certificates = [self.add_certificate() for _ in range(3)]
+        self.presigner = ResponsePresigner(batch=10)
+        self.presigner.cache = LRUResponseCache(freshness=3600)
+        self.signer = signer_cache.get()
+
+    def add_certificate(self):
+        # No CSR or PEM are needed to sign the responses
+        request = Request(user=self.user, subject='/CN=test', template=self.template)
+        Request.objects.bulk_create([request])
+        request = Request.objects.order_by('-id').first()
+        now = datetime.now(timezone.utc)
+        Certificate.objects.bulk_create([
+            Certificate(user=self.user, csr=request, subject='/CN=test',
+                        serial='%x' % (request.id + 0x1000), der=b'\x00',
+                        valid_from=now, valid_to=now + timedelta(days=1))
+        ])
+        return Certificate.objects.get(csr=request)
+
+    def cached(self, certificate, revoked=None, hash_algo='sha1'):
+        cert_id = build_cert_id(self.signer, int(certificate.serial, 16), hash_algo)
+        return self.presigner.cache.get(
+            cert_id_issuer(cert_id), certificate.serial, revoked=revoked)
+
+    def test_load(self):
+        """All the certificates are signed once after loading."""
+        self.presigner.load()
+        self.assertEqual(
+            sorted(self.presigner.scheduled),
+            sorted(cert.serial for cert in self.certificates))
+        self.assertEqual(self.presigner.run(), 3)
+        for certificate in self.certificates:
+            self.assertIsNotNone(self.cached(certificate, revoked=False))
+        self.assertEqual(self.presigner.run(), 0)
+
+    def test_cert_id(self):
+        """Responses are only found with the CertId they were signed for."""
+        self.presigner.run()
+        self.assertIsNone(self.cached(self.certificates[0], hash_algo='sha256'))
+
+    def test_reschedule(self):
+        """Responses are signed again at REFRESH_AT of their freshness."""
+        self.presigner.run()
+        before = time.time()
+        for refresh_at, serial in self.presigner.queue:
+            self.assertEqual(self.presigner.scheduled[serial], refresh_at)
+            self.assertAlmostEqual(
+                refresh_at, before + 3600 * REFRESH_AT, delta=60)
+        # Responses that are never fresh are due right away
+        self.presigner.cache.freshness = 0
+        self.presigner.sign([cert.serial for cert in self.certificates])
+        self.presigner.cache.freshness = 3600
+        self.presigner.batch = 2
+        self.assertEqual(self.presigner.run(), 2)
+        self.assertEqual(self.presigner.run(), 1)
+        self.assertEqual(self.presigner.run(), 0)
+
+    def test_urgent(self):
+        """New certificates and revocations are signed right away."""
+        self.presigner.run()
+        certificate = self.add_certificate()
+        self.assertEqual(self.presigner.run(), 1)
+        self.assertIsNotNone(self.cached(certificate))
+        revoked = Revoked.objects.create(certificate=self.certificates[0])
+        self.assertEqual(self.presigner.run(), 1)
+        self.assertIsNotNone(self.cached(self.certificates[0], revoked=True))
+        # Changing the reason signs the response again
+        revoked.reason = c.REV_KEYCOMPROMISE
+        revoked.save()
+        self.assertEqual(self.presigner.run(), 1)
+        self.assertEqual(self.presigner.run(), 0)
+
+    def test_not_shared(self):
+        """The service refuses to presign into a cache of its own."""
+        previous = response_caches._response_cache
+        response_caches._response_cache = LRUResponseCache()
+        try:
+            with self.settings(OCSP_PRESIGN=True):
+                with self.assertRaises(ServiceError):
+                    CAService()
+        finally:
+            response_caches._response_cache = previous
+
+    def test_next_due(self):
+        """The next due time skips the rescheduled serials."""
+        presigner = ResponsePresigner()
+        self.assertIsNone(presigner.next_due())
+        for refresh_at, serial in [(10, 'a'), (20, 'b'), (30, 'a')]:
+            heapq.heappush(presigner.queue, (refresh_at, serial))
+            presigner.scheduled[serial] = refresh_at
+        self.assertEqual(presigner.next_due(), 20)
+        del presigner.scheduled['b']
+        self.assertEqual(presigner.next_due(), 30)
+
+
+class CRLPublication(TestCase):
+    """Test the CRLs published by the CA service."""
+    fixtures = [
+        'config',
+        'certstore_db',
+    ]
+    multi_db = True
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'ca.crl')
+        CRLLocation.objects.create(url='http://example.com/ca.crl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def publish(self, **options):
+        crl_config = dict(new_crl_config(), path=self.path, **options)
+        Config.set_value(p.CRL_CONFIG, json.dumps(crl_config))
+        CAService().process_crl()
+        with open(crl.der_name(self.path), 'rb') as der:
+            return asn1_crl.CertificateList.load(der.read())
+
+    def test_no_deltas(self):
+        """Without delta CRLs the base CRL doesn't point to them."""
+        self.assertEqual(new_crl_config()['delta_days'], 0)
+        ca_crl = self.publish()
+        self.assertIsNone(ca_crl.freshest_crl_value)
+        self.assertFalse(os.path.exists(crl.delta_name(self.path)))
+
+    def test_deltas(self):
+        """With delta CRLs the base CRL points to them."""
+        ca_crl = self.publish(delta_days=1)
+        self.assertEqual(
+            ca_crl.freshest_crl_value[0]['distribution_point'].chosen[0].native,
+            'http://example.com/ca-delta.crl')
+        self.assertTrue(os.path.exists(crl.delta_name(self.path)))
+
+
+class CRLDistribution(TestCase):
+    """Test the publication of CRLs over HTTP."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'ca.crl')
+        crl_config = new_crl_config()
+        crl_config['path'] = path
+        Config.set_value(p.CRL_CONFIG, json.dumps(crl_config))
+        ca_key, ca_cert = certs.create_ca_certificate([('CN', 'test')], bits=512)
+        crl.write_crl([(1, datetime.now(timezone.utc), 'superseded')], 1,
+                      (ca_cert, ca_key), 1,
+                      der_path=crl.der_name(path), pem_path=path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get(self):
+        """The CRLs are served with their metadata."""
+        response = self.client.get('/crl/ca.der')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pkix-crl')
+        with open(os.path.join(self.directory.name, 'ca.der'), 'rb') as der:
+            content = der.read()
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertTrue(response['Cache-Control'].startswith('public, max-age='))
+        self.assertGreater(int(response['Cache-Control'].split('=')[1]), 3600)
+        response = self.client.get('/crl/ca.crl')
+        self.assertEqual(response['Content-Type'], 'application/x-pem-file')
+
+    def test_conditional(self):
+        """Clients that have the CRL get a 304."""
+        response = self.client.get('/crl/ca.der')
+        etag = response['ETag']
+        response = self.client.get('/crl/ca.der', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get('/crl/ca.der', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            '/crl/ca.der', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_found(self):
+        """Only the published CRLs are served."""
+        self.assertEqual(self.client.get('/crl/ca-delta.crl').status_code, 404)
+        self.assertEqual(self.client.get('/crl/ca.crl.json').status_code, 404)
+        self.assertEqual(os.listdir(self.directory.name).count('ca.crl.json'), 1)
+        # No temporary files are left behind
+        self.assertEqual(len(os.listdir(self.directory.name)), 4)
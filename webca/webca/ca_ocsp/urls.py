@@ -14,9 +14,10 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path
-from webca.ca_ocsp.views import OCSPResponder
+from webca.ca_ocsp.views import CRLView, OCSPResponder
 
 urlpatterns = [
+    path('crl/<str:name>', CRLView.as_view(), name='crl'),
     path('', OCSPResponder.as_view()),
     path('<path:slug>', OCSPResponder.as_view()),
 ]
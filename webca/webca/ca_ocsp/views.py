@@ -1,36 +1,28 @@
 
+import os
+import time
 import traceback
 from base64 import b64decode
-from datetime import datetime
 from urllib.parse import unquote
 import binascii
 
 from asn1crypto.ocsp import OCSPRequest
-from asn1crypto.util import timezone
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
+from django.utils.http import http_date
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from ocspbuilder import OCSPResponseBuilder
-from oscrypto import asymmetric
 
-from webca.certstore import CertStore
-from webca.config import constants as p
+from webca.ca_ocsp.cache import get_response_cache, signer_cache
+from webca.ca_ocsp.responses import cert_id_issuer, sign_responses
+from webca.config import constants as parameters
 from webca.config.models import ConfigurationObject as Config
-from webca.crypto import constants as c
-from webca.crypto import utils as crypto_utils
-from webca.web.models import Certificate, Revoked
-
-# Missing: revoked, remove_from_crl, privilege_withdrawn
-REASONS = {
-    c.REV_UNSPECIFIED: 'revoked',
-    c.REV_KEYCOMPROMISE: 'key_compromise',
-    c.REV_CACOMPROMISE: 'ca_compromise',
-    c.REV_AFFILIATIONCHANGED: 'affiliation_changed',
-    c.REV_SUPERSEDED: 'superseded',
-    c.REV_CESSATIONOFOPERATION: 'cessation_of_operation',
-    c.REV_CERTIFICATEHOLD: 'certificate_hold',
-}
+from webca.crypto import crl
+from webca.crypto.utils import int_to_hex
+from webca.web.models import Certificate
+from webca.web.revocation_index import revocation_index
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -50,40 +42,10 @@ class OCSPResponder(View):
 
     def __init__(self, *args, **kwargs):
         """Setup the signing certificate."""
-        # TODO: the cert must have the EKU of OCSPSigning and cannot be self signed
-        key_store, keysign_serial = Config.get_value(p.CERT_KEYSIGN).split(',')
-        if not keysign_serial:
-            raise ValueError('No CA certificate configured.')
-        store = CertStore.get_store(key_store)
-
-        ca_x509 = store.get_certificate(keysign_serial)
-        if not ca_x509:
-            raise ValueError('The CA certificates are not correctly configured.')
-        ca_x509_der = crypto_utils.export_certificate(ca_x509, pem=False)
-        self.issuer_cert = asymmetric.load_certificate(ca_x509_der)
-
-        # ca_key = store.get_private_key(keysign_serial)
-        # if not ca_key:
-            # raise ValueError('Cannot find the CA key.')
-        # ca_key_der = crypto_utils.export_private_key(ca_key, pem=False)
-        # self.issuer_key = asymmetric.load_private_key(ca_key_der)
-
-        key_store, ocspsign_serial = Config.get_value(p.CERT_OCSPSIGN).split(',')
-        if not ocspsign_serial:
-            raise ValueError('No OCSP certificate configured.')
-        store = CertStore.get_store(key_store)
-
-        ocsp_key = store.get_private_key(ocspsign_serial)
-        if not ocsp_key:
-            raise ValueError('Cannot find the OCSP key')
-        ocsp_key_der = crypto_utils.export_private_key(ocsp_key, pem=False)
-        self.ocsp_key = asymmetric.load_private_key(ocsp_key_der)
-
-        ocsp_x509 = store.get_certificate(ocspsign_serial)
-        if not ocsp_x509:
-            raise ValueError('Cannot find the OCSP certificate')
-        ocsp_x509_der = crypto_utils.export_certificate(ocsp_x509, pem=False)
-        self.ocsp_cert = asymmetric.load_certificate(ocsp_x509_der)
+        super().__init__(*args, **kwargs)
+        # as_view() builds a new responder for every request so the
+        # signing material is kept in a process-wide cache
+        self.signer = signer_cache.get()
 
     def get(self, request, *args, **kwargs):
         """
@@ -148,45 +110,84 @@ class OCSPResponder(View):
         """
         ocsp = OCSPRequest.load(raw)
         # FUTURE: check the issuer key hash to make sure it's for us
-        # FUTURE: responses may be cached too
-        questions = []
-        for request in ocsp.native['tbs_request']['request_list']:
-            serial = request['req_cert']['serial_number']
-            cert = Revoked.objects.filter(certificate__serial=serial).first()
-            if cert:
-                questions.append((serial, cert))
-            else:
-                questions.append((serial, None))
-        if questions:
-            for serial, revoked in questions:
-                # FIXME: We can only respond to one cert, we need to use asn1crypto.ocsp for several responses
-                if not revoked:
-                    cert = Certificate.objects.filter(serial=serial).first()
-                    if not cert:
-                        # FIXME: To return unknown we need to pass the cert details.
-                        # builder = OCSPResponseBuilder('successful', None, 'unknown')
-                        return self._ocsp_error('unauthorized')
-                    else:
-                        der = crypto_utils.export_certificate(cert.get_certificate(), pem=False)
-                        subject_cert = asymmetric.load_certificate(der)
-                        builder = OCSPResponseBuilder('successful', subject_cert, 'good')
-                    # This if there is a OCSP signing certificate
-                else:
-                    der = crypto_utils.export_certificate(revoked.certificate.get_certificate(), pem=False)
-                    subject_cert = asymmetric.load_certificate(der)
-                    revocation_date = revoked.date
-                    reason = REASONS[revoked.reason]
-                    builder = OCSPResponseBuilder('successful', subject_cert, reason, revocation_date)
-                builder.certificate_issuer = self.issuer_cert
-                ocsp_response = builder.build(self.ocsp_key, self.ocsp_cert)
-                # FUTURE: cache this so it doesn't have to be loaded every time
-                return HttpResponse(ocsp_response.dump(), content_type='application/ocsp-response')
-        # Didn't get any serial??
-        return self._ocsp_error('malformed_request')
+        cert_ids = [request['req_cert']
+                    for request in ocsp['tbs_request']['request_list']]
+        if not cert_ids:
+            # Didn't get any serial??
+            return self._ocsp_error('malformed_request')
+        cache = get_response_cache()
+        if len(cert_ids) == 1:
+            cert_id = cert_ids[0]
+            serial = cert_id['serial_number'].native
+            # The revocation may have been evicted in another process only
+            cached = cache.get(cert_id_issuer(cert_id), serial,
+                               revoked=revocation_index.is_revoked(serial))
+            if cached:
+                return self._ocsp_response(cached)
+        # Resolve all the serials at once and answer them in one response
+        serials = [int_to_hex(cert_id['serial_number'].native)
+                   for cert_id in cert_ids]
+        statuses = Certificate.lookup_status(serials)
+        answers = [(cert_id, statuses[serial])
+                   for cert_id, serial in zip(cert_ids, serials)]
+        ocsp_response, this_update, next_update = sign_responses(
+            self.signer, answers)
+        status = answers[0][1]
+        if len(cert_ids) == 1 and status.status != Certificate.STATUS_UNKNOWN:
+            cache.set(cert_id_issuer(cert_ids[0]), status.serial,
+                      ocsp_response, this_update, next_update,
+                      revoked=status.status == Certificate.STATUS_REVOKED)
+        return self._ocsp_response(ocsp_response)
+
+    def _ocsp_response(self, der):
+        """Return an HttpResponse with the DER of an OCSPResponse."""
+        return HttpResponse(der, content_type='application/ocsp-response')
 
     def _ocsp_error(self, error):
         """Return an `error` OCSPResponse."""
         # print('OCSP Responder error: %s' % error)
         builder = OCSPResponseBuilder(error)
         ocsp_response = builder.build()#self.ocsp_key, self.ocsp_cert)
-        return HttpResponse(ocsp_response.dump(), content_type='application/ocsp-response')
+        return self._ocsp_response(ocsp_response.dump())
+
+
+class CRLView(View):
+    """Serve the CRLs published by the CA service.
+
+    Only the files that have metadata are served, that is, the CRLs in
+    the export directory. The metadata has the ETag and dates of the
+    CRL so clients that already have it get a 304 and caches can keep
+    it until nextUpdate.
+    """
+
+    def get(self, request, name):
+        crl_config = Config.get_json(parameters.CRL_CONFIG)
+        if not crl_config or name.startswith('.'):
+            raise Http404
+        directory = os.path.dirname(crl_config['path'])
+        path = os.path.join(directory, name)
+        metadata = crl.read_metadata(path)
+        if metadata is None:
+            raise Http404
+        try:
+            crl_file = open(path, 'rb')
+        except OSError:
+            raise Http404
+        length = os.fstat(crl_file.fileno()).st_size
+        if length != metadata['length']:
+            # A new CRL was published between both reads
+            metadata = crl.read_metadata(path) or metadata
+        etag = '"%s"' % metadata['etag']
+        last_modified = int(metadata['this_update'])
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = FileResponse(crl_file, content_type=metadata['content_type'])
+            response['Content-Length'] = length
+        else:
+            crl_file.close()
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        max_age = max(0, int(metadata['next_update'] - time.time()))
+        response['Cache-Control'] = 'public, max-age=%d' % max_age
+        return response
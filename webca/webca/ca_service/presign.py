@@ -0,0 +1,117 @@
+"""
+Sign OCSP responses in advance so that the responder only has to look them up.
+"""
+import heapq
+import time
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from webca.ca_ocsp.cache import get_response_cache, signer_cache
+from webca.ca_ocsp.responses import (build_cert_id, cert_id_issuer,
+                                     sign_response_batch)
+from webca.web.models import Certificate, RevocationCursor, Revoked
+
+# Refresh a response when this fraction of its freshness window has passed
+REFRESH_AT = 0.8
+
+
+class ResponsePresigner:
+    """Keep a signed response in the response cache for every
+    certificate that has not expired.
+
+    Responses are signed in rolling batches of `batch` certificates.
+    Each one is scheduled to be signed again before it stops being
+    fresh in the cache. Newly issued and revoked certificates are
+    signed as soon as they are found, and so are the revocations that
+    are saved again, e.g. to change their reason.
+    """
+
+    def __init__(self, batch=None):
+        self.batch = batch or settings.OCSP_PRESIGN_BATCH
+        self.cache = get_response_cache()
+        # Heap of (refresh_at, serial). An entry is stale if `scheduled`
+        # has a different time for the serial.
+        self.queue = []
+        self.scheduled = {}
+        self.last_certificate = 0
+        self.revocations = RevocationCursor()
+        self.loaded = False
+
+    def load(self):
+        """Schedule all the certificates that have not expired."""
+        now = timezone.now()
+        self.queue = []
+        self.scheduled = {}
+        certificates = Certificate.objects.filter(valid_to__gt=now)
+        for cert_id, serial in certificates.values_list('id', 'serial'):
+            self.queue.append((0, serial))
+            self.scheduled[serial] = 0
+            self.last_certificate = max(self.last_certificate, cert_id)
+        heapq.heapify(self.queue)
+        last = Revoked.objects.aggregate(last=Max('sequence'))['last'] or 0
+        self.revocations = RevocationCursor()
+        self.revocations.skip(Revoked.objects.all(), last)
+        self.loaded = True
+
+    def run(self):
+        """Sign the responses that are due. Return how many were signed."""
+        if not self.loaded:
+            self.load()
+        # New certificates and revocations first
+        urgent = set()
+        for cert_id, serial in Certificate.objects.filter(
+                id__gt=self.last_certificate).values_list('id', 'serial'):
+            urgent.add(serial)
+            self.last_certificate = max(self.last_certificate, cert_id)
+        for serial, _ in self.revocations.read(
+                Revoked.objects.all(), 'certificate__serial'):
+            urgent.add(serial)
+        # Then a batch of the responses that have to be refreshed
+        now = time.time()
+        due = set()
+        while self.queue and self.queue[0][0] <= now and len(due) < self.batch:
+            refresh_at, serial = heapq.heappop(self.queue)
+            if self.scheduled.get(serial) == refresh_at:
+                del self.scheduled[serial]
+                due.add(serial)
+        serials = urgent | due
+        if serials:
+            self.sign(serials)
+        return len(serials)
+
+    def next_due(self):
+        """Return the time when the next response has to be signed,
+        or None if there is none scheduled."""
+        while self.queue:
+            refresh_at, serial = self.queue[0]
+            if self.scheduled.get(serial) == refresh_at:
+                return refresh_at
+            # A stale entry
+            heapq.heappop(self.queue)
+        return None
+
+    def sign(self, serials):
+        """Sign and store the responses for a list of `serials`."""
+        signer = signer_cache.get()
+        now = timezone.now()
+        certificates = Certificate.objects.filter(
+            serial__in=serials,
+            valid_to__gt=now,
+        ).select_related('revoked')
+        certificates = list(certificates)
+        cert_ids = [build_cert_id(signer, int(cert.serial, 16))
+                    for cert in certificates]
+        responses = sign_response_batch(signer, [
+            (cert_id, cert.get_status())
+            for cert_id, cert in zip(cert_ids, certificates)
+        ])
+        for cert_id, cert, (der, this_update, next_update) in zip(
+                cert_ids, certificates, responses):
+            self.cache.set(cert_id_issuer(cert_id), cert.serial, der,
+                           this_update, next_update, revoked=cert.is_revoked)
+            refresh_at = (this_update.timestamp() +
+                          self.cache.freshness * REFRESH_AT)
+            heapq.heappush(self.queue, (refresh_at, cert.serial))
+            self.scheduled[cert.serial] = refresh_at
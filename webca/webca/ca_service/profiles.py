@@ -0,0 +1,206 @@
+"""
+Compiled issuance profiles.
+
+A profile has everything the CA service needs from a template to issue
+a certificate: its extensions already encoded, the CDP and AIA
+extensions and the key requirements. Profiles are compiled once and
+kept until the template, the CRL locations or the OCSP URL change.
+"""
+import threading
+import uuid
+
+from OpenSSL import crypto
+
+from webca.config import constants as parameters
+from webca.config.models import ConfigurationObject as Config
+from webca.crypto import constants as c
+from webca.crypto import crl
+from webca.crypto import extensions as crypto_extensions
+from webca.web.models import CRLLocation, CRLPointSet
+
+KEY_TYPES = [c.KEY_RSA, c.KEY_DSA, c.KEY_EC]
+
+
+def encode_extension(extension):
+    """Return a X509Extension as a tuple (name, critical, DER of the value)."""
+    return (
+        extension.get_short_name(),
+        bool(extension.get_critical()),
+        extension.get_data(),
+    )
+
+
+def decode_extension(encoded):
+    """Return the X509Extension of a tuple made by `encode_extension`."""
+    name, critical, der = encoded
+    return crypto.X509Extension(name, critical, b'DER:' + der.hex().encode('ascii'))
+
+
+class IssuanceProfile:
+    """The compiled issuance settings of a template.
+
+    The extensions are kept DER encoded, so that the profile can be
+    sent to the workers of the service, and decoded once in each
+    process. The same X509Extension can be added to any number of
+    certificates.
+
+    `key` is set by `ProfileCache` to the inputs the profile was
+    compiled from.
+    """
+
+    def __init__(self, template, locations, point_set_id, ocsp_url):
+        self.key = None
+        self.template_id = template.id
+        self.version = template.version
+        self.encoded = [encode_extension(ext) for ext in template.get_extensions()]
+        self.key_types = template.allowed_key_types()
+        self.min_bits = {key_type: template.min_bits_for(key_type)
+                         for key_type in KEY_TYPES}
+        self.locations = list(locations)
+        self.point_set_id = point_set_id
+        self.ocsp_url = ocsp_url
+        self.encoded_aia = None
+        if ocsp_url:
+            self.encoded_aia = encode_extension(crypto_extensions.build_aia(ocsp_url))
+        self._lock = threading.Lock()
+        self._extensions = None
+        self._aia = None
+        self._cdp = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_extensions'] = None
+        state['_aia'] = None
+        state['_cdp'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def allowed_key_types(self):
+        """Same as `Template.allowed_key_types`."""
+        return self.key_types
+
+    def min_bits_for(self, key_type):
+        """Same as `Template.min_bits_for`."""
+        return self.min_bits.get(key_type, self.min_bits[c.KEY_EC])
+
+    def get_extensions(self):
+        """Return a new list with the extensions of the template."""
+        if self._extensions is None:
+            self._extensions = [decode_extension(ext) for ext in self.encoded]
+        return list(self._extensions)
+
+    def get_cdp(self, partition=None):
+        """Return the CRLDistributionPoints extension, or None if there
+        are no CRL locations.
+
+        If `partition` is not None, it points to that partitioned CRL.
+        """
+        if not self.locations:
+            return None
+        with self._lock:
+            if partition not in self._cdp:
+                urls = self.locations
+                if partition is not None:
+                    urls = [crl.partition_name(url, partition) for url in urls]
+                self._cdp[partition] = crypto_extensions.build_cdp(urls)
+            return self._cdp[partition]
+
+    def get_aia(self):
+        """Return the AuthorityInfoAccess extension or None if there is no OCSP URL."""
+        if self.encoded_aia is None:
+            return None
+        if self._aia is None:
+            self._aia = decode_extension(self.encoded_aia)
+        return self._aia
+
+
+class ProfileCache:
+    """Process-wide cache of the compiled profiles.
+
+    Profiles are keyed by (template id, template version, version of
+    the CRL locations, OCSP URL). The version of the locations is a
+    configuration parameter that changes every time a location is saved
+    (see `webca.web.signals`), so it's read from the configuration cache
+    without queries.
+
+    The service compiles the profiles and sends them to its workers
+    with the requests (see `add`), so they are compiled only once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._locations = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def locations_version():
+        """Return the current version of the CRL locations."""
+        return Config.get_value(parameters.CRL_LOCATIONS_VERSION)
+
+    def get_locations(self, version):
+        """Return (list of URLs, CRLPointSet id) of the current CRL locations."""
+        with self._lock:
+            if self._locations is not None and self._locations[0] == version:
+                return self._locations[1]
+        locations = list(CRLLocation.get_locations())
+        point_set = CRLPointSet.for_locations(locations)
+        value = (
+            [location.url for location in locations],
+            point_set.id if point_set else None,
+        )
+        with self._lock:
+            self._locations = (version, value)
+        return value
+
+    def get(self, template, ocsp_url=''):
+        """Return the `IssuanceProfile` of `template`."""
+        version = self.locations_version()
+        key = (template.id, template.version, version, ocsp_url)
+        with self._lock:
+            entry = self._profiles.get(template.id)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+        locations, point_set_id = self.get_locations(version)
+        profile = IssuanceProfile(template, locations, point_set_id, ocsp_url)
+        profile.key = key
+        with self._lock:
+            self.misses += 1
+            self._profiles[template.id] = (key, profile)
+        return profile
+
+    def add(self, profile):
+        """Keep a profile compiled by another process.
+
+        It's used by `get` only if its inputs haven't changed since.
+        """
+        with self._lock:
+            self._profiles[profile.template_id] = (profile.key, profile)
+
+    def invalidate(self):
+        """Forget the profiles of this process."""
+        with self._lock:
+            self._profiles = {}
+            self._locations = None
+
+    def locations_changed(self):
+        """Tell every process that the CRL locations have changed."""
+        self.invalidate()
+        Config.set_value(parameters.CRL_LOCATIONS_VERSION, uuid.uuid4().hex)
+
+    def stats(self):
+        """Return a dictionary with the hit/miss counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'profiles': len(self._profiles),
+        }
+
+
+profile_cache = ProfileCache()
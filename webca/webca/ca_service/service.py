@@ -4,27 +4,32 @@ Implementation of the CA service.
 import json
 import time
 import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 
 import pytz
+from django import db
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Max, Q
 from django.utils import timezone
 from OpenSSL import crypto
 
 from webca import utils as ca_utils
-from webca.certstore import CertStore
+from webca.utils import notify
+from webca.ca_service import workers
+from webca.ca_service.presign import ResponsePresigner
+from webca.ca_service.profiles import profile_cache
+from webca.certstore import material_cache
 from webca.config import constants as parameters
-from webca.config import new_crl_config
+from webca.config import get_crl_config, new_crl_config
 from webca.config.models import ConfigurationObject as Config
 from webca.crypto import utils as cert_utils
 from webca.crypto import certs, crl
-from webca.crypto.constants import REV_REASON
+from webca.crypto.constants import REV_REASON_ASN1
 from webca.crypto import extensions as crypto_extensions
-from webca.web.models import (Certificate, CRLLocation, Request, Revoked,
-                              Template)
-
-SLEEP = 1
+from webca.web.models import (Certificate, Counter, CRLLocation, Request,
+                              RevocationCursor, Revoked, Template)
 
 class ServiceError(Exception):
     pass
@@ -37,53 +42,116 @@ class CAService:
     # Initialization and service
 
     #pylint: disable=w0613
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, worker=False, **kwargs):
+        """`worker` is True in the processes of the issuance pool."""
         # Get the current certificates
+        self.certificates_config = None
         self.refresh_certificates()
+        self.presigner = None
+        self.pool = None
+        # Revoked entries of the base CRL, kept between CRLs
+        # The entries are loaded again when revocations are deleted,
+        # so the number of deletions they were loaded with is kept.
+        self.crl_entries = None
+        self.crl_cursor = None
+        self.crl_deletions = 0
+        # Revoked entries of each partitioned CRL
+        self.partition_entries = None
+        self.partition_cursor = None
+        self.partition_deletions = 0
+        # Revocations waiting to be published, see _revocations_due
+        self.pending_cursor = None
+        self.pending_deletions = 0
+        self.pending = False
+        self.pending_since = 0
+        self.pending_changed_at = 0
+        self.published_at = 0
+        if worker:
+            return
+        if settings.OCSP_PRESIGN:
+            self.presigner = ResponsePresigner()
+            if not self.presigner.cache.shared:
+                # The responder would never see the responses
+                raise ServiceError(
+                    'OCSP_PRESIGN needs a response cache shared with the '
+                    'responder, like the sqlite backend.')
+        if settings.CA_SERVICE_WORKERS:
+            self.pool = self._new_pool()
+
+    @staticmethod
+    def _new_pool():
+        return ProcessPoolExecutor(
+            max_workers=settings.CA_SERVICE_WORKERS,
+            initializer=workers.init_worker,
+        )
 
     def refresh_certificates(self):
-        """Set up the signing certificates."""
-        key_store, keysign_serial = Config.get_value(
-            parameters.CERT_KEYSIGN).split(',')
-        crl_store, crlsign_serial = Config.get_value(
-            parameters.CERT_KEYSIGN).split(',')
-        csr_store, csrsign_serial = Config.get_value(
-            parameters.CERT_CSRSIGN).split(',')
-
-        if not keysign_serial or not crlsign_serial or not csrsign_serial:
+        """Set up the signing certificates.
+
+        They are only loaded again if CERT_KEYSIGN has changed or if
+        the certificate stores have been modified. The parsed objects
+        are shared through `material_cache`.
+        """
+        config = Config.get_value(parameters.CERT_KEYSIGN)
+        version = (config, material_cache.get_version())
+        if version == self.certificates_config:
+            return
+        key_store, keysign_serial = config.split(',')
+        crl_store, crlsign_serial = config.split(',')
+
+        if not keysign_serial or not crlsign_serial:
             self.fatal_error('No CA certificates configured.')
-        store = CertStore.get_store(key_store)
         self.certsign = (
-            store.get_certificate(keysign_serial),
-            store.get_private_key(keysign_serial),
+            material_cache.get_certificate(key_store, keysign_serial),
+            material_cache.get_private_key(key_store, keysign_serial),
         )
-        store = CertStore.get_store(crl_store)
         self.crlsign = (
-            store.get_certificate(crlsign_serial),
-            store.get_private_key(crlsign_serial),
-        )
-        store = CertStore.get_store(csr_store)
-        self.csrsign = (
-            store.get_certificate(csrsign_serial),
-            store.get_private_key(csrsign_serial),
+            material_cache.get_certificate(crl_store, crlsign_serial),
+            material_cache.get_private_key(crl_store, crlsign_serial),
         )
-        if not self.certsign[0] or not self.crlsign[0] or not self.csrsign[0]:
+        if not self.certsign[0] or not self.crlsign[0]:
             raise ServiceError('The CA certificates are not correctly configured.')
+        self.certificates_config = version
 
     def run(self):
         """Start the service."""
         try:
             print('CA service started')
+            self.release_stale_claims()
             self._run()
         except KeyboardInterrupt:
             print('Exiting...')
 
     def _run(self):
-        """Really run the service."""
-        while True:
-            time.sleep(SLEEP)
-            self.process_requests()
-            self.process_crl()
+        """Really run the service.
+
+        The service sleeps until it's notified that there is something
+        to do. If there are no notifications, it polls the database
+        with an interval that grows while it is idle.
+        """
+        listener = notify.Listener()
+        delay = settings.CA_SERVICE_POLL_MIN
+        try:
+            while True:
+                events = listener.wait(delay)
+                issued = self.process_requests()
+                self.process_crl()
+                signed = self.process_ocsp()
+                if events or issued or signed:
+                    delay = settings.CA_SERVICE_POLL_MIN
+                else:
+                    delay = min(delay * 2, settings.CA_SERVICE_POLL_MAX)
+                if self.pending:
+                    # Don't miss the end of the debounce window
+                    delay = min(delay, settings.CRL_DEBOUNCE)
+                next_due = self.presigner and self.presigner.next_due()
+                if next_due is not None:
+                    # Nor the responses that have to be signed again
+                    delay = max(min(delay, next_due - time.time()), 0)
+        finally:
+            listener.close()
+            if self.pool:
+                self.pool.shutdown()
 
     # Output and control
 
@@ -94,17 +162,105 @@ class CAService:
 
     # The stuff
 
+    def release_stale_claims(self):
+        """Issue again the requests left by a service that stopped."""
+        released = Request.release_stale(settings.CA_SERVICE_CLAIM_TIMEOUT)
+        if released:
+            print('Released %d stale requests' % released)
+
+    def _issue_failed(self, request_id):
+        """Mark a request as failed with the exception being handled."""
+        request = Request.objects.get(pk=request_id)
+        request.status = Request.STATUS_ERROR
+        error = traceback.format_exc().replace(settings.BASE_DIR, '')
+        request.admin_comment = 'Error issuing the certificate:\n%s' % error
+        request.save()
+
     def process_requests(self):
-        """Process a list of requests that have been approved."""
-        requests = Request.objects.filter(self.pending_requests)
+        """Process a list of requests that have been approved.
+
+        Each request is claimed before it's issued so that several
+        services can run at the same time. If there is a pool of
+        workers, the requests are issued in parallel.
+
+        Returns the number of requests processed.
+        """
+        requests = Request.objects.filter(
+            self.pending_requests).select_related('template')
+        if self.pool:
+            return self._process_parallel(requests)
         if requests:
             self.refresh_certificates()
+        count = 0
         for request in requests:
+            if not Request.claim(request.id):
+                continue
+            request.status = Request.STATUS_ISSUING
             print('Got a certificate request ({})!'.format(request.id))
             try:
                 self._process_request(request)
-            except Exception as ex:
-                raise ex
+            except Exception:
+                print('error!')
+                self._issue_failed(request.id)
+            count += 1
+        return count
+
+    def _process_parallel(self, requests):
+        """Issue a list of requests in the pool of workers."""
+        claimed = [request for request in requests
+                   if Request.claim(request.id)]
+        if not claimed:
+            return 0
+        print('Issuing %d requests' % len(claimed))
+        # The profiles are compiled here once and sent to the workers
+        profiles = {}
+        for request in claimed:
+            try:
+                profiles[request.id] = self.get_profile(request.template)
+            except Exception:
+                self._issue_failed(request.id)
+        # New workers are forked when requests are submitted
+        # so they must not inherit the open connections.
+        # The notifications have a connection of their own.
+        db.connections.close_all()
+        futures = {}
+        broken = False
+        try:
+            for request_id, profile in profiles.items():
+                future = self.pool.submit(workers.issue_request, request_id, profile)
+                futures[future] = request_id
+        except BrokenProcessPool:
+            # A worker died. The requests not submitted are issued later.
+            broken = True
+            Request.release(set(profiles) - set(futures.values()))
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except BrokenProcessPool:
+                broken = True
+                self._issue_failed(futures[future])
+            except Exception:
+                self._issue_failed(futures[future])
+        if broken:
+            self.pool.shutdown(wait=False)
+            self.pool = self._new_pool()
+        return len(claimed)
+
+    def issue(self, request_id, profile=None):
+        """Issue a request that has been claimed by this service.
+
+        `profile` is the `IssuanceProfile` of its template if it was
+        compiled by another process.
+        """
+        if profile is not None:
+            profile_cache.add(profile)
+        self.refresh_certificates()
+        self._process_request(
+            Request.objects.select_related('template').get(pk=request_id))
+
+    def get_profile(self, template):
+        """Return the compiled `IssuanceProfile` of `template`."""
+        return profile_cache.get(template, settings.OCSP_URL)
 
     def _process_request(self, request):
         """To process a request we have to:
@@ -129,7 +285,8 @@ class CAService:
         pub_key = request.get_csr().get_pubkey()
         subject = cert_utils.name_to_components(request.subject)
         # Get the fixed extensions from the template
-        extensions = request.template.get_extensions()
+        profile = self.get_profile(request.template)
+        extensions = profile.get_extensions()
         # If the template is for user certificates, then modify the subject
         if request.template.required_subject == Template.SUBJECT_USER:
             d = ca_utils.tuples_as_dict(subject)
@@ -147,19 +304,24 @@ class CAService:
         if san:
             ext = crypto_extensions.build_san(','.join(san))
             extensions.append(ext)
+        serial = cert_utils.new_serial()
         # Now build the CDP extension.
-        crl_locations = CRLLocation.get_locations()
-        if crl_locations:
-            ext = crypto_extensions.build_cdp(crl_locations.values_list('url', flat=True))
-            extensions.append(ext)
+        # If CRLs are partitioned, it points to the partition of the certificate
+        crl_config = self.get_crl_config() or new_crl_config()
+        partition = None
+        if crl_config['partitions']:
+            partition = crl.serial_partition(serial, crl_config['partitions'])
+        cdp = profile.get_cdp(partition)
+        if cdp is not None:
+            extensions.append(cdp)
         # Add the OCSP extension
-        if settings.OCSP_URL:
-            ext = crypto_extensions.json_to_extension('{"name":"authorityInfoAccess", "critical":false, "value":"OCSP;URI:%s"}' % settings.OCSP_URL)
-            extensions.append(ext)
+        aia = profile.get_aia()
+        if aia is not None:
+            extensions.append(aia)
         # Validate stuff
         # Key size. Template requirements might have changed since the request was done
         key_type = cert_utils.public_key_type(request.get_csr())
-        min_bits = request.template.min_bits_for(key_type)
+        min_bits = profile.min_bits_for(key_type)
 
         if pub_key.bits() < min_bits:
             # The request at this point will never meet the template minimum
@@ -173,27 +335,14 @@ class CAService:
             return
 
         # New stuff
-        serial = cert_utils.new_serial()
         valid_from = 0
         valid_to = int(timedelta(days=request.template.days).total_seconds())
-        # Generate CSR and then the certificate
+        # Build the certificate
         try:
-            new_csr = certs.create_cert_request(
+            x509 = certs.create_certificate_from_parts(
                 pub_key,
-                name=subject,
-                extensions=extensions,
-                signing_key=self.csrsign[1]
-            )
-        except crypto.Error as ex:
-            print('error!')
-            request.status = Request.STATUS_ERROR
-            error = traceback.format_exc().replace(settings.BASE_DIR, '')
-            request.admin_comment = 'Error creating internal CSR:\n%s' % error
-            request.save()
-            return
-        try:
-            x509 = certs.create_certificate(
-                new_csr,
+                subject,
+                extensions,
                 self.certsign,
                 serial,
                 (valid_from, valid_to)
@@ -211,74 +360,313 @@ class CAService:
         certificate.user = request.user
         certificate.csr = request
         certificate.x509 = cert_utils.export_certificate(x509)
-        certificate.serial = serial
+        certificate.serial = cert_utils.int_to_hex(serial)
         certificate.subject = cert_utils.components_to_name(subject)
         certificate.valid_from = datetime.now(pytz.utc)
         certificate.valid_to = (datetime.now(pytz.utc) +
                                 timedelta(days=request.template.days))
+        certificate.crl_partition = partition
+        certificate.crl_points_id = profile.point_set_id
         certificate.save()
         # Update the request
         request.status = Request.STATUS_ISSUED
         request.save()
-        # Update the CRL locations
-        for location in crl_locations:
-            location.certificates.add(certificate)
-            location.save()
         print('done')
 
-    def process_crl(self):
-        """Check if there is a CRL to sign."""
-        value = Config.get_value(
-            parameters.CRL_CONFIG) or json.dumps(new_crl_config())
+    def get_crl_config(self):
+        """Return the CRL configuration or None if it can't be loaded."""
         try:
-            crl_config = json.loads(value)
-        except json.decoder.JSONDecodeError as exc:
+            return get_crl_config()
+        except ValueError as exc:
             # This should not happen
             print('Error loading CRL config!! -> %s' % exc)
+            return None
+
+    def process_crl(self):
+        """Check if there is a CRL to sign."""
+        crl_config = self.get_crl_config()
+        if crl_config is None:
             return
         now = timezone.now()
-        next = now - timedelta(days=1)
-        if crl_config['last_update']:
-            next = datetime.fromtimestamp(crl_config['last_update'], pytz.utc)
-            next += timedelta(days=crl_config['days'])
+        # New revocations are published without waiting for the next CRL
+        revocations = self._revocations_due(
+            self.read_new_revocations(crl_config), now)
         # TODO: handle errors, should we keep trying?
-        if now > next:
+        # A base CRL is needed before the first delta CRL
+        missing_base = crl_config['delta_days'] and not crl_config['base_number']
+        base_due = missing_base or self._crl_due(
+            crl_config['last_update'], crl_config['days'], now)
+        if base_due or (revocations and not crl_config['delta_days']):
             print('CRL time!')
-            # Refresh signing certificates
-            self.refresh_certificates()
-            # Get CRL signing certificate
-            crl_cert, crl_key = self.crlsign
-            # Get Revoked certificates
-            # TODO: should it be filtered with certs only signed by the current certificate?
-            revoked_list = [
-                (int(r.certificate.serial, 16), r.date, REV_REASON[r.reason])
-                for r in Revoked.objects.all()
-            ]
-            # Build CRL
-            x509crl = crl.create_crl(
-                revoked_list,
+            self.publish_crl(crl_config, now)
+            if crl_config['delta_days']:
+                self.publish_delta_crl(crl_config, now)
+            self.publish_partitions(crl_config, now, everything=base_due)
+            self._crl_published(crl_config, now)
+            print('CRL done')
+            return
+        if (crl_config['delta_days'] and
+                (revocations or
+                 self._crl_due(crl_config['delta_last_update'],
+                               crl_config['delta_days'], now))):
+            print('Delta CRL time!')
+            self.publish_delta_crl(crl_config, now)
+            if revocations:
+                self.publish_partitions(crl_config, now)
+            self._crl_published(crl_config, now)
+            print('Delta CRL done')
+
+    def read_new_revocations(self, crl_config):
+        """Return how many revocations have been saved or deleted since
+        the last call.
+
+        The first time, the revocations up to the last one published
+        (`last_sequence`) are taken as read.
+        """
+        deletions = Counter.get_value(Counter.REVOCATION_DELETIONS)
+        new = 0
+        if self.pending_cursor is None:
+            self.pending_deletions = crl_config['last_deletions']
+            self.pending_cursor = RevocationCursor()
+            self.pending_cursor.skip(
+                Revoked.objects.all(), crl_config['last_sequence'])
+        if deletions != self.pending_deletions:
+            new += deletions - self.pending_deletions
+            self.pending_deletions = deletions
+        return new + len(self.pending_cursor.read(Revoked.objects.all()))
+
+    def _revocations_due(self, new, now):
+        """Return if there are revocations that have to be published now.
+
+        `new` is the number of revocations seen since the last call.
+        Revocations usually come in bursts, so they are published once
+        none has been seen for `CRL_DEBOUNCE` seconds, or after
+        `CRL_MIN_INTERVAL` seconds if they keep coming. The CRLs are not
+        published because of revocations more often than every
+        `CRL_MIN_INTERVAL` seconds.
+        """
+        now = now.timestamp()
+        if new:
+            if not self.pending:
+                self.pending = True
+                self.pending_since = now
+            self.pending_changed_at = now
+        if not self.pending:
+            return False
+        if now - self.published_at < settings.CRL_MIN_INTERVAL:
+            return False
+        return (now - self.pending_changed_at >= settings.CRL_DEBOUNCE or
+                now - self.pending_since >= settings.CRL_MIN_INTERVAL)
+
+    def _crl_published(self, crl_config, now):
+        """Save the CRL configuration after publishing CRLs with the
+        revocations read by `read_new_revocations`."""
+        if self.pending_cursor is not None:
+            crl_config['last_sequence'] = self.pending_cursor.sequence
+            crl_config['last_deletions'] = self.pending_deletions
+        Config.set_value(parameters.CRL_CONFIG, json.dumps(crl_config))
+        self.pending = False
+        self.published_at = now.timestamp()
+
+    def _crl_due(self, last_update, days, now):
+        """Return if a CRL published at `last_update` has to be published again."""
+        if not last_update:
+            return True
+        next_update = datetime.fromtimestamp(last_update, pytz.utc)
+        next_update += timedelta(days=days)
+        return now > next_update
+
+    def _add_revocations(self, entries, cursor, revocations):
+        """Add the revocations of a queryset that `cursor` has not read
+        to a `crl.RevokedEntries`."""
+        for serial, valid_to, date, reason, _ in cursor.read(
+                revocations, 'certificate__serial', 'certificate__valid_to',
+                'date', 'reason'):
+            entries.add(int(serial, 16), date, REV_REASON_ASN1[reason], valid_to)
+        entries.sequence = cursor.sequence
+
+    def update_crl_entries(self, now):
+        """Bring the revoked entries of the base CRL up to date.
+
+        Only the revocations made since the last CRL are encoded.
+        If revocations have been deleted, all of them are loaded again.
+        """
+        entries = self.crl_entries
+        deletions = Counter.get_value(Counter.REVOCATION_DELETIONS)
+        if entries is None or deletions != self.crl_deletions:
+            entries = self.crl_entries = crl.RevokedEntries()
+            self.crl_cursor = RevocationCursor()
+            self.crl_deletions = deletions
+        self._add_revocations(entries, self.crl_cursor, Revoked.objects.all())
+        entries.drop_expired(now)
+        return entries
+
+    def publish_crl(self, crl_config, now):
+        """Sign and export a base CRL with all the revocations.
+
+        `crl_config` is updated but not saved.
+        """
+        # Refresh signing certificates
+        self.refresh_certificates()
+        # Get Revoked certificates
+        # TODO: should it be filtered with certs only signed by the current certificate?
+        entries = self.update_crl_entries(now)
+        freshest = None
+        if crl_config['delta_days']:
+            freshest = [crl.delta_name(url)
+                        for url in CRLLocation.get_locations().values_list('url', flat=True)]
+        # Build CRL
+        # Build CRL and export it to path
+        self._export_crl(
+            crl_config['path'],
+            crl_config,
+            entries,
+            crl_config['days'],
+            self.crlsign,
+            crl_config['sequence'],
+            freshest=freshest,
+        )
+        # Update CRL config
+        next = now + timedelta(days=crl_config['days'])
+        crl_config.update({
+            'last_update': now.timestamp(),
+            'next_update': next.timestamp(),
+            'base_number': crl_config['sequence'],
+            'base_sequence': entries.sequence,
+            'sequence': crl_config['sequence'] + 1,
+            'status': 'OK',
+        })
+
+    def publish_delta_crl(self, crl_config, now):
+        """Sign and export a delta CRL with the revocations made
+        since the last base CRL.
+
+        `crl_config` is updated but not saved.
+        """
+        self.refresh_certificates()
+        # The revocations are streamed from the database to the CRL.
+        # Those committed late may be in the window below `base_sequence`
+        # and not in the base CRL. Repeating the others does no harm.
+        revocations = Revoked.objects.filter(
+            sequence__gt=crl_config['base_sequence'] - settings.REVOCATION_SEQUENCE_WINDOW,
+            certificate__valid_to__gte=now,
+        ).order_by('certificate__serial_number').values_list(
+            'certificate__serial', 'date', 'reason')
+        self._export_crl(
+            crl.delta_name(crl_config['path']),
+            crl_config,
+            ((int(serial, 16), date, REV_REASON_ASN1[reason])
+             for serial, date, reason in revocations.iterator()),
+            crl_config['delta_days'],
+            self.crlsign,
+            crl_config['sequence'],
+            delta_number=crl_config['base_number'],
+        )
+        next = now + timedelta(days=crl_config['delta_days'])
+        crl_config.update({
+            'delta_last_update': now.timestamp(),
+            'delta_next_update': next.timestamp(),
+            'sequence': crl_config['sequence'] + 1,
+            'status': 'OK',
+        })
+
+    def update_partition_entries(self, now):
+        """Bring the revoked entries of the partitioned CRLs up to date.
+
+        Returns the set of partitions with new revocations. If they are
+        loaded again because revocations have been deleted, the partitions
+        that had revocations are returned too.
+        """
+        entries = self.partition_entries
+        deletions = Counter.get_value(Counter.REVOCATION_DELETIONS)
+        changed = set()
+        if entries is None or deletions != self.partition_deletions:
+            changed = set(entries or ())
+            entries = self.partition_entries = {}
+            self.partition_cursor = RevocationCursor()
+            self.partition_deletions = deletions
+        partitioned = Revoked.objects.filter(
+            certificate__crl_partition__isnull=False)
+        revocations = self.partition_cursor.read(
+            partitioned, 'certificate__crl_partition', 'certificate__serial',
+            'certificate__valid_to', 'date', 'reason')
+        for partition, serial, valid_to, date, reason, sequence in revocations:
+            if partition not in entries:
+                entries[partition] = crl.RevokedEntries()
+            entries[partition].add(
+                int(serial, 16), date, REV_REASON_ASN1[reason], valid_to)
+            entries[partition].sequence = sequence
+            changed.add(partition)
+        for partition_entries in entries.values():
+            partition_entries.drop_expired(now)
+        return changed
+
+    def publish_partitions(self, crl_config, now, everything=False):
+        """Sign and export the partitioned CRLs that have new revocations.
+
+        With `everything` all the partitions are published, including
+        those of older certificates if the number of partitions changed.
+        Returns the number of CRLs published. `crl_config` is updated
+        but not saved.
+        """
+        if everything:
+            used = Certificate.objects.aggregate(
+                last=Max('crl_partition'))['last']
+            count = max(crl_config['partitions'],
+                        used + 1 if used is not None else 0)
+            crl_config['published_partitions'] = count
+            if not count:
+                return 0
+        changed = self.update_partition_entries(now)
+        if everything:
+            partitions = range(crl_config['published_partitions'])
+        else:
+            partitions = sorted(changed)
+        if not partitions:
+            return 0
+        urls = CRLLocation.get_locations().values_list('url', flat=True)
+        if not urls:
+            # Without an Issuing Distribution Point the partitions
+            # would look like complete CRLs
+            return 0
+        self.refresh_certificates()
+        for partition in partitions:
+            self._export_crl(
+                crl.partition_name(crl_config['path'], partition),
+                crl_config,
+                self.partition_entries.get(partition, crl.RevokedEntries()),
                 crl_config['days'],
                 self.crlsign,
                 crl_config['sequence'],
+                idp=[crl.partition_name(url, partition) for url in urls],
             )
-            # Export CRL to path
-            try:
-                crl_file = open(crl_config['path'], 'w')
-                crl_file.write(cert_utils.export_crl(x509crl))
-                crl_file.close()
-            except Exception as ex:
-                crl_config.update({
-                    'status': str(ex),
-                })
-                Config.set_value(parameters.CRL_CONFIG, json.dumps(crl_config))
-                self.fatal_error(ex)
-            # Update CRL config
-            next = now + timedelta(days=crl_config['days'])
+            crl_config['sequence'] += 1
+        return len(partitions)
+
+    def _export_crl(self, path, crl_config, *args, **kwargs):
+        """Sign a CRL and write it to `path` in PEM format and next to it
+        in DER format. Exit if it can't be written.
+
+        The other arguments are those of `crl.write_crl`.
+        """
+        try:
+            crl.write_crl(*args, der_path=crl.der_name(path), pem_path=path,
+                          **kwargs)
+        except Exception as ex:
             crl_config.update({
-                'last_update': now.timestamp(),
-                'next_update': next.timestamp(),
-                'sequence': crl_config['sequence'] + 1,
-                'status': 'OK',
+                'status': str(ex),
             })
             Config.set_value(parameters.CRL_CONFIG, json.dumps(crl_config))
-            print('CRL done')
+            self.fatal_error(ex)
+
+    def process_ocsp(self):
+        """Sign the OCSP responses that are due.
+
+        Returns the number of responses signed.
+        """
+        if not self.presigner:
+            return 0
+        count = self.presigner.run()
+        if count:
+            print('Signed %d OCSP responses' % count)
+        return count
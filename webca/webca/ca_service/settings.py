@@ -19,6 +19,24 @@ DATABASE_ROUTERS = ['webca.certstore_db.CertStoreDBRouter']
 if hasattr(settings_local, 'DATABASES'):
     DATABASES.update(settings_local.DATABASES)
 
+if hasattr(settings_local, 'OCSP_RESPONSE_CACHE'):
+    OCSP_RESPONSE_CACHE.update(settings_local.OCSP_RESPONSE_CACHE)
+
+if hasattr(settings_local, 'CRL_DEBOUNCE'):
+    CRL_DEBOUNCE = settings_local.CRL_DEBOUNCE
+
+if hasattr(settings_local, 'CRL_MIN_INTERVAL'):
+    CRL_MIN_INTERVAL = settings_local.CRL_MIN_INTERVAL
+
+if hasattr(settings_local, 'CONFIG_GENERATION_FILE'):
+    CONFIG_GENERATION_FILE = settings_local.CONFIG_GENERATION_FILE
+
+if hasattr(settings_local, 'SIGNING_AGENT_SOCKET'):
+    SIGNING_AGENT_SOCKET = settings_local.SIGNING_AGENT_SOCKET
+
+if hasattr(settings_local, 'REVOCATION_INDEX_INTERVAL'):
+    REVOCATION_INDEX_INTERVAL = settings_local.REVOCATION_INDEX_INTERVAL
+
 OCSP_URL = ''
 if hasattr(settings_local, 'OCSP_URL'):
     OCSP_URL = settings_local.OCSP_URL
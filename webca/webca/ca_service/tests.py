@@ -0,0 +1,111 @@
+"""
+Test the CA service.
+"""
+import json
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.x509.oid import (AuthorityInformationAccessOID,
+                                   ExtendedKeyUsageOID)
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from OpenSSL import crypto
+
+from webca.ca_service.profiles import profile_cache
+from webca.ca_service.service import CAService
+from webca.config import constants as p
+from webca.config import new_crl_config
+from webca.config.models import ConfigurationObject as Config
+from webca.crypto import certs, crl
+from webca.crypto import constants as c
+from webca.web.models import CRLLocation, CRLPointSet, Request, Template
+
+
+@override_settings(OCSP_URL='http://ocsp.test/', CA_SERVICE_WORKERS=0,
+                   OCSP_PRESIGN=False)
+class IssuanceTest(TestCase):
+    """Test the certificates issued from the compiled profiles."""
+    fixtures = [
+        'config',
+        'certstore_db',
+    ]
+    multi_db = True
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.net')
+        self.template = Template.objects.create(
+            name='test', days=1, enabled=True, min_bits_rsa=1024,
+            key_usage=['digitalSignature'], ext_key_usage=['clientAuth'])
+        self.location = CRLLocation.objects.create(url='http://test/ca.crl')
+        crl_config = dict(new_crl_config(), partitions=4)
+        Config.set_value(p.CRL_CONFIG, json.dumps(crl_config))
+        self.key = certs.create_key_pair(c.KEY_RSA, 1024)
+        profile_cache.invalidate()
+
+    def tearDown(self):
+        profile_cache.invalidate()
+
+    def issue(self):
+        """Issue a new request and return its `Certificate`."""
+        csr = certs.create_cert_request(self.key, [('CN', 'test')])
+        request = Request.objects.create(
+            user=self.user, subject='/CN=test', template=self.template,
+            csr=crypto.dump_certificate_request(
+                crypto.FILETYPE_PEM, csr).decode('utf-8'),
+            san='DNS:test.example.com', approved=True)
+        self.assertEqual(CAService().process_requests(), 1)
+        request.refresh_from_db()
+        self.assertEqual(request.status, Request.STATUS_ISSUED)
+        return request.certificate
+
+    @staticmethod
+    def extension(certificate, extension_class):
+        cert = x509.load_pem_x509_certificate(
+            certificate.x509.encode('utf-8'), default_backend())
+        return cert.extensions.get_extension_for_class(extension_class).value
+
+    def cdp_urls(self, certificate):
+        cdp = self.extension(certificate, x509.CRLDistributionPoints)
+        return [point.full_name[0].value for point in cdp]
+
+    def test_issue(self):
+        """The certificate has the extensions of the profile."""
+        certificate = self.issue()
+        eku = self.extension(certificate, x509.ExtendedKeyUsage)
+        self.assertEqual(list(eku), [ExtendedKeyUsageOID.CLIENT_AUTH])
+        san = self.extension(certificate, x509.SubjectAlternativeName)
+        self.assertEqual(san.get_values_for_type(x509.DNSName), ['test.example.com'])
+        aia = self.extension(certificate, x509.AuthorityInformationAccess)
+        self.assertEqual(
+            [(desc.access_method, desc.access_location.value) for desc in aia],
+            [(AuthorityInformationAccessOID.OCSP, 'http://ocsp.test/')])
+        self.assertEqual(
+            certificate.crl_partition,
+            crl.serial_partition(int(certificate.serial, 16), 4))
+        self.assertEqual(
+            self.cdp_urls(certificate),
+            [crl.partition_name('http://test/ca.crl', certificate.crl_partition)])
+        self.assertEqual(
+            certificate.crl_points, CRLPointSet.for_locations([self.location]))
+
+    def test_template_changed(self):
+        """Changing the template changes the next certificates."""
+        self.issue()
+        self.template.ext_key_usage = ['serverAuth']
+        self.template.save()
+        eku = self.extension(self.issue(), x509.ExtendedKeyUsage)
+        self.assertEqual(list(eku), [ExtendedKeyUsageOID.SERVER_AUTH])
+
+    def test_locations_changed(self):
+        """Changing the CRL locations changes the next certificates."""
+        first = self.issue()
+        other = CRLLocation.objects.create(url='http://other/ca.crl')
+        certificate = self.issue()
+        self.assertEqual(
+            self.cdp_urls(certificate),
+            [crl.partition_name(url, certificate.crl_partition)
+             for url in ['http://test/ca.crl', 'http://other/ca.crl']])
+        self.assertEqual(
+            certificate.crl_points,
+            CRLPointSet.for_locations([self.location, other]))
+        self.assertNotEqual(certificate.crl_points, first.crl_points)
@@ -0,0 +1,30 @@
+"""
+Worker processes that issue certificates in parallel.
+
+This module doesn't import any model at the top so that a new
+process can load it before Django has been set up.
+"""
+import django
+from django import db
+
+# The service of this worker process. It keeps the signing material
+# loaded between requests.
+_service = None
+
+
+def init_worker():
+    """Set up a worker process of the issuance pool."""
+    global _service
+    django.setup()
+    # Don't use the connections inherited from the parent process
+    db.connections.close_all()
+    from webca.ca_service.service import CAService
+    _service = CAService(worker=True)
+
+
+def issue_request(request_id, profile=None):
+    """Issue a request that has already been claimed.
+
+    `profile` is the `IssuanceProfile` of its template, compiled by the service.
+    """
+    _service.issue(request_id, profile)
@@ -3,8 +3,14 @@ This module defines the abstract class CertStore from which different stores
 have to inherit so that can provide the same features.
 """
 import abc
+import threading
+import uuid
+
+from django.conf import settings
+from OpenSSL import crypto
 
 from webca.crypto.constants import KU_KEYCERTSIGN, KU_CRLSIGN, EKU_OCSPSIGNING
+from webca.crypto.utils import asn1_to_datetime, components_to_name, int_to_hex
 
 
 class CertificateExistsError(Exception):
@@ -12,12 +18,53 @@ class CertificateExistsError(Exception):
     pass
 
 
+class CertificateInfo:
+    """A certificate in a store.
+
+    It has what is needed to list the certificates. The certificate is
+    only parsed when `certificate` is used.
+    """
+
+    def __init__(self, serial, subject, valid_from, valid_to,
+                 key_usage=None, ext_key_usage=None, pem=None, x509=None):
+        self.serial = serial
+        self.subject = subject
+        self.valid_from = valid_from
+        self.valid_to = valid_to
+        self.key_usage = key_usage or []
+        self.ext_key_usage = ext_key_usage or []
+        self._pem = pem
+        self._x509 = x509
+
+    def __repr__(self):
+        return '<CertificateInfo %s>' % self.serial
+
+    @property
+    def certificate(self):
+        """The OpenSSL.crypto.X509 certificate."""
+        if self._x509 is None:
+            self._x509 = crypto.load_certificate(crypto.FILETYPE_PEM, self._pem)
+        return self._x509
+
+    @classmethod
+    def from_x509(cls, x509):
+        """Build the info of an OpenSSL.crypto.X509 certificate."""
+        return cls(
+            int_to_hex(x509.get_serial_number()),
+            components_to_name(x509.get_subject().get_components()),
+            asn1_to_datetime(x509.get_notBefore().decode('utf-8')),
+            asn1_to_datetime(x509.get_notAfter().decode('utf-8')),
+            x509=x509,
+        )
+
+
 class CertStore(metaclass=abc.ABCMeta):
     """"This class is to be used to track the different
     implementations of a certificate store."""
     CLASS_ID = 'cfb28a77-eed7-4c91-9061-2ba0d3d2bea9'
 
     _stores = {}
+    _instances = {}
 
     @staticmethod
     def register_store(store_class):
@@ -39,19 +86,45 @@ class CertStore(metaclass=abc.ABCMeta):
         return [cls() for name, cls in CertStore.all()]
 
     @staticmethod
-    def get_store(store_id):
-        """Return an instance of the selected store."""
-        store = CertStore._stores[store_id]
-        return store[1]()
+    def get_store(store_id, local=False):
+        """Return the instance of the selected store.
+
+        Stores keep no state so the same instance is shared.
+        If SIGNING_AGENT_SOCKET is set, the private keys are used through
+        the signing agent, unless `local` is True. If the store is not
+        installed in this process, the certificates are read through the
+        agent too.
+        """
+        agent = bool(settings.SIGNING_AGENT_SOCKET) and not local
+        store = CertStore._instances.get((store_id, agent))
+        if store is None:
+            if agent:
+                from webca.certstore.agent import AgentStore, RemoteStore
+                if store_id in CertStore._stores:
+                    store = AgentStore(CertStore._stores[store_id][1]())
+                else:
+                    store = RemoteStore(store_id)
+            else:
+                store = CertStore._stores[store_id][1]()
+            CertStore._instances[(store_id, agent)] = store
+        return store
+
+    @staticmethod
+    def changed():
+        """Tell the caches that the certificates of a store have changed.
+
+        Stores must call this when certificates are added or deleted.
+        """
+        material_cache.stores_changed()
 
     @staticmethod
     def get_by_name(name):
         """Return an instance of the selected store by `name`.
         Returns `None` if not found."""
-        store = [store for store_name,
+        store = [store.STORE_ID for store_name,
                  store in CertStore.all() if store_name == name]
         if store:
-            return store[0]()
+            return CertStore.get_store(store[0])
         return None
 
     @abc.abstractmethod
@@ -87,6 +160,15 @@ class CertStore(metaclass=abc.ABCMeta):
         """
         return
 
+    def find_certificates(self, key_usage=None, ext_key_usage=None):
+        """Return a list of `CertificateInfo` that match the list of keyUsage
+        and/or extendedKeyUsage.
+
+        Stores should override this to avoid parsing the certificates.
+        """
+        return [CertificateInfo.from_x509(cert)
+                for cert in self.get_certificates(key_usage, ext_key_usage)]
+
     def get_ca_certificates(self):
         """Return the certificates that can sign other certificates."""
         return self.get_certificates(key_usage=[KU_KEYCERTSIGN])
@@ -98,3 +180,95 @@ class CertStore(metaclass=abc.ABCMeta):
     def get_ocsp_certificates(self):
         """Return the  certificates that can sign OCSP responses."""
         return self.get_certificates(ext_key_usage=[EKU_OCSPSIGNING])
+
+
+class MaterialCache:
+    """Process-wide cache of the certificates and private keys loaded
+    from the stores.
+
+    Objects are kept by `(store_id, serial)` until `invalidate` is called,
+    which bumps `version`. `CertStore.changed` does this when a store is
+    modified and also changes a shared configuration parameter so that
+    the caches of the other processes are invalidated on their next read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = {}
+        self._shared = None
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def shared_version():
+        """Return the version of the stores shared by all the processes."""
+        # Imported here, the stores are loaded before the apps are ready
+        from webca.config import constants as parameters
+        from webca.config.models import ConfigurationObject as Config
+        return Config.get_value(parameters.CERTSTORE_VERSION)
+
+    def get_version(self):
+        """Return `version` after forgetting the cached objects if another
+        process has changed a store."""
+        shared = self.shared_version()
+        with self._lock:
+            if shared != self._shared:
+                self._items = {}
+                self._shared = shared
+                self.version += 1
+            return self.version
+
+    def _get(self, kind, store_id, serial):
+        key = (kind, store_id, serial)
+        self.get_version()
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                return self._items[key]
+            version = self.version
+        # Load outside the lock so that a slow store doesn't block readers
+        store = CertStore.get_store(store_id)
+        if kind == 'certificate':
+            value = store.get_certificate(serial)
+        else:
+            value = store.get_private_key(serial)
+        with self._lock:
+            self.misses += 1
+            # Don't keep what was loaded before an invalidation
+            if value is not None and version == self.version:
+                self._items[key] = value
+        return value
+
+    def get_certificate(self, store_id, serial):
+        """Return the OpenSSL.crypto.X509 certificate with this serial number."""
+        return self._get('certificate', store_id, serial)
+
+    def get_private_key(self, store_id, serial):
+        """Return the private OpenSSL.crypto.PKey of the certificate
+        with this serial number."""
+        return self._get('private_key', store_id, serial)
+
+    def invalidate(self):
+        """Forget all the cached objects."""
+        with self._lock:
+            self._items = {}
+            self.version += 1
+
+    def stores_changed(self):
+        """Tell every process that the certificates of a store have changed."""
+        from webca.config import constants as parameters
+        from webca.config.models import ConfigurationObject as Config
+        self.invalidate()
+        Config.set_value(parameters.CERTSTORE_VERSION, uuid.uuid4().hex)
+
+    def stats(self):
+        """Return a dictionary with the hit/miss counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'version': self.version,
+        }
+
+
+material_cache = MaterialCache()
@@ -0,0 +1,392 @@
+"""
+Signing agent.
+
+The agent is a long-lived process that holds the private keys of the CA
+and signs SHA256 digests for the other processes over a Unix socket, so
+that they never load the keys (manage.py signingagent).
+
+Every message is a 4 byte big-endian length followed by a JSON object.
+A request signs a batch of digests:
+
+    {"sign": [["store_id,serial", "base64 digest"], ...]}
+
+and the reply has the signatures in the same order:
+
+    {"signatures": ["base64 signature", ...]}
+
+or {"error": "..."} if any of them failed.
+
+The certificates of the keys can also be read from the agent, so that
+the processes that use it don't need access to the stores at all:
+
+    {"certificate": "store_id,serial"}
+
+and the reply has the certificate in PEM format, or null if there is
+no certificate with that serial number:
+
+    {"certificate": "-----BEGIN CERTIFICATE-----..."}
+"""
+import base64
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from OpenSSL import crypto
+
+from webca.certstore import CertStore
+from webca.crypto.utils import sign_digest
+
+HEADER = struct.Struct('!I')
+# Requests bigger than this are rejected
+MAX_MESSAGE = 16 * 1024 * 1024
+
+KEY_ALGORITHMS = {
+    crypto.TYPE_RSA: 'rsa',
+    crypto.TYPE_DSA: 'dsa',
+}
+
+
+class SigningAgentError(Exception):
+    """Raised when the signing agent cannot sign."""
+    pass
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def send_message(sock, message):
+    """Send a JSON `message` to `sock`."""
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    """Receive a JSON message from `sock`. Return None if it's closed."""
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    size = HEADER.unpack(header)[0]
+    if size > MAX_MESSAGE:
+        raise SigningAgentError('message too big')
+    data = _recv_exactly(sock, size)
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def key_id(store_id, serial):
+    """Return the id of a key as used by the agent and the CERT_* parameters."""
+    return '{},{}'.format(store_id, serial)
+
+
+class SigningAgent(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Sign digests with the keys of the certificate stores.
+
+    Each connection is served by its own thread and the digests of a
+    batch are signed in parallel by a pool of `workers` threads.
+    """
+    daemon_threads = True
+
+    def __init__(self, path=None, workers=None):
+        self.path = path or settings.SIGNING_AGENT_SOCKET
+        if not self.path:
+            raise SigningAgentError('SIGNING_AGENT_SOCKET is not set')
+        self.pool = ThreadPoolExecutor(
+            max_workers=workers or settings.SIGNING_AGENT_WORKERS)
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._certificates = {}
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        super().__init__(self.path, AgentHandler)
+
+    def server_bind(self):
+        # Only the processes of the same user can ask for signatures.
+        # The socket is created with these permissions, so there is no
+        # moment when other users can connect to it.
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def get_key(self, key):
+        """Return the `cryptography` private key with id `key`."""
+        with self._lock:
+            if key in self._keys:
+                return self._keys[key]
+        store_id, serial = key.split(',')
+        private_key = CertStore.get_store(store_id, local=True).get_private_key(serial)
+        if private_key is None:
+            raise SigningAgentError('unknown key %s' % key)
+        private_key = private_key.to_cryptography_key()
+        with self._lock:
+            self._keys[key] = private_key
+        return private_key
+
+    def get_certificate(self, key):
+        """Return the PEM certificate of the key with id `key`, or None."""
+        with self._lock:
+            if key in self._certificates:
+                return self._certificates[key]
+        store_id, serial = key.split(',')
+        certificate = CertStore.get_store(store_id, local=True).get_certificate(serial)
+        if certificate is None:
+            return None
+        certificate = crypto.dump_certificate(
+            crypto.FILETYPE_PEM, certificate).decode('ascii')
+        with self._lock:
+            self._certificates[key] = certificate
+        return certificate
+
+    def sign(self, requests):
+        """Sign a list of (key, digest) and return the list of signatures."""
+        futures = [
+            self.pool.submit(sign_digest, self.get_key(key), digest)
+            for key, digest in requests
+        ]
+        return [future.result() for future in futures]
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class AgentHandler(socketserver.BaseRequestHandler):
+    """Answer the requests of a client until it disconnects."""
+
+    def handle(self):
+        while True:
+            try:
+                message = recv_message(self.request)
+            except (OSError, ValueError, SigningAgentError):
+                return
+            if message is None:
+                return
+            try:
+                if 'certificate' in message:
+                    reply = {
+                        'certificate': self.server.get_certificate(
+                            message['certificate']),
+                    }
+                else:
+                    requests = [(key, base64.b64decode(digest))
+                                for key, digest in message['sign']]
+                    signatures = self.server.sign(requests)
+                    reply = {
+                        'signatures': [base64.b64encode(signature).decode('ascii')
+                                       for signature in signatures],
+                    }
+            except Exception as ex:
+                reply = {'error': str(ex) or ex.__class__.__name__}
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                return
+
+
+class AgentClient:
+    """Client of the signing agent.
+
+    Each thread uses its own connection, that is opened on first use
+    and opened again if the agent is restarted.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or settings.SIGNING_AGENT_SOCKET
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError as ex:
+            sock.close()
+            raise SigningAgentError('cannot connect to the signing agent: %s' % ex)
+        self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def _request(self, message):
+        if self._pid != os.getpid():
+            # Don't share the connections of the parent after a fork
+            self._local = threading.local()
+            self._pid = os.getpid()
+        for retry in (True, False):
+            sock = getattr(self._local, 'sock', None) or self._connect()
+            try:
+                send_message(sock, message)
+                reply = recv_message(sock)
+            except OSError:
+                reply = None
+            if reply is not None:
+                return reply
+            self._close()
+            if not retry:
+                raise SigningAgentError('the signing agent closed the connection')
+
+    def sign(self, requests):
+        """Sign a list of (key, digest) in one round trip.
+
+        Returns the list of signatures in the same order.
+        """
+        if not requests:
+            return []
+        reply = self._request({
+            'sign': [[key, base64.b64encode(digest).decode('ascii')]
+                     for key, digest in requests],
+        })
+        if 'error' in reply:
+            raise SigningAgentError(reply['error'])
+        return [base64.b64decode(signature) for signature in reply['signatures']]
+
+    def get_certificate(self, key):
+        """Return the OpenSSL.crypto.X509 certificate of the key with id
+        `key`, or None if it's not in the stores."""
+        reply = self._request({'certificate': key})
+        if 'error' in reply:
+            raise SigningAgentError(reply['error'])
+        if reply['certificate'] is None:
+            return None
+        return crypto.load_certificate(crypto.FILETYPE_PEM, reply['certificate'])
+
+    def close(self):
+        """Close the connection of this thread."""
+        self._close()
+
+
+_client = None
+
+
+def get_client():
+    """Return the process-wide `AgentClient`."""
+    global _client
+    if _client is None:
+        _client = AgentClient()
+    return _client
+
+
+class RemoteKey:
+    """A private key held by the signing agent.
+
+    It can be used instead of an `OpenSSL.crypto.PKey` wherever
+    `webca.crypto.utils.sign_digest` is used to sign.
+    """
+
+    def __init__(self, key, public_key, client=None):
+        self.key = key
+        self.public_key = public_key
+        self.client = client or get_client()
+
+    def __repr__(self):
+        return '<RemoteKey %s>' % self.key
+
+    def type(self):
+        """Type of the key as `OpenSSL.crypto.TYPE_*`."""
+        return self.public_key.type()
+
+    def bits(self):
+        """Size of the key."""
+        return self.public_key.bits()
+
+    @property
+    def algorithm(self):
+        """'rsa', 'dsa' or 'ec', like the keys of oscrypto."""
+        return KEY_ALGORITHMS.get(self.type(), 'ec')
+
+    def sign_digest(self, digest):
+        """Sign a SHA256 `digest`."""
+        return self.client.sign([(self.key, digest)])[0]
+
+    def sign_digests(self, digests):
+        """Sign a list of SHA256 digests in one request."""
+        return self.client.sign([(self.key, digest) for digest in digests])
+
+
+class AgentStore(CertStore):
+    """Client backend of a store whose private keys are held by the
+    signing agent.
+
+    Everything is read from the store except the private keys, which
+    are returned as `RemoteKey`.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.STORE_ID = store.STORE_ID
+
+    def add_certificate(self, private_key, certificate):
+        return self.store.add_certificate(private_key, certificate)
+
+    def get_private_key(self, serial):
+        certificate = self.store.get_certificate(serial)
+        if certificate is None:
+            return None
+        return RemoteKey(key_id(self.STORE_ID, serial), certificate.get_pubkey())
+
+    def get_public_key(self, serial):
+        return self.store.get_public_key(serial)
+
+    def get_certificate(self, serial):
+        return self.store.get_certificate(serial)
+
+    def get_certificates(self, key_usage=None, ext_key_usage=None):
+        return self.store.get_certificates(key_usage, ext_key_usage)
+
+    def find_certificates(self, key_usage=None, ext_key_usage=None):
+        return self.store.find_certificates(key_usage, ext_key_usage)
+
+
+class RemoteStore(CertStore):
+    """A store that is only read through the signing agent.
+
+    It's used by the processes that don't have the stores installed,
+    like the OCSP responder when SIGNING_AGENT_SOCKET is set. Only the
+    certificates of known serial numbers and their keys can be used.
+    """
+
+    def __init__(self, store_id, client=None):
+        self.STORE_ID = store_id
+        self.client = client or get_client()
+
+    def add_certificate(self, private_key, certificate):
+        raise NotImplementedError('the store is read through the signing agent')
+
+    def get_private_key(self, serial):
+        certificate = self.get_certificate(serial)
+        if certificate is None:
+            return None
+        return RemoteKey(key_id(self.STORE_ID, serial),
+                         certificate.get_pubkey(), self.client)
+
+    def get_public_key(self, serial):
+        certificate = self.get_certificate(serial)
+        if certificate is None:
+            return None
+        return certificate.get_pubkey()
+
+    def get_certificate(self, serial):
+        return self.client.get_certificate(key_id(self.STORE_ID, serial))
+
+    def get_certificates(self, key_usage=None, ext_key_usage=None):
+        raise NotImplementedError('the store is read through the signing agent')
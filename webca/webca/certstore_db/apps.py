@@ -8,3 +8,4 @@ class CertstoreDbConfig(AppConfig):
         from webca.certstore_db.impl import DatabaseStore
         from webca.certstore import CertStore
         CertStore.register_store(DatabaseStore)
+        import webca.certstore_db.signals
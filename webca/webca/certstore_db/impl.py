@@ -2,11 +2,11 @@
 A CertStore implementation that uses Djando models to store the CA certificates.
 """
 from django.db import transaction
+from django.db.models import Q
 
 from webca.certstore import CertStore
 from webca.certstore_db import DATABASE_LABEL
 from webca.certstore_db.models import Certificate, KeyPair
-from webca.crypto.constants import EXT_KEY_USAGE, KEY_USAGE
 
 
 class DatabaseStore(CertStore):
@@ -52,27 +52,24 @@ class DatabaseStore(CertStore):
         key_usage is a list of webca.crypto.constants.KU_*
         ext_key_usage is a list of webca.crypto.constants.EKU_*
         """
-        certs = {}
-        key_usage = key_usage or []
-        ext_key_usage = ext_key_usage or []
+        return [info.certificate
+                for info in self.find_certificates(key_usage, ext_key_usage)]
 
-        for usage in key_usage:
-            value = KEY_USAGE[usage]
-            matches = Certificate.objects.filter(key_usage__icontains=value)
-            for cert in matches:
-                certs[cert.serial] = cert
-        for usage in ext_key_usage:
-            value = EXT_KEY_USAGE[usage]
-            matches = Certificate.objects.filter(
-                ext_key_usage__icontains=value)
-            for cert in matches:
-                certs[cert.serial] = cert
+    def find_certificates(self, key_usage=None, ext_key_usage=None):
+        """Return a list of `CertificateInfo` that match the list of key_usage
+        and/or ext_key_usage with a single query.
 
-        certs = certs.values()
-        if not certs and not key_usage and not ext_key_usage:
-            certs = Certificate.objects.all()
-
-        return [x.get_certificate() for x in certs]
+        The certificates are not parsed until they are used.
+        """
+        certs = Certificate.objects.order_by('id')
+        usages = Q()
+        if key_usage:
+            usages |= Q(usages__extended=False, usages__usage__in=key_usage)
+        if ext_key_usage:
+            usages |= Q(usages__extended=True, usages__usage__in=ext_key_usage)
+        if usages:
+            certs = certs.filter(usages).distinct()
+        return [cert.get_info() for cert in certs]
 
     def add_certificate(self, private_key, certificate):
         """Add an OpenSSL.crypto.X509 certificate and
@@ -86,4 +83,5 @@ class DatabaseStore(CertStore):
             keys.save()
             cert.keys = keys
             cert.save()
+        self.changed()
         return certificate
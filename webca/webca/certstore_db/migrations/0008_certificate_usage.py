@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from webca.crypto import constants as c
+
+
+def usage_values(names, usages):
+    values = {name.lower(): value for value, name in usages.items()}
+    names = [name.strip().lower() for name in (names or '').split(',')]
+    return [values[name] for name in names if name in values]
+
+
+def add_usages(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Certificate = apps.get_model('certstore_db', 'Certificate')
+    CertificateUsage = apps.get_model('certstore_db', 'CertificateUsage')
+    usages = []
+    for cert in Certificate.objects.using(db_alias).all():
+        usages += [
+            CertificateUsage(certificate=cert, usage=usage)
+            for usage in usage_values(cert.key_usage, c.KEY_USAGE)
+        ]
+        usages += [
+            CertificateUsage(certificate=cert, usage=usage, extended=True)
+            for usage in usage_values(cert.ext_key_usage, c.EXT_KEY_USAGE)
+        ]
+    CertificateUsage.objects.using(db_alias).bulk_create(usages)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('certstore_db', '0007_key_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CertificateUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('usage', models.SmallIntegerField(help_text='KU_* or EKU_* constant')),
+                ('extended', models.BooleanField(default=False, help_text='Whether this is an extended key usage')),
+                ('certificate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usages', to='certstore_db.Certificate')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='certificateusage',
+            index=models.Index(fields=['extended', 'usage'], name='certstore_d_extende_f3a024_idx'),
+        ),
+        migrations.RunPython(add_usages, migrations.RunPython.noop),
+    ]
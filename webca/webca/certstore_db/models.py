@@ -2,7 +2,7 @@
 from django.db import models
 from OpenSSL import crypto
 
-from webca.certstore import CertificateExistsError
+from webca.certstore import CertificateExistsError, CertificateInfo
 from webca.config import constants as parameters
 from webca.config.models import ConfigurationObject as Config
 from webca.crypto import utils as cert_utils
@@ -150,6 +150,38 @@ class Certificate(models.Model):
         cert = crypto.load_certificate(crypto.FILETYPE_PEM, self.certificate)
         return cert
 
+    def get_usages(self):
+        """Return the lists of KU_* and EKU_* constants of this certificate."""
+        return (
+            _usage_values(self.key_usage, c.KEY_USAGE),
+            _usage_values(self.ext_key_usage, c.EXT_KEY_USAGE),
+        )
+
+    def get_info(self):
+        """Return the `CertificateInfo` of this certificate."""
+        key_usage, ext_key_usage = self.get_usages()
+        return CertificateInfo(
+            self.serial,
+            self.subject,
+            self.valid_from,
+            self.valid_to,
+            key_usage=key_usage,
+            ext_key_usage=ext_key_usage,
+            pem=self.certificate,
+        )
+
+    def save_usages(self, using=None):
+        """Save the usages of this certificate in `CertificateUsage`."""
+        key_usage, ext_key_usage = self.get_usages()
+        usages = CertificateUsage.objects.db_manager(using)
+        usages.filter(certificate=self).delete()
+        usages.bulk_create(
+            [CertificateUsage(certificate=self, usage=usage)
+             for usage in key_usage] +
+            [CertificateUsage(certificate=self, usage=usage, extended=True)
+             for usage in ext_key_usage]
+        )
+
     @classmethod
     def from_certificate(cls, certificate):
         """Create a new Certificate object based on a X509 certificate.
@@ -186,3 +218,41 @@ class Certificate(models.Model):
             crypto.FILETYPE_PEM, certificate).decode('utf-8')
 
         return cert
+
+
+class CertificateUsage(models.Model):
+    """A key usage or extended key usage of a certificate.
+
+    They are saved in their own table so that the certificates can be
+    looked up by usage with an index.
+    """
+    certificate = models.ForeignKey(
+        'Certificate',
+        on_delete=models.CASCADE,
+        related_name='usages',
+    )
+    usage = models.SmallIntegerField(
+        help_text='KU_* or EKU_* constant',
+    )
+    extended = models.BooleanField(
+        default=False,
+        help_text='Whether this is an extended key usage',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['extended', 'usage']),
+        ]
+
+    def __repr__(self):
+        return '<CertificateUsage %s %s>' % (self.certificate_id, self.usage)
+
+
+def _usage_values(names, usages):
+    """Return the constants of a comma separated list of usage names.
+
+    `usages` is `constants.KEY_USAGE` or `constants.EXT_KEY_USAGE`.
+    """
+    values = {name.lower(): value for value, name in usages.items()}
+    names = [name.strip().lower() for name in (names or '').split(',')]
+    return [values[name] for name in names if name in values]
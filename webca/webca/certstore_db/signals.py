@@ -0,0 +1,23 @@
+"""
+Model signals.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from webca.certstore import CertStore
+from webca.certstore_db.models import Certificate, KeyPair
+
+
+@receiver(post_save, sender=Certificate)
+def save_certificate_usages(sender, instance, using, **kwargs):
+    """Save the usages of a certificate, also when it's loaded from a fixture."""
+    instance.save_usages(using)
+
+
+@receiver(post_save, sender=Certificate)
+@receiver(post_save, sender=KeyPair)
+@receiver(post_delete, sender=Certificate)
+@receiver(post_delete, sender=KeyPair)
+def store_changed(sender, **kwargs):
+    """Forget the cached certificates and keys when they are modified."""
+    CertStore.changed()
@@ -1,3 +1,200 @@
-from django.test import TestCase
+import os
+import shutil
+import stat
+import tempfile
+import threading
 
-# Create your tests here.
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import utils as asym_utils
+from django.test import TestCase, override_settings
+from OpenSSL import crypto
+
+from webca.certstore import CertStore, material_cache
+from webca.certstore.agent import (AgentClient, AgentStore, RemoteKey,
+                                   RemoteStore, SigningAgent,
+                                   SigningAgentError, key_id)
+from webca.certstore_db import DATABASE_LABEL
+from webca.certstore_db.impl import DatabaseStore
+from webca.certstore_db.models import Certificate, CertificateUsage
+from webca.config.cache import config_cache
+from webca.config.constants import CERTSTORE_VERSION
+from webca.config.models import ConfigurationObject as Config
+from webca.crypto import certs
+from webca.crypto import constants as c
+
+
+class Usages(TestCase):
+    """Test the lookup of certificates by usage."""
+    fixtures = [
+        'certstore_db',
+    ]
+    multi_db = True
+
+    def test_fixture_usages(self):
+        """The usages are saved when the certificates are loaded."""
+        cert = Certificate.objects.get(pk=126)
+        usages = CertificateUsage.objects.filter(certificate=cert)
+        self.assertEqual(
+            sorted(usages.values_list('extended', 'usage')),
+            [(False, c.KU_DIGITALSIGNATURE), (True, c.EKU_OCSPSIGNING)],
+        )
+
+    def test_resave(self):
+        """Saving a certificate again replaces its usages."""
+        cert = Certificate.objects.get(pk=123)
+        cert.key_usage = 'cRLSign'
+        cert.save()
+        self.assertEqual(
+            list(cert.usages.values_list('usage', flat=True)),
+            [c.KU_CRLSIGN],
+        )
+
+    def test_find_one_query(self):
+        """Certificates are found with one query and not parsed."""
+        store = DatabaseStore()
+        with self.assertNumQueries(1, using=DATABASE_LABEL):
+            infos = store.find_certificates(
+                key_usage=[c.KU_KEYCERTSIGN],
+                ext_key_usage=[c.EKU_OCSPSIGNING],
+            )
+        self.assertEqual(
+            [info.serial for info in infos],
+            ['f63db9a5307f3d410864eee6c90dad5c',
+             '3b246e08ad69f986257475d594e0034b',
+             '7bdeaca7dcb023e1b750b54101fee569'],
+        )
+        self.assertTrue(all(info._x509 is None for info in infos))
+        self.assertIn(c.KU_CRLSIGN, infos[0].key_usage)
+
+    def test_get_certificates(self):
+        """The X509 certificates match the usages."""
+        store = DatabaseStore()
+        certs = store.get_ocsp_certificates()
+        self.assertEqual(len(certs), 1)
+        self.assertEqual(
+            '%x' % certs[0].get_serial_number(),
+            '7bdeaca7dcb023e1b750b54101fee569',
+        )
+        self.assertEqual(len(store.get_ca_certificates()), 2)
+        self.assertEqual(len(store.get_certificates()), 4)
+        self.assertEqual(store.get_certificates(key_usage=[c.KU_DECIPHERONLY]), [])
+
+
+class MaterialCache(TestCase):
+    """Test the cache of certificates and keys."""
+    fixtures = [
+        'certstore_db',
+    ]
+    multi_db = True
+    serial = 'f63db9a5307f3d410864eee6c90dad5c'
+
+    def test_singleton(self):
+        """Stores are only created once."""
+        self.assertIs(
+            CertStore.get_store(DatabaseStore.STORE_ID),
+            CertStore.get_by_name('DatabaseStore'),
+        )
+
+    def test_hit(self):
+        """Certificates and keys are loaded once."""
+        material_cache.invalidate()
+        store_id = DatabaseStore.STORE_ID
+        cert = material_cache.get_certificate(store_id, self.serial)
+        key = material_cache.get_private_key(store_id, self.serial)
+        with self.assertNumQueries(0, using=DATABASE_LABEL):
+            self.assertIs(material_cache.get_certificate(store_id, self.serial), cert)
+            self.assertIs(material_cache.get_private_key(store_id, self.serial), key)
+
+    def test_delete(self):
+        """Deleting a certificate invalidates the cache."""
+        store_id = DatabaseStore.STORE_ID
+        self.assertIsNotNone(material_cache.get_certificate(store_id, self.serial))
+        version = material_cache.version
+        Certificate.objects.get(serial=self.serial).delete()
+        self.assertGreater(material_cache.version, version)
+        self.assertIsNone(material_cache.get_certificate(store_id, self.serial))
+
+    def test_other_process(self):
+        """Changes made by other processes invalidate the cache."""
+        store_id = DatabaseStore.STORE_ID
+        cert = material_cache.get_certificate(store_id, self.serial)
+        version = material_cache.get_version()
+        Config.objects.update_or_create(
+            name=CERTSTORE_VERSION, defaults={'value': 'other'})
+        config_cache.bump()
+        self.assertGreater(material_cache.get_version(), version)
+        self.assertIsNot(material_cache.get_certificate(store_id, self.serial), cert)
+
+
+class Agent(TestCase):
+    """Test the signing agent."""
+    multi_db = True
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.agent = SigningAgent(os.path.join(self.dir, 'agent.sock'), workers=2)
+        store = DatabaseStore()
+        key, self.cert = certs.create_ca_certificate([('CN', 'Agent CA')])
+        store.add_certificate(key, self.cert)
+        self.key_id = key_id(store.STORE_ID, '%x' % self.cert.get_serial_number())
+        # The threads of the agent can't see the data of the test
+        self.agent.get_key(self.key_id)
+        self.agent.get_certificate(self.key_id)
+        self.thread = threading.Thread(target=self.agent.serve_forever)
+        self.thread.start()
+        self.client = AgentClient(self.agent.path)
+        self.remote = RemoteKey(self.key_id, self.cert.get_pubkey(), self.client)
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.shutdown()
+        self.thread.join()
+        self.agent.server_close()
+        shutil.rmtree(self.dir)
+
+    def test_permissions(self):
+        """Only the user of the agent can connect to it."""
+        self.assertEqual(stat.S_IMODE(os.stat(self.agent.path).st_mode), 0o600)
+
+    def test_sign(self):
+        """A batch of digests is signed in one request."""
+        digests = [bytes([i]) * 32 for i in range(10)]
+        signatures = self.remote.sign_digests(digests)
+        public_key = self.cert.get_pubkey().to_cryptography_key()
+        for digest, signature in zip(digests, signatures):
+            public_key.verify(signature, digest, padding.PKCS1v15(),
+                              asym_utils.Prehashed(hashes.SHA256()))
+
+    def test_unknown_key(self):
+        """Keys that are not in the stores can't be used."""
+        remote = RemoteKey(key_id(DatabaseStore.STORE_ID, 'ff'),
+                           self.cert.get_pubkey(), self.client)
+        with self.assertRaises(SigningAgentError):
+            remote.sign_digest(b'0' * 32)
+        # The connection can still be used
+        self.assertTrue(self.remote.sign_digest(b'0' * 32))
+
+    def test_certificate(self):
+        """Certificates are signed by the agent."""
+        key = certs.create_key_pair(c.KEY_RSA, 1024)
+        cert = certs.create_certificate_from_parts(
+            key, [('CN', 'Agent user')], [], (self.cert, self.remote),
+            1, (0, 3600))
+        store = crypto.X509Store()
+        store.add_cert(self.cert)
+        crypto.X509StoreContext(store, cert).verify_certificate()
+
+    def test_remote_store(self):
+        """Stores that are not installed are read through the agent."""
+        serial = '%x' % self.cert.get_serial_number()
+        store = RemoteStore(DatabaseStore.STORE_ID, self.client)
+        self.assertEqual(
+            store.get_certificate(serial).get_subject(), self.cert.get_subject())
+        key = store.get_private_key(serial)
+        self.assertEqual(key.key, self.key_id)
+        self.assertTrue(key.sign_digest(b'0' * 32))
+        with override_settings(SIGNING_AGENT_SOCKET=self.agent.path):
+            self.assertIsInstance(CertStore.get_store('unknown'), RemoteStore)
+            self.assertIsInstance(
+                CertStore.get_store(DatabaseStore.STORE_ID), AgentStore)
@@ -3,7 +3,19 @@ Django app to store generic configuration settings.
 """
 
 def new_crl_config():
-    """Build a new CRL configuration dictionary."""
+    """Build a new CRL configuration dictionary.
+
+    Delta CRLs are published every `delta_days` days, 0 disables them.
+    `sequence` is the number of the next CRL. `base_number` is the number
+    of the last base CRL and `base_sequence` the sequence of the last
+    revocation included in it: delta CRLs have the revocations after it.
+
+    `partitions` is the number of partitioned CRLs new certificates are
+    assigned to, 0 to disable them. `published_partitions` is the number
+    of partitioned CRLs published in the last base CRL.
+    `last_sequence` is the sequence of the last revocation published
+    and `last_deletions` the number of revocations deleted by then.
+    """
     return dict(
         path='',
         last_update='',
@@ -11,7 +23,24 @@ def new_crl_config():
         days=15,
         delta_last_update='',
         delta_next_update='',
-        delta_days=1,
+        delta_days=0,
         sequence=1,
+        base_number=0,
+        base_sequence=0,
+        partitions=0,
+        published_partitions=0,
+        last_sequence=0,
+        last_deletions=0,
         status='',
     )
+
+
+def get_crl_config():
+    """Return the CRL configuration, with the defaults of `new_crl_config`
+    for the values that are missing.
+
+    Raises ValueError if the configuration can't be parsed.
+    """
+    from webca.config.constants import CRL_CONFIG
+    from webca.config.models import ConfigurationObject as Config
+    return dict(new_crl_config(), **(Config.get_json(CRL_CONFIG) or {}))
@@ -6,3 +6,6 @@ class ConfigConfig(AppConfig):
     """Configuration for the config applications."""
     name = 'webca.config'
     verbose_name = 'Configuration'
+
+    def ready(self):
+        import webca.config.signals
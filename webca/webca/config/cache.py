@@ -0,0 +1,172 @@
+"""
+Process-wide cache of the configuration objects.
+"""
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+
+# Generation of a cache that has not read the generation file yet
+_UNKNOWN = object()
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigCache:
+    """Read-through cache of the values of `ConfigurationObject`.
+
+    The values are kept until the generation of the configuration
+    changes. The generation is the identity of CONFIG_GENERATION_FILE,
+    which is replaced every time a value is saved, so checking it costs
+    a `stat` and no queries. All the processes that use the same
+    database must use the same file. If it's empty the cache is disabled.
+
+    Values changed by this process inside a transaction are not cached
+    until the transaction is committed or rolled back.
+    """
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._path = path
+        self._generation = _UNKNOWN
+        self._values = {}
+        self._parsed = {}
+        # (connection, commit hook) of the transactions that changed a value
+        self._transactions = set()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self):
+        """Path of the generation file."""
+        if self._path is None:
+            return settings.CONFIG_GENERATION_FILE
+        return self._path
+
+    def generation(self):
+        """Return the current generation of the configuration."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    @property
+    def dirty(self):
+        """Is there a transaction of this process that changed a value
+        and hasn't ended?"""
+        with self._lock:
+            # The commit hook is dropped if the transaction is rolled back
+            self._transactions = {
+                (connection, hook) for connection, hook in self._transactions
+                if any(entry[1] is hook for entry in connection.run_on_commit)
+            }
+            return bool(self._transactions)
+
+    def get(self, name, load):
+        """Return the value of `name`. `load(name)` reads it from the database."""
+        if not self.path or self.dirty:
+            return load(name)
+        generation = self.generation()
+        with self._lock:
+            if generation != self._generation:
+                self._values = {}
+                self._parsed = {}
+                self._generation = generation
+            elif name in self._values:
+                self.hits += 1
+                return self._values[name]
+        # Anything saved from now on changes the generation, so the
+        # value can be kept with the generation read before loading it
+        value = load(name)
+        with self._lock:
+            self.misses += 1
+            if self._generation == generation:
+                self._values[name] = value
+        return value
+
+    def get_json(self, name, load):
+        """Return the value of `name` parsed as JSON or None if it doesn't exist.
+
+        The parsed value is cached too. Dictionaries are copied so callers
+        can change them.
+        """
+        value = self.get(name, load)
+        if value is None:
+            return None
+        with self._lock:
+            cached = self._parsed.get(name)
+        if cached is not None and cached[0] is value:
+            parsed = cached[1]
+        else:
+            parsed = json.loads(value)
+            with self._lock:
+                if self._values.get(name) is value:
+                    self._parsed[name] = (value, parsed)
+        if isinstance(parsed, dict):
+            return dict(parsed)
+        return parsed
+
+    def changed(self, using=None):
+        """Tell the cache that a value has been saved.
+
+        The generation is bumped once the change is committed, so that
+        other processes don't cache the old value again.
+        """
+        self.clear()
+        connection = connections[using or 'default']
+        # A hook of its own, to find it in the transaction
+        hook = functools.partial(self._committed)
+        if connection.in_atomic_block:
+            with self._lock:
+                self._transactions.add((connection, hook))
+        transaction.on_commit(hook, using=using)
+
+    def _committed(self):
+        try:
+            self.bump()
+        except OSError as ex:
+            # The values of this process are cleared anyway. The other
+            # processes see the change when the generation changes again.
+            logger.error('Cannot change the configuration generation: %s', ex)
+
+    def bump(self):
+        """Change the generation of the configuration."""
+        self.clear()
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temp = tempfile.mkstemp(dir=directory, prefix='.config-')
+        try:
+            with os.fdopen(handle, 'w') as temp_file:
+                temp_file.write(str(time.time()))
+            # A new inode each time, even if mtime doesn't change
+            os.replace(temp, self.path)
+        except OSError:
+            if os.path.exists(temp):
+                os.unlink(temp)
+            raise
+
+    def clear(self):
+        """Forget the cached values."""
+        with self._lock:
+            self._values = {}
+            self._parsed = {}
+            self._generation = _UNKNOWN
+            self._transactions = set()
+
+    def stats(self):
+        """Return a dictionary with the hit/miss counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+config_cache = ConfigCache()
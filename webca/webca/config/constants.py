@@ -20,3 +20,14 @@ CERT_CSRSIGN = 'csrsign-2ea16b24-3350-44ea-a1ba-7d546d4941b4'
 
 # Key to store CRL status and configuration
 CRL_CONFIG = 'crlconfig-b953912c-e962-4c0e-b75b-d7faa23c78f2'
+
+# Keys that change every time the templates users can use may have changed,
+# either because a template has changed or because a user's groups have
+TEMPLATES_VERSION = 'templatesversion-7ac45242-8fdf-4722-98d4-93b3e500348b'
+GROUPS_VERSION = 'groupsversion-c6e48f64-012a-48d9-b43d-15a03f28f4c1'
+
+# Key that changes every time the CRL locations are changed
+CRL_LOCATIONS_VERSION = 'crllocationsversion-5d0e6f0e-3b7a-4c55-9c1f-0f3e8d2b6a41'
+
+# Key that changes every time the certificates of a store are changed
+CERTSTORE_VERSION = 'certstoreversion-69ecab26-690b-4363-8446-bf00b0a1ede2'
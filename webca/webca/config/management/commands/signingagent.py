@@ -0,0 +1,36 @@
+"""
+Command to run the signing agent.
+
+Run it with the settings of the CA service, which can read the private keys:
+
+    manage.py signingagent --settings webca.ca_service.settings
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+#pylint: disable=E0611, E0401
+from webca.certstore.agent import SigningAgent, SigningAgentError
+#pylint: enable=E0611, E0401
+
+
+class Command(BaseCommand):
+    """This command runs the signing agent until it's interrupted."""
+    help = 'Run the signing agent that holds the private keys of the CA.'
+    requires_migrations_checks = True
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default=settings.SIGNING_AGENT_SOCKET)
+        parser.add_argument("--workers", type=int, default=settings.SIGNING_AGENT_WORKERS)
+
+    def handle(self, *args, **options):
+        try:
+            agent = SigningAgent(options['socket'], options['workers'])
+        except (SigningAgentError, OSError) as ex:
+            raise CommandError('Cannot start the signing agent: %s' % ex)
+        self.stdout.write('Signing agent listening on %s' % agent.path)
+        try:
+            agent.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write('Exiting...')
+        finally:
+            agent.server_close()
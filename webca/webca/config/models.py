@@ -3,6 +3,8 @@ import uuid
 
 from django.db import models
 
+from webca.config.cache import config_cache
+
 
 def gen_uuid():
     """Return a uuid4 as string."""
@@ -37,11 +39,22 @@ class ConfigurationObject(models.Model):
 
     @staticmethod
     def get_value(name):
-        """Return the value of an object or None if it doesn't exist."""
-        obj = ConfigurationObject.objects.filter(name=name).first()
-        if obj:
-            return obj.value
-        return None
+        """Return the value of an object or None if it doesn't exist.
+
+        Values are cached until any of them changes, see `ConfigCache`.
+        """
+        return config_cache.get(name, ConfigurationObject.load_value)
+
+    @staticmethod
+    def get_json(name):
+        """Return the value of an object parsed as JSON or None if it doesn't exist."""
+        return config_cache.get_json(name, ConfigurationObject.load_value)
+
+    @staticmethod
+    def load_value(name):
+        """Return the value of an object from the database."""
+        return ConfigurationObject.objects.filter(name=name).values_list(
+            'value', flat=True).first()
 
     @staticmethod
     def set_value(name, value):
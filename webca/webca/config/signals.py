@@ -0,0 +1,15 @@
+"""
+Model signals.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from webca.config.cache import config_cache
+from webca.config.models import ConfigurationObject
+
+
+@receiver(post_save, sender=ConfigurationObject)
+@receiver(post_delete, sender=ConfigurationObject)
+def configuration_changed(sender, using, **kwargs):
+    """Invalidate the cached configuration in every process."""
+    config_cache.changed(using)
@@ -1,3 +1,91 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.db import DatabaseError, transaction
+from django.test import TestCase, override_settings
+
+from webca.config import get_crl_config, new_crl_config
+from webca.config.cache import config_cache
+from webca.config.constants import CRL_CONFIG
+from webca.config.models import ConfigurationObject as Config
+
+
+class Cache(TestCase):
+    """Test the cache of configuration objects."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.override = override_settings(
+            CONFIG_GENERATION_FILE=os.path.join(self.dir, 'generation'))
+        self.override.enable()
+        Config.objects.create(name='test', value='{"a": 1}')
+        # Saving in this transaction disables the cache until it's committed
+        config_cache.clear()
+
+    def tearDown(self):
+        config_cache.clear()
+        self.override.disable()
+        shutil.rmtree(self.dir)
+
+    def test_hit(self):
+        """Values are read once."""
+        self.assertEqual(Config.get_value('test'), '{"a": 1}')
+        with self.assertNumQueries(0):
+            self.assertEqual(Config.get_value('test'), '{"a": 1}')
+        self.assertIsNone(Config.get_value('missing'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(Config.get_value('missing'))
+
+    def test_generation(self):
+        """Changes made by other processes are seen when the generation changes."""
+        Config.get_value('test')
+        Config.objects.filter(name='test').update(value='2')
+        self.assertEqual(Config.get_value('test'), '{"a": 1}')
+        config_cache.bump()
+        self.assertEqual(Config.get_value('test'), '2')
+
+    def test_set_value(self):
+        """Changes made by this process are seen at once."""
+        Config.get_value('test')
+        Config.set_value('test', '3')
+        self.assertEqual(Config.get_value('test'), '3')
+        self.assertTrue(config_cache.dirty)
+
+    def test_rollback(self):
+        """The cache is used again after a rollback."""
+        Config.get_value('test')
+        try:
+            with transaction.atomic():
+                Config.set_value('test', '3')
+                self.assertTrue(config_cache.dirty)
+                raise DatabaseError('rollback')
+        except DatabaseError:
+            pass
+        self.assertFalse(config_cache.dirty)
+        self.assertEqual(Config.get_value('test'), '{"a": 1}')
+        with self.assertNumQueries(0):
+            self.assertEqual(Config.get_value('test'), '{"a": 1}')
+
+    def test_bump_error(self):
+        """The values of this process are cleared if the generation can't
+        be changed."""
+        Config.get_value('test')
+        Config.objects.filter(name='test').update(value='2')
+        with override_settings(CONFIG_GENERATION_FILE=os.path.join(
+                self.dir, 'missing', 'generation')):
+            config_cache._committed()
+        self.assertEqual(Config.get_value('test'), '2')
+
+    def test_json(self):
+        """Parsed values are cached and copied."""
+        value = Config.get_json('test')
+        value['a'] = 2
+        with self.assertNumQueries(0):
+            self.assertEqual(Config.get_json('test'), {'a': 1})
+
+    def test_crl_config(self):
+        """The CRL configuration has defaults."""
+        self.assertEqual(get_crl_config(), new_crl_config())
+        Config.set_value(CRL_CONFIG, '{"days": 3}')
+        self.assertEqual(get_crl_config()['days'], 3)
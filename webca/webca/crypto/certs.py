@@ -1,14 +1,19 @@
 """
 Functions used for certificate operations
 """
+import hashlib
 from datetime import datetime, timedelta
+from functools import lru_cache
 
 import pytz
+from asn1crypto import x509 as asn1_x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec
 from OpenSSL import crypto
 
 from webca.crypto import constants as c
 from webca.crypto.exceptions import CryptoException
-from webca.crypto.utils import asn1_to_datetime, new_serial
+from webca.crypto.utils import asn1_to_datetime, new_serial, sign_digest
 
 # Creation functions
 
@@ -86,6 +91,33 @@ def create_certificate(request, issuer_cert_key, serial, validity_period, digest
     `digest` - Digest method to use for signing, default is sha256
     Returns: The signed certificate in an X509 object
     """
+    return create_certificate_from_parts(
+        request.get_pubkey(),
+        request.get_subject(),
+        request.get_extensions(),
+        issuer_cert_key,
+        serial,
+        validity_period,
+        digest,
+    )
+
+
+def create_certificate_from_parts(pubkey, subject, extensions, issuer_cert_key,
+                                  serial, validity_period, digest="sha256"):
+    """
+    Generate a certificate from its parts, without a certificate request.
+
+    Arguments
+    ---------
+    `pubkey` - PKey with the public key of the certificate
+    `subject` - X509Name or list of (name, value) tuples (see `create_cert_request`)
+    `extensions` - List of X509Extensions
+    `issuer_cert_key` - tuple (issuer certificate, issuer private key)
+    `serial` - Serial number for the certificate
+    `validity_period` - tuple (not_before, not_after) of timestamps relative to now
+    `digest` - Digest method to use for signing, default is sha256
+    Returns: The signed certificate in an X509 object
+    """
     # Check signing cert validity period against the new cert validity period
     issuer_cert, issuer_key = issuer_cert_key
     not_before, not_after = validity_period
@@ -110,10 +142,16 @@ def create_certificate(request, issuer_cert_key, serial, validity_period, digest
     cert.gmtime_adj_notBefore(not_before)
     cert.gmtime_adj_notAfter(not_after)
     cert.set_issuer(issuer_cert.get_subject())
-    cert.set_subject(request.get_subject())
-    cert.set_pubkey(request.get_pubkey())
+    if isinstance(subject, crypto.X509Name):
+        cert.set_subject(subject)
+    else:
+        # Changing the name changes the subject of the certificate
+        name = cert.get_subject()
+        for key, value in subject:
+            setattr(name, key, value)
+    cert.set_pubkey(pubkey)
 
-    cert.add_extensions(request.get_extensions())
+    cert.add_extensions(extensions)
     ski = crypto.X509Extension(b'subjectKeyIdentifier', False, b'hash', cert)
     cert.add_extensions([ski])
     if isinstance(issuer_cert, crypto.X509):
@@ -125,8 +163,44 @@ def create_certificate(request, issuer_cert_key, serial, validity_period, digest
             b'authorityKeyIdentifier', False, b'keyid:always,issuer:always', issuer=cert)
     cert.add_extensions([aki])
 
-    cert.sign(issuer_key, digest)
-    return cert
+    return sign_certificate(cert, issuer_key, digest)
+
+
+@lru_cache(maxsize=None)
+def _placeholder_key(key_type):
+    """Return a throwaway key of `key_type` (OpenSSL.crypto.TYPE_*)."""
+    if key_type in (crypto.TYPE_RSA, crypto.TYPE_DSA):
+        key = crypto.PKey()
+        key.generate_key(key_type, 1024)
+        return key
+    return crypto.PKey.from_cryptography_key(
+        ec.generate_private_key(ec.SECP256R1(), default_backend()))
+
+
+def sign_certificate(cert, key, digest="sha256"):
+    """Sign a X509 `cert` with `key` and return it.
+
+    If `key` is not a PKey (i.e. it's held by the signing agent), the
+    certificate is signed with a placeholder key of the same type, so
+    that OpenSSL sets the signature algorithm, and then the TBS is signed
+    with `webca.crypto.utils.sign_digest`. Only sha256 can be used then.
+    """
+    if isinstance(key, crypto.PKey):
+        cert.sign(key, digest)
+        return cert
+    if digest != 'sha256':
+        raise CryptoException('Only sha256 can be used with this key')
+    cert.sign(_placeholder_key(key.type()), digest)
+    signed = asn1_x509.Certificate.load(
+        crypto.dump_certificate(crypto.FILETYPE_ASN1, cert))
+    tbs = signed['tbs_certificate']
+    signature = sign_digest(key, hashlib.sha256(tbs.dump()).digest())
+    signed = asn1_x509.Certificate({
+        'tbs_certificate': tbs,
+        'signature_algorithm': signed['signature_algorithm'],
+        'signature_value': signature,
+    })
+    return crypto.load_certificate(crypto.FILETYPE_ASN1, signed.dump())
 
 
 def create_self_signed(name, key_type=c.KEY_RSA, bits=2048, duration=c.CERT_DURATION, extensions=None):
@@ -4,6 +4,10 @@ Constants used in the webca.crypto module.
 # Max allowed serial number size is < 20 bits
 SERIAL_BYTES = 16
 
+# Width of the zero-padded hex serials stored in the database.
+# RFC 5280 allows serials of up to 20 octets.
+SERIAL_WIDTH = 40
+
 # Default duration of a certificate in seconds (25 years)
 # The value must be an integer < (1<<31) - 1
 CERT_DURATION = 60*60*24*365*25
@@ -90,6 +94,17 @@ REV_REASON = {
     REV_CERTIFICATEHOLD: 'certificateHold',
 }
 
+# Names of the revocation reasons in asn1crypto
+REV_REASON_ASN1 = {
+    REV_UNSPECIFIED: 'unspecified',
+    REV_KEYCOMPROMISE: 'key_compromise',
+    REV_CACOMPROMISE: 'ca_compromise',
+    REV_AFFILIATIONCHANGED: 'affiliation_changed',
+    REV_SUPERSEDED: 'superseded',
+    REV_CESSATIONOFOPERATION: 'cessation_of_operation',
+    REV_CERTIFICATEHOLD: 'certificate_hold',
+}
+
 # User selectable reasons
 REV_USER = {
     REV_UNSPECIFIED: 'Unspecified',
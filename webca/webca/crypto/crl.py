@@ -1,127 +1,256 @@
 """
 Functions used for certificate revocation operations
 """
+import base64
+import hashlib
+import heapq
+import io
+import json
+import os
+import tempfile
+from bisect import bisect_left
+from functools import lru_cache
 from datetime import datetime, timedelta
 
+import pytz
+from asn1crypto import algos as asn1_algos
+from asn1crypto import core as asn1_core
+from asn1crypto import crl as asn1_crl
+from asn1crypto import x509 as asn1_x509
 from cryptography import x509
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
 from OpenSSL import crypto
 
-from webca.crypto.extensions import get_certificate_extension
-from webca.crypto.utils import datetime_to_asn1, int_to_hex
+from webca.crypto import constants as c
+from webca.crypto.utils import sign_digest
 
 REASON_UNSPECIFIED = crypto.Revoked().all_reasons()[0]
 
+SIGNATURE_ALGORITHMS = {
+    crypto.TYPE_RSA: 'sha256_rsa',
+    crypto.TYPE_DSA: 'sha256_dsa',
+}
 
-# is_delta=False, delta_number=None, crl_locations=None
-def create_crl(revoked_list, days, issuer, number):
-    """Create a CRL using cryptography's API and then convert it to pyopenssl.
+# Size of the chunks used to write the CRLs
+CHUNK_SIZE = 48 * 1024
 
-    Arguments
-    ----------
-    `revoked_list` - list of integers that represent the serial number of the revoked certificates
-    `days` - number of days for the next update
-    `issuer` - cert,key tuple of the certificate used to sign the CRL
-    `number` - CRL sequence number
+CONTENT_TYPE_DER = 'application/pkix-crl'
+CONTENT_TYPE_PEM = 'application/x-pem-file'
+
+
+def _add_suffix(name, suffix):
+    """Add `suffix` to a path or URL, before the extension."""
+    base, dot, extension = name.rpartition('.')
+    if not dot or '/' in extension or '\\' in extension:
+        return name + suffix
+    return '{}{}.{}'.format(base, suffix, extension)
+
+
+def delta_name(name):
+    """Return the path or URL of the delta CRL that goes with a base CRL.
+
+    '-delta' is added before the extension: ca.crl -> ca-delta.crl
     """
-    issuer_cert, issuer_key = issuer
-    # crl_locations = crl_locations or []
-
-    builder = x509.CertificateRevocationListBuilder()
-    name_attrs = []
-    if issuer_cert.get_subject().CN:
-        name_attrs.append(
-            x509.NameAttribute(
-                x509.oid.NameOID.COMMON_NAME,
-                issuer_cert.get_subject().CN
-            )
-        )
-    if issuer_cert.get_subject().C:
-        name_attrs.append(
-            x509.NameAttribute(
-                x509.oid.NameOID.COUNTRY_NAME,
-                issuer_cert.get_subject().C
-            )
-        )
-    if issuer_cert.get_subject().ST:
-        name_attrs.append(
-            x509.NameAttribute(
-                x509.oid.NameOID.STATE_OR_PROVINCE_NAME,
-                issuer_cert.get_subject().ST
-            )
-        )
-    if issuer_cert.get_subject().L:
-        name_attrs.append(
-            x509.NameAttribute(
-                x509.oid.NameOID.LOCALITY_NAME,
-                issuer_cert.get_subject().L
-            )
-        )
-    if issuer_cert.get_subject().O:
-        name_attrs.append(
-            x509.NameAttribute(
-                x509.oid.NameOID.ORGANIZATION_NAME,
-                issuer_cert.get_subject().O
-            )
-        )
-    if issuer_cert.get_subject().OU:
-        name_attrs.append(
-            x509.NameAttribute(
-                x509.oid.NameOID.ORGANIZATIONAL_UNIT_NAME,
-                issuer_cert.get_subject().OU
-            )
-        )
-    builder = builder.issuer_name(x509.Name(name_attrs))
-    builder = builder.last_update(datetime.utcnow())
-    builder = builder.next_update(datetime.utcnow() + timedelta(days=days))
+    return _add_suffix(name, '-delta')
 
-    for serial, date, reason in revoked_list:
-        ext = x509.CRLReason(x509.ReasonFlags(reason))
-        revoked_cert = x509.RevokedCertificateBuilder(
-        ).serial_number(
-            serial
-        ).revocation_date(
-            date
-        ).add_extension(
-            ext, False
-        ).build(default_backend())
-        builder = builder.add_revoked_certificate(revoked_cert)
 
+def der_name(name):
+    """Return the path of the DER copy of a CRL: ca.crl -> ca.der"""
+    base, dot, extension = name.rpartition('.')
+    if (not dot or '/' in extension or '\\' in extension or
+            extension.lower() == 'der'):
+        return name + '.der'
+    return base + '.der'
+
+
+def partition_name(name, partition):
+    """Return the path or URL of a partition of a CRL.
+
+    The partition is added before the extension: ca.crl -> ca-p3.crl
+    """
+    return _add_suffix(name, '-p%d' % partition)
+
+
+def serial_partition(serial, partitions):
+    """Return the CRL partition of a certificate.
+
+    The range of the serials is split in `partitions` ranges of the
+    same size. Serials are random so the partitions are even.
+    """
+    partition = serial * partitions >> (c.SERIAL_BYTES * 8)
+    return min(partition, partitions - 1)
+
+
+def _time(date):
+    """Return a date as an `asn1crypto.x509.Time`. Naive dates are UTC."""
+    if date.tzinfo is None:
+        date = pytz.utc.localize(date)
+    if date.year < 2050:
+        return asn1_x509.Time({'utc_time': date})
+    return asn1_x509.Time({'general_time': date})
+
+
+def _der_header(tag, length):
+    """Return the DER header of a value with this tag and length."""
+    if length < 0x80:
+        return bytes((tag, length))
+    size = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes((tag, 0x80 | len(size))) + size
+
+
+@lru_cache(maxsize=None)
+def _entry_extensions(reason):
+    """Return the DER of the extensions of an entry revoked for `reason`."""
+    return asn1_crl.CRLEntryExtensions([{
+        'extn_id': 'crl_reason',
+        'critical': False,
+        'extn_value': reason,
+    }]).dump()
+
+
+def encode_entry(serial, date, reason):
+    """Return the DER of a revoked certificate entry of a CRL.
+
+    `reason` is the asn1crypto name of the reason, see
+    `constants.REV_REASON_ASN1`.
+
+    The entry is encoded by hand because building it with asn1crypto
+    is far too slow for CRLs with millions of entries.
+    """
+    serial = serial.to_bytes(serial.bit_length() // 8 + 1, 'big')
+    if date.tzinfo is None:
+        date = pytz.utc.localize(date)
+    date = date.astimezone(pytz.utc)
+    if date.year < 2050:
+        date = b'\x17\x0d' + date.strftime('%y%m%d%H%M%SZ').encode('ascii')
+    else:
+        date = b'\x18\x0f' + date.strftime('%Y%m%d%H%M%SZ').encode('ascii')
+    extensions = _entry_extensions(reason)
+    length = 2 + len(serial) + len(date) + len(extensions)
+    return b''.join((_der_header(0x30, length), b'\x02', bytes((len(serial),)),
+                     serial, date, extensions))
+
+
+class RevokedEntries:
+    """The revoked certificates of a CRL, already encoded.
+
+    The entries are kept sorted by serial. Adding a revocation only
+    encodes that entry, so a CRL can be signed again without encoding
+    all the revocations every time.
+
+    `sequence` is the sequence of the last revocation added and
+    `total` is the number of certificates added, including those
+    dropped because they expired.
+    """
+
+    def __init__(self):
+        self.serials = []
+        # serial -> (DER, expiration timestamp or None)
+        self.entries = {}
+        # (expiration timestamp, serial)
+        self.expiry = []
+        self.sequence = 0
+        self.total = 0
+
+    def __len__(self):
+        return len(self.serials)
+
+    def add(self, serial, date, reason, expires=None):
+        """Add or replace the revocation of the certificate `serial`.
+
+        `expires` is when the certificate expires, it will be dropped
+        from the CRL after that.
+        """
+        if serial not in self.entries:
+            self.serials.insert(bisect_left(self.serials, serial), serial)
+            self.total += 1
+        if expires is not None:
+            expires = expires.timestamp()
+            heapq.heappush(self.expiry, (expires, serial))
+        self.entries[serial] = (encode_entry(serial, date, reason), expires)
+
+    def drop_expired(self, now):
+        """Drop the certificates that have expired before `now`.
+
+        RFC 5280 allows removing an entry once the certificate
+        has expired. Returns the number of entries dropped.
+        """
+        now = now.timestamp()
+        dropped = 0
+        while self.expiry and self.expiry[0][0] < now:
+            expires, serial = heapq.heappop(self.expiry)
+            entry = self.entries.get(serial)
+            # The entry may have been replaced after it was queued
+            if entry is None or entry[1] != expires:
+                continue
+            del self.entries[serial]
+            del self.serials[bisect_left(self.serials, serial)]
+            dropped += 1
+        return dropped
+
+    def write(self, out):
+        """Write the DER of the entries sorted by serial to the binary
+        file `out`, without the SEQUENCE header.
+
+        They are written one at a time, so they are not copied in memory.
+        Returns the number of bytes written.
+        """
+        length = 0
+        for serial in self.serials:
+            entry = self.entries[serial][0]
+            out.write(entry)
+            length += len(entry)
+        return length
+
+
+def signature_algorithm(key):
+    """Return the asn1crypto name of the SHA256 signature made with `key`."""
+    return SIGNATURE_ALGORITHMS.get(key.type(), 'sha256_ecdsa')
+
+
+def _crl_extensions(issuer_cert, number, delta_number, freshest, idp):
+    """Return the extensions of a CRL."""
+    extensions = []
     # To add the AKI extension, we have to read the SKI extension from the
     # signing certificate
-    ski = get_certificate_extension(issuer_cert, b'subjectKeyIdentifier')
-    if ski:
-        ski = bytes.fromhex(str(ski).replace(':', '').lower())
-        ext = x509.AuthorityKeyIdentifier(ski, None, None)
-        builder = builder.add_extension(ext, False)
+    if issuer_cert.key_identifier:
+        extensions.append({
+            'extn_id': 'authority_key_identifier',
+            'critical': False,
+            'extn_value': {'key_identifier': issuer_cert.key_identifier},
+        })
 
     # Add CRL Number
-    ext = x509.CRLNumber(number)
-    builder = builder.add_extension(ext, False)
+    extensions.append({
+        'extn_id': 'crl_number',
+        'critical': False,
+        'extn_value': number,
+    })
 
     # Add Delta CRL Number
-    # if is_delta:
-    #     if number >= delta_number:
-    #         raise ValueError('delta_number')
-    #     ext = x509.DeltaCRLIndicator(delta_number)
-    #     builder = builder.add_extension(ext, False)
-
-    # FUTURE: Add Freshest CRL. Cryptography doesn't support building
-    # CRLs with this extension so we can't create Delta CRLs right now
-    # if not is_delta and crl_locations:
-    #     url = crl_locations[0]
-    #     point = x509.DistributionPoint(
-    #         full_name=[x509.DNSName(url)],
-    #         relative_name=None,
-    #         reasons=None,
-    #         crl_issuer=None,
-    #     )
-    #     ext = x509.FreshestCRL(distribution_points=[point])
-    #     builder = builder.add_extension(ext, False)
-
-    # FUTURE: add Issuing Distribution Point
-    # This extension is not supported by criptography either
+    if delta_number is not None:
+        if number <= delta_number:
+            raise ValueError('delta_number')
+        extensions.append({
+            'extn_id': 'delta_crl_indicator',
+            'critical': True,
+            'extn_value': delta_number,
+        })
+
+    # Add Freshest CRL to point to the delta CRLs
+    if delta_number is None and freshest:
+        extensions.append({
+            'extn_id': 'freshest_crl',
+            'critical': False,
+            'extn_value': [
+                {'distribution_point': {
+                    'full_name': [asn1_x509.GeneralName(
+                        name='uniform_resource_identifier', value=url)],
+                }}
+                for url in freshest
+            ],
+        })
+
+    # Add Issuing Distribution Point to partitioned CRLs
     # https://tools.ietf.org/html/rfc5280#section-5.2.5
     #    Although the extension is critical, conforming implementations
     #    are not required to support this extension.
@@ -129,12 +258,272 @@ def create_crl(revoked_list, days, issuer, number):
     #    MUST either treat the status of any certificate not listed
     #    on this CRL as unknown or locate another CRL that does not
     #    contain any unrecognized critical extensions.
+    if idp:
+        extensions.append({
+            'extn_id': 'issuing_distribution_point',
+            'critical': True,
+            'extn_value': {
+                'distribution_point': {
+                    'full_name': [
+                        asn1_x509.GeneralName(
+                            name='uniform_resource_identifier', value=url)
+                        for url in idp
+                    ],
+                },
+            },
+        })
+    return extensions
+
+
+def _tbs_parts(this_update, next_update, issuer, number, delta_number,
+               freshest, idp):
+    """Return the DER of the fields of the TBS that go before and after
+    the revoked certificates, and the signature algorithm."""
+    issuer_cert, issuer_key = issuer
+    issuer_cert = asn1_x509.Certificate.load(
+        crypto.dump_certificate(crypto.FILETYPE_ASN1, issuer_cert))
+    algorithm = signature_algorithm(issuer_key)
+    tbs = {
+        'version': 'v2',
+        'signature': {'algorithm': algorithm},
+        'issuer': issuer_cert.subject,
+        'this_update': _time(this_update),
+        'next_update': _time(next_update),
+    }
+    prefix = asn1_crl.TbsCertList(tbs).contents
+    tbs['crl_extensions'] = _crl_extensions(
+        issuer_cert, number, delta_number, freshest, idp)
+    suffix = asn1_crl.TbsCertList(tbs).contents[len(prefix):]
+    return prefix, suffix, algorithm
+
 
-    crl = builder.sign(
-        issuer_key.to_cryptography_key(),
-        hashes.SHA256(),
-        default_backend(),
+def _chunks(body):
+    """Read a binary file from the start in chunks."""
+    body.seek(0)
+    while True:
+        chunk = body.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_entries(revocations, out):
+    """Write the DER of the revoked certificates to the binary file `out`.
+
+    `revocations` is an iterable of (serial, date, reason) tuples.
+    Returns the number of bytes written.
+    """
+    length = 0
+    for serial, date, reason in revocations:
+        entry = encode_entry(serial, date, reason)
+        out.write(entry)
+        length += len(entry)
+    return length
+
+
+def sign_crl(out, body, length, days, issuer, number, delta_number=None,
+             freshest=None, idp=None):
+    """Sign a CRL and write its DER to the binary file `out`.
+
+    `body` is a binary file with the DER of the revoked certificates,
+    `length` bytes long. It is read twice, first to hash the TBS and
+    then to write it, so the entries are never kept in memory.
+    See `encode_crl` for the other arguments.
+
+    Returns the thisUpdate and nextUpdate dates of the CRL.
+    """
+    this_update = datetime.now(pytz.utc).replace(microsecond=0)
+    next_update = this_update + timedelta(days=days)
+    prefix, suffix, algorithm = _tbs_parts(
+        this_update, next_update, issuer, number, delta_number, freshest, idp)
+    revoked_header = _der_header(0x30, length) if length else b''
+    tbs_length = len(prefix) + len(revoked_header) + length + len(suffix)
+    tbs_header = _der_header(0x30, tbs_length) + prefix + revoked_header
+
+    digest = hashlib.sha256(tbs_header)
+    for chunk in _chunks(body):
+        digest.update(chunk)
+    digest.update(suffix)
+    signature = sign_digest(issuer[1], digest.digest())
+    trailer = (
+        asn1_algos.SignedDigestAlgorithm({'algorithm': algorithm}).dump() +
+        asn1_core.OctetBitString(signature).dump()
     )
 
-    openssl_crl = crypto.CRL.from_cryptography(crl)
-    return openssl_crl
+    out.write(_der_header(0x30, len(tbs_header) + length + len(suffix) + len(trailer)))
+    out.write(tbs_header)
+    for chunk in _chunks(body):
+        out.write(chunk)
+    out.write(suffix)
+    out.write(trailer)
+    return this_update, next_update
+
+
+def write_pem(der, out):
+    """Write the binary file `der` with a CRL to `out` in PEM format."""
+    out.write(b'-----BEGIN X509 CRL-----\n')
+    for chunk in _chunks(der):
+        # 48 bytes are a line of 64 characters
+        for start in range(0, len(chunk), 48):
+            out.write(base64.b64encode(chunk[start:start + 48]) + b'\n')
+    out.write(b'-----END X509 CRL-----\n')
+
+
+def encode_crl(entries, days, issuer, number, delta_number=None, freshest=None,
+               idp=None):
+    """Sign a CRL and return its DER.
+
+    Arguments
+    ----------
+    `entries` - `RevokedEntries` with the revoked certificates
+    `days` - number of days for the next update
+    `issuer` - cert,key tuple of the certificate used to sign the CRL
+    `number` - CRL sequence number
+    `delta_number` - if not None, build a delta CRL based on the CRL with this number
+    `freshest` - list of URLs where the delta CRLs of a base CRL are published
+    `idp` - list of URLs of a partitioned CRL, for the Issuing Distribution Point
+    """
+    body = io.BytesIO()
+    length = entries.write(body)
+    out = io.BytesIO()
+    sign_crl(out, body, length, days, issuer, number,
+             delta_number, freshest, idp)
+    return out.getvalue()
+
+
+def write_crl(revocations, days, issuer, number, delta_number=None,
+              freshest=None, idp=None, der_path=None, pem_path=None):
+    """Sign a CRL and publish it to `der_path` and `pem_path`.
+
+    `revocations` is a `RevokedEntries` or an iterable of (serial, date,
+    reason) tuples sorted by serial, like a database iterator. They are
+    written to a temporary file so the memory used doesn't grow with
+    the size of the CRL. See `encode_crl` for the other arguments.
+
+    The files are replaced atomically and each one gets a metadata file
+    with what is needed to serve it over HTTP, see `read_metadata`.
+    """
+    body = tempfile.TemporaryFile()
+    if isinstance(revocations, RevokedEntries):
+        length = revocations.write(body)
+    else:
+        length = encode_entries(revocations, body)
+    outputs = []
+    try:
+        with body:
+            der = AtomicFile(der_path) if der_path else tempfile.TemporaryFile()
+            outputs.append(der)
+            dates = sign_crl(der, body, length, days, issuer, number,
+                             delta_number, freshest, idp)
+            if pem_path:
+                pem = AtomicFile(pem_path)
+                outputs.append(pem)
+                write_pem(der, pem)
+        # Publish the CRLs once all of them have been written
+        if der_path:
+            der.commit(CONTENT_TYPE_DER, *dates)
+        if pem_path:
+            pem.commit(CONTENT_TYPE_PEM, *dates)
+    finally:
+        for output in outputs:
+            output.close()
+
+
+def metadata_name(path):
+    """Return the path of the metadata file of a published CRL."""
+    return path + '.json'
+
+
+def read_metadata(path):
+    """Return the metadata of the CRL published at `path` or None.
+
+    It is a dictionary with the `etag`, `length` and `content_type` of
+    the file and the `this_update` and `next_update` timestamps of the CRL.
+    """
+    try:
+        with open(metadata_name(path)) as metadata:
+            return json.load(metadata)
+    except (OSError, ValueError):
+        return None
+
+
+class AtomicFile:
+    """Binary file that replaces `path` atomically.
+
+    The data is written to a temporary file in the same directory which
+    is renamed to `path` by `commit`, so readers never see a file that
+    is half written. The SHA256 and length of the data are kept for the
+    metadata.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory, name = os.path.split(path)
+        handle, self.temp_path = tempfile.mkstemp(
+            prefix='.%s.' % name, dir=directory or '.')
+        self.file = os.fdopen(handle, 'w+b')
+        self.digest = hashlib.sha256()
+        self.length = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.digest.update(data)
+        self.length += len(data)
+
+    def seek(self, offset):
+        return self.file.seek(offset)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def _replace(self, path, temp_path):
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+
+    def commit(self, content_type, this_update, next_update):
+        """Replace `path` with the data written and save its metadata."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self._replace(self.path, self.temp_path)
+        self.temp_path = None
+        metadata = json.dumps({
+            'etag': self.digest.hexdigest()[:32],
+            'length': self.length,
+            'content_type': content_type,
+            'this_update': this_update.timestamp(),
+            'next_update': next_update.timestamp(),
+        })
+        handle, temp_path = tempfile.mkstemp(
+            prefix='.%s.' % os.path.basename(self.path),
+            dir=os.path.dirname(self.path) or '.')
+        with os.fdopen(handle, 'w') as metadata_file:
+            metadata_file.write(metadata)
+        self._replace(metadata_name(self.path), temp_path)
+
+    def close(self):
+        """Close the file and drop it if it wasn't committed."""
+        self.file.close()
+        if self.temp_path:
+            os.remove(self.temp_path)
+            self.temp_path = None
+
+
+def create_crl(revoked_list, days, issuer, number, delta_number=None, freshest=None):
+    """Create a CRL and return it as a pyopenssl object.
+
+    Arguments
+    ----------
+    `revoked_list` - list of (serial, date, reason) tuples of the revoked
+    certificates. The reason is an `x509.ReasonFlags` or its value.
+    `days` - number of days for the next update
+    `issuer` - cert,key tuple of the certificate used to sign the CRL
+    `number` - CRL sequence number
+    `delta_number` - if not None, build a delta CRL based on the CRL with this number
+    `freshest` - list of URLs where the delta CRLs of a base CRL are published
+    """
+    entries = RevokedEntries()
+    for serial, date, reason in revoked_list:
+        entries.add(serial, date, x509.ReasonFlags(reason).name)
+    der = encode_crl(entries, days, issuer, number, delta_number, freshest)
+    return crypto.load_crl(crypto.FILETYPE_ASN1, der)
@@ -148,7 +148,7 @@ def _as_extension(dct):
 
 
 def json_to_extension(json_input):
-    obj = json.loads(json_input, encoding='utf-8', object_hook=_as_extension)
+    obj = json.loads(json_input, object_hook=_as_extension)
     return obj
 
 
@@ -162,6 +162,16 @@ def build_san(names, critical=False):
     return _as_extension(san)
 
 
+def build_aia(ocsp_url, critical=False):
+    """Return an AuthorityInfoAccess OpenSSL.crypto.X509Extension with an OCSP URL."""
+    aia = {
+        'name': 'authorityInfoAccess',
+        'critical': critical,
+        'value': 'OCSP;URI:%s' % ocsp_url,
+    }
+    return _as_extension(aia)
+
+
 def build_cdp(locations, critical=False):
     """Return a CRLDistributionPoints OpenSSL.crypto.X509Extension."""
     value = ['URI:%s' % l for l in locations]
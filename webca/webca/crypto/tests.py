@@ -1,11 +1,14 @@
 """
 Tests for the crypto module.
 """
+import os
+import tempfile
 from datetime import datetime, timedelta
 
 import pytz
 from cryptography import x509
 from django.test import TestCase
+from asn1crypto import crl as asn1_crl
 from OpenSSL import crypto
 
 from . import constants as c
@@ -184,6 +187,28 @@ class Certificate(TestCase):
             "sha256",
         ))
 
+    def test_from_parts(self):
+        """create_certificate_from_parts"""
+        keys2, req2, cert2 = self.build_certificate2()
+        keys = certs.create_key_pair(c.KEY_RSA, 1024)
+        extensions = [
+            crypto.X509Extension(b'keyUsage', True, b'digitalSignature'),
+        ]
+        certificate = certs.create_certificate_from_parts(
+            keys, [('CN', 'parts'), ('O', 'test')], extensions,
+            (cert2, keys2), 5, (0, 10))
+        self.assertEqual(certificate.get_serial_number(), 5)
+        self.assertEqual(certificate.get_subject().get_components(),
+                         [(b'CN', b'parts'), (b'O', b'test')])
+        self.assertEqual(certificate.get_issuer(), req2.get_subject())
+        self.assertEqual(
+            crypto.dump_publickey(crypto.FILETYPE_PEM, certificate.get_pubkey()),
+            crypto.dump_publickey(crypto.FILETYPE_PEM, keys))
+        names = [certificate.get_extension(i).get_short_name()
+                 for i in range(certificate.get_extension_count())]
+        self.assertEqual(names, [b'keyUsage', b'subjectKeyIdentifier',
+                                 b'authorityKeyIdentifier'])
+
     def test_extensions(self):
         """Cert without declared extensions."""
         keys, req, cert = self.build_certificate(add_exts=False)
@@ -324,3 +349,134 @@ class CRL(TestCase):
             ca_crl.to_cryptography().tbs_certlist_bytes,
             "sha256",
         ))
+
+    def test_delta(self):
+        """Test delta CRLs."""
+        ca_key, ca_cert = certs.create_ca_certificate(self.name, bits=512)
+        ca_crl = crl.create_crl(self.revoked, 1, (ca_cert, ca_key), 5, delta_number=4)
+        ext = ca_crl.to_cryptography().extensions.get_extension_for_class(
+            x509.DeltaCRLIndicator)
+        self.assertTrue(ext.critical)
+        self.assertEqual(ext.value.crl_number, 4)
+        with self.assertRaises(ValueError):
+            crl.create_crl([], 1, (ca_cert, ca_key), 4, delta_number=4)
+
+    def test_freshest(self):
+        """Test the FreshestCRL extension of base CRLs."""
+        ca_key, ca_cert = certs.create_ca_certificate(self.name, bits=512)
+        url = crl.delta_name('http://example.com/ca.crl')
+        ca_crl = crl.create_crl([], 15, (ca_cert, ca_key), 1, freshest=[url])
+        ext = ca_crl.to_cryptography().extensions.get_extension_for_class(
+            x509.FreshestCRL)
+        self.assertEqual(ext.value[0].full_name[0].value,
+                         'http://example.com/ca-delta.crl')
+
+    def test_delta_name(self):
+        """Test the names of the delta CRLs."""
+        self.assertEqual(crl.delta_name('/tmp/ca.crl'), '/tmp/ca-delta.crl')
+        self.assertEqual(crl.delta_name('/tmp.dir/ca'), '/tmp.dir/ca-delta')
+        self.assertEqual(crl.delta_name('http://example.com/crl'),
+                         'http://example.com/crl-delta')
+
+    def test_entries(self):
+        """Test the incremental revoked entries."""
+        now = datetime.now(pytz.utc)
+        entries = crl.RevokedEntries()
+        entries.add(3, now, 'superseded', now + timedelta(days=1))
+        entries.add(1, now, 'unspecified', now - timedelta(days=1))
+        entries.add(2, now, 'key_compromise')
+        self.assertEqual(entries.serials, [1, 2, 3])
+        self.assertEqual(entries.drop_expired(now), 1)
+        self.assertEqual(entries.serials, [2, 3])
+        self.assertEqual(entries.total, 3)
+        ca_key, ca_cert = certs.create_ca_certificate(self.name, bits=512)
+        ca_crl = crypto.load_crl(
+            crypto.FILETYPE_ASN1,
+            crl.encode_crl(entries, 15, (ca_cert, ca_key), 1))
+        revoked = ca_crl.get_revoked()
+        self.assertEqual([r.get_serial() for r in revoked], [b'02', b'03'])
+        self.assertEqual(revoked[0].get_reason(), b'Key Compromise')
+        # Replacing an entry doesn't add it twice
+        entries.add(2, now, 'superseded')
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries.total, 3)
+
+    def test_partitions(self):
+        """Test the partitions of the CRLs."""
+        self.assertEqual(crl.partition_name('/tmp/ca.crl', 3), '/tmp/ca-p3.crl')
+        self.assertEqual(crl.serial_partition(0, 4), 0)
+        self.assertEqual(crl.serial_partition(1 << 126, 4), 1)
+        self.assertEqual(crl.serial_partition((1 << 128) - 1, 4), 3)
+
+    def test_idp(self):
+        """Test the Issuing Distribution Point of partitioned CRLs."""
+        ca_key, ca_cert = certs.create_ca_certificate(self.name, bits=512)
+        url = crl.partition_name('http://example.com/ca.crl', 2)
+        der = crl.encode_crl(crl.RevokedEntries(), 15, (ca_cert, ca_key), 1, idp=[url])
+        crl_list = asn1_crl.CertificateList.load(der)
+        self.assertIn('issuing_distribution_point', crl_list.critical_extensions)
+        idp = crl_list.issuing_distribution_point_value
+        self.assertEqual(idp['distribution_point'].chosen[0].native,
+                         'http://example.com/ca-p2.crl')
+
+    def test_write(self):
+        """Test the streaming CRL writer."""
+        ca_key, ca_cert = certs.create_ca_certificate(self.name, bits=512)
+        now = datetime.now(pytz.utc)
+        revocations = ((serial, now, 'superseded') for serial in range(1, 5001))
+        with tempfile.TemporaryDirectory() as tmp:
+            der_path = os.path.join(tmp, 'ca.der')
+            pem_path = os.path.join(tmp, 'ca.crl')
+            crl.write_crl(revocations, 15, (ca_cert, ca_key), 1,
+                          der_path=der_path, pem_path=pem_path)
+            with open(der_path, 'rb') as der, open(pem_path, 'rb') as pem:
+                der_crl = crypto.load_crl(crypto.FILETYPE_ASN1, der.read())
+                pem_crl = crypto.load_crl(crypto.FILETYPE_PEM, pem.read())
+        self.assertEqual(len(der_crl.get_revoked()), 5000)
+        self.assertEqual(crypto.dump_crl(crypto.FILETYPE_ASN1, der_crl),
+                         crypto.dump_crl(crypto.FILETYPE_ASN1, pem_crl))
+        self.assertIsNone(crypto.verify(
+            ca_cert,
+            der_crl.to_cryptography().signature,
+            der_crl.to_cryptography().tbs_certlist_bytes,
+            "sha256",
+        ))
+
+    def test_write_entries(self):
+        """The revoked entries are written in serial order."""
+        ca_key, ca_cert = certs.create_ca_certificate(self.name, bits=512)
+        now = datetime.now(pytz.utc)
+        entries = crl.RevokedEntries()
+        for serial in range(3000, 0, -1):
+            entries.add(serial, now, 'superseded')
+        with tempfile.TemporaryDirectory() as tmp:
+            der_path = os.path.join(tmp, 'ca.der')
+            crl.write_crl(entries, 15, (ca_cert, ca_key), 1, der_path=der_path)
+            with open(der_path, 'rb') as der:
+                der = der.read()
+        revoked = crypto.load_crl(crypto.FILETYPE_ASN1, der).get_revoked()
+        self.assertEqual([int(r.get_serial(), 16) for r in revoked],
+                         list(range(1, 3001)))
+
+    def test_der_name(self):
+        """Test the names of the DER CRLs."""
+        self.assertEqual(crl.der_name('/tmp/ca.crl'), '/tmp/ca.der')
+        self.assertEqual(crl.der_name('/tmp/ca.der'), '/tmp/ca.der.der')
+        self.assertEqual(crl.der_name('/tmp.dir/ca'), '/tmp.dir/ca.der')
+
+    def test_encode_entry(self):
+        """The entries are encoded like asn1crypto does."""
+        dates = [datetime(2018, 1, 1, 10, 30), datetime(2051, 1, 1, tzinfo=pytz.utc)]
+        for serial in [1, 128, utils.new_serial()]:
+            for date in dates:
+                entry = asn1_crl.RevokedCertificate({
+                    'user_certificate': serial,
+                    'revocation_date': crl._time(date),
+                    'crl_entry_extensions': [{
+                        'extn_id': 'crl_reason',
+                        'critical': False,
+                        'extn_value': 'key_compromise',
+                    }],
+                })
+                self.assertEqual(crl.encode_entry(serial, date, 'key_compromise'),
+                                 entry.dump())
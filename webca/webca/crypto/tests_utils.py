@@ -33,6 +33,25 @@ class Utils(TestCase):
         """int_to_hex"""
         self.assertEqual('75bcd15', utils.int_to_hex(123456789))
 
+    def test_pad_serial(self):
+        """pad_serial"""
+        self.assertEqual('0' * 33 + '75bcd15', utils.pad_serial(123456789))
+        self.assertEqual(utils.pad_serial(123456789), utils.pad_serial('75BCD15'))
+        self.assertLess(utils.pad_serial(0xff), utils.pad_serial(0x100))
+
+    def test_certificate_metadata(self):
+        """certificate_metadata"""
+        ca_key, ca_cert = certs.create_ca_certificate([('CN', 'test')], bits=1024)
+        der = crypto.dump_certificate(crypto.FILETYPE_ASN1, ca_cert)
+        metadata = utils.certificate_metadata(der)
+        serial = ca_cert.get_serial_number()
+        self.assertEqual(metadata['serial'], utils.int_to_hex(serial))
+        self.assertEqual(metadata['serial_number'], utils.pad_serial(serial))
+        self.assertEqual(len(metadata['issuer_name_hash']), 40)
+        # Self-signed: the AKI is the hash of its own key
+        ski = ca_cert.get_extension(2).get_data()[2:].hex()
+        self.assertEqual(metadata['issuer_key_hash'], ski)
+
     def test_name_to_components(self):
         """name_to_components"""
         name = [
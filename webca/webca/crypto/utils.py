@@ -5,7 +5,11 @@ import secrets
 from datetime import datetime
 
 import pytz
+from asn1crypto import x509
 from cryptography import hazmat
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import dsa, ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric import utils as asym_utils
 from OpenSSL import crypto
 
 from webca.crypto import constants as c
@@ -27,6 +31,35 @@ def int_to_hex(number):
     return hex_string
 
 
+def pad_serial(serial):
+    """Convert a serial (int or hex string) into a zero-padded hex string.
+
+    Padded serials have a fixed width so they sort like the integers.
+    """
+    if not isinstance(serial, int):
+        serial = int(serial, 16)
+    return '%0*x' % (c.SERIAL_WIDTH, serial)
+
+
+def certificate_metadata(der):
+    """Return a dictionary with the values of a DER certificate
+    that are stored next to it.
+
+    `issuer_key_hash` is taken from the AuthorityKeyIdentifier,
+    which is the SHA-1 hash of the issuer public key when the
+    certificate was issued by the CA. It's empty if the extension
+    is missing.
+    """
+    cert = x509.Certificate.load(der)
+    key_identifier = cert.authority_key_identifier
+    return {
+        'serial': int_to_hex(cert.serial_number),
+        'serial_number': pad_serial(cert.serial_number),
+        'issuer_name_hash': cert.issuer.sha1.hex(),
+        'issuer_key_hash': key_identifier.hex() if key_identifier else '',
+    }
+
+
 def name_to_components(name):
     """Converts a name to a list of components.
 
@@ -143,6 +176,24 @@ def check_key_usage(key_type, key_usage, ca=False):
     return not bool(not_allowed)
 
 
+def sign_digest(key, digest):
+    """Sign a SHA256 `digest`.
+
+    `key` can be an `OpenSSL.crypto.PKey`, a `cryptography` private key
+    or a `webca.certstore.agent.RemoteKey`, that is signed by the signing agent.
+    """
+    if hasattr(key, 'sign_digest'):
+        return key.sign_digest(digest)
+    if isinstance(key, crypto.PKey):
+        key = key.to_cryptography_key()
+    algorithm = asym_utils.Prehashed(hashes.SHA256())
+    if isinstance(key, rsa.RSAPrivateKey):
+        return key.sign(digest, padding.PKCS1v15(), algorithm)
+    if isinstance(key, dsa.DSAPrivateKey):
+        return key.sign(digest, algorithm)
+    return key.sign(digest, ec.ECDSA(algorithm))
+
+
 ##################
 # Output helpers #
 ##################
@@ -173,9 +173,155 @@ EMAIL_HOST_PASSWORD = ''
 EMAIL_USE_TLS = True
 EMAIL_USE_SSL = False
 
+# OCSP responses
+# Seconds between thisUpdate and nextUpdate of the signed responses
+OCSP_RESPONSE_VALIDITY = 60 * 60 * 24
+# Seconds that a signed response is served from the cache before signing it again
+OCSP_RESPONSE_FRESHNESS = 60 * 60
+# Where signed responses are cached:
+#   'lru' - in memory, one cache per responder process. Revocations are
+#           only noticed when the revocation index of the responder is
+#           refreshed (REVOCATION_INDEX_INTERVAL)
+#   'sqlite' - a SQLite file in PATH shared by all the processes, so that
+#              revocations evict the responses of every responder. Use a
+#              path outside of the source tree, e.g. in /var/lib/webca
+OCSP_RESPONSE_CACHE = {
+    'BACKEND': 'lru',
+    'SIZE': 10000,
+    'PATH': '',
+}
+# Sign responses in advance in the CA service. Needs a shared cache ('sqlite')
+OCSP_PRESIGN = False
+# Number of responses signed in each pass of the CA service
+OCSP_PRESIGN_BATCH = 500
+
+# CA service
+# UDP port on localhost where the CA service is woken up when there is
+# something to do. Not used with PostgreSQL (NOTIFY is used instead).
+# None disables the notifications.
+CA_SERVICE_NOTIFY_PORT = 8411
+# Seconds between polls of the database. The interval doubles
+# from MIN to MAX while the service is idle.
+CA_SERVICE_POLL_MIN = 1
+CA_SERVICE_POLL_MAX = 30
+# Number of processes that issue certificates in parallel.
+# With 0 they are issued one at a time by the service itself.
+CA_SERVICE_WORKERS = 0
+# Seconds after which a request that is still being issued is taken as
+# left by a service that stopped. It's issued again when a service starts.
+CA_SERVICE_CLAIM_TIMEOUT = 600
+
+# CRLs published after new revocations
+# Seconds without new revocations before the CRLs are published
+CRL_DEBOUNCE = 10
+# Minimum seconds between publications. Revocations that keep
+# coming are published after this time anyway.
+CRL_MIN_INTERVAL = 60
+
+# Configuration cache
+# File that is replaced every time the configuration changes, so that
+# every process can cache it. It must be the same file for all the
+# processes that use the same database. Empty disables the cache.
+CONFIG_GENERATION_FILE = os.path.join(BASE_DIR, 'config.generation')
+
+# Signing agent
+# Unix socket of the process that holds the private keys and signs for
+# the other processes (manage.py signingagent). Empty to load the keys
+# and sign in every process.
+# When it's set, the OCSP responder doesn't install the certificate
+# stores and reads the certificates through the agent. The CA service
+# and the admin site still have the stores installed, because the
+# agent runs with the settings of the service and the admin site
+# imports certificates, so their database credentials can read the
+# private keys.
+SIGNING_AGENT_SOCKET = ''
+# Number of threads of the signing agent
+SIGNING_AGENT_WORKERS = 4
+
+# Revocation index
+# Seconds between the checks for new revocations made by other processes.
+# For this long, a responder with a response cache of its own ('lru') may
+# still answer that a certificate revoked by another process is good,
+# while it serves the response it had cached. With the 'sqlite' response
+# cache the revocation evicts the responses of every responder at once.
+REVOCATION_INDEX_INTERVAL = 5
+# Seconds between full reloads of the index
+REVOCATION_INDEX_RELOAD = 60 * 60
+# Number of revocation sequences below the last one seen that are read
+# again, in case they were committed late
+REVOCATION_SEQUENCE_WINDOW = 100
+
+# Template access
+# Number of users whose allowed templates are kept in each process
+TEMPLATE_ACCESS_CACHE_SIZE = 10000
+
+# Listings
+# Number of rows in each page of the lists of requests and certificates
+WEB_LIST_PAGE_SIZE = 50
+
 # Local settings
 if hasattr(settings_local, 'DATABASES'):
     DATABASES.update(settings_local.DATABASES)
 
 if hasattr(settings_local, 'ALLOWED_HOSTS'):
     ALLOWED_HOSTS.extend(settings_local.ALLOWED_HOSTS)
+
+if hasattr(settings_local, 'OCSP_RESPONSE_VALIDITY'):
+    OCSP_RESPONSE_VALIDITY = settings_local.OCSP_RESPONSE_VALIDITY
+
+if hasattr(settings_local, 'OCSP_RESPONSE_FRESHNESS'):
+    OCSP_RESPONSE_FRESHNESS = settings_local.OCSP_RESPONSE_FRESHNESS
+
+if hasattr(settings_local, 'OCSP_RESPONSE_CACHE'):
+    OCSP_RESPONSE_CACHE.update(settings_local.OCSP_RESPONSE_CACHE)
+
+if hasattr(settings_local, 'OCSP_PRESIGN'):
+    OCSP_PRESIGN = settings_local.OCSP_PRESIGN
+
+if hasattr(settings_local, 'OCSP_PRESIGN_BATCH'):
+    OCSP_PRESIGN_BATCH = settings_local.OCSP_PRESIGN_BATCH
+
+if hasattr(settings_local, 'CA_SERVICE_NOTIFY_PORT'):
+    CA_SERVICE_NOTIFY_PORT = settings_local.CA_SERVICE_NOTIFY_PORT
+
+if hasattr(settings_local, 'CA_SERVICE_POLL_MIN'):
+    CA_SERVICE_POLL_MIN = settings_local.CA_SERVICE_POLL_MIN
+
+if hasattr(settings_local, 'CA_SERVICE_POLL_MAX'):
+    CA_SERVICE_POLL_MAX = settings_local.CA_SERVICE_POLL_MAX
+
+if hasattr(settings_local, 'CA_SERVICE_WORKERS'):
+    CA_SERVICE_WORKERS = settings_local.CA_SERVICE_WORKERS
+
+if hasattr(settings_local, 'CA_SERVICE_CLAIM_TIMEOUT'):
+    CA_SERVICE_CLAIM_TIMEOUT = settings_local.CA_SERVICE_CLAIM_TIMEOUT
+
+if hasattr(settings_local, 'CRL_DEBOUNCE'):
+    CRL_DEBOUNCE = settings_local.CRL_DEBOUNCE
+
+if hasattr(settings_local, 'CRL_MIN_INTERVAL'):
+    CRL_MIN_INTERVAL = settings_local.CRL_MIN_INTERVAL
+
+if hasattr(settings_local, 'CONFIG_GENERATION_FILE'):
+    CONFIG_GENERATION_FILE = settings_local.CONFIG_GENERATION_FILE
+
+if hasattr(settings_local, 'SIGNING_AGENT_SOCKET'):
+    SIGNING_AGENT_SOCKET = settings_local.SIGNING_AGENT_SOCKET
+
+if hasattr(settings_local, 'SIGNING_AGENT_WORKERS'):
+    SIGNING_AGENT_WORKERS = settings_local.SIGNING_AGENT_WORKERS
+
+if hasattr(settings_local, 'REVOCATION_INDEX_INTERVAL'):
+    REVOCATION_INDEX_INTERVAL = settings_local.REVOCATION_INDEX_INTERVAL
+
+if hasattr(settings_local, 'REVOCATION_INDEX_RELOAD'):
+    REVOCATION_INDEX_RELOAD = settings_local.REVOCATION_INDEX_RELOAD
+
+if hasattr(settings_local, 'REVOCATION_SEQUENCE_WINDOW'):
+    REVOCATION_SEQUENCE_WINDOW = settings_local.REVOCATION_SEQUENCE_WINDOW
+
+if hasattr(settings_local, 'TEMPLATE_ACCESS_CACHE_SIZE'):
+    TEMPLATE_ACCESS_CACHE_SIZE = settings_local.TEMPLATE_ACCESS_CACHE_SIZE
+
+if hasattr(settings_local, 'WEB_LIST_PAGE_SIZE'):
+    WEB_LIST_PAGE_SIZE = settings_local.WEB_LIST_PAGE_SIZE
@@ -0,0 +1,122 @@
+"""
+Wake up the CA service when there is something for it to do.
+
+With PostgreSQL the notifications are sent with NOTIFY so they work
+across hosts. With other databases they are UDP datagrams sent to the
+service on localhost. Notifications may be lost: the service still
+polls the database, just less often.
+"""
+import logging
+import select
+import socket
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'webca_service'
+
+# Events
+REQUESTS = 'requests'
+REVOCATIONS = 'revocations'
+
+
+def _use_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def notify(event):
+    """Tell the CA service about an `event`. Errors are ignored."""
+    if _use_postgres():
+        # It's called once the changes are committed, so a failure
+        # must not turn them into an error for the user
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, event])
+        except DatabaseError as ex:
+            logger.warning('Cannot notify the CA service: %s', ex)
+        return
+    port = settings.CA_SERVICE_NOTIFY_PORT
+    if not port:
+        return
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(event.encode('ascii'), ('127.0.0.1', port))
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+def notify_on_commit(event):
+    """Notify an `event` once the current transaction is committed,
+    so that the service can see the changes."""
+    transaction.on_commit(lambda: notify(event))
+
+
+class Listener:
+    """Receive the notifications sent with `notify`.
+
+    With PostgreSQL it has a connection of its own, which is not closed
+    with the connections of Django.
+    """
+
+    def __init__(self, port=None):
+        self.socket = None
+        self.pg_connection = None
+        if _use_postgres():
+            self.pg_connection = connection.get_new_connection(
+                connection.get_connection_params())
+            self.pg_connection.autocommit = True
+            with self.pg_connection.cursor() as cursor:
+                cursor.execute('LISTEN %s' % CHANNEL)
+            return
+        port = port or settings.CA_SERVICE_NOTIFY_PORT
+        if not port:
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(('127.0.0.1', port))
+        except OSError as ex:
+            sock.close()
+            print('Cannot listen for notifications, polling only: %s' % ex)
+            return
+        sock.setblocking(False)
+        self.socket = sock
+
+    def wait(self, timeout):
+        """Wait up to `timeout` seconds for notifications.
+
+        Returns the set of events received, empty if none.
+        """
+        source = self.socket or self.pg_connection
+        if source is None:
+            time.sleep(timeout)
+            return set()
+        readable, _, _ = select.select([source], [], [], timeout)
+        events = set()
+        if not readable:
+            return events
+        if self.socket:
+            while True:
+                try:
+                    data = self.socket.recv(64)
+                except BlockingIOError:
+                    break
+                events.add(data.decode('ascii', 'replace'))
+        else:
+            self.pg_connection.poll()
+            while self.pg_connection.notifies:
+                events.add(self.pg_connection.notifies.pop(0).payload)
+        return events
+
+    def close(self):
+        """Stop listening."""
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+        if self.pg_connection:
+            self.pg_connection.close()
+            self.pg_connection = None
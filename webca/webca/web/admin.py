@@ -39,16 +39,48 @@ def cert_readonly_fields():
     ]
 
 
+class ValidityListFilter(admin.SimpleListFilter):
+    """Filter the certificates by their validity in the database."""
+    title = 'validity'
+    parameter_name = 'validity'
+
+    def lookups(self, request, model_admin):
+        return [
+            ('valid', 'Valid'),
+            ('expired', 'Expired'),
+            ('revoked', 'Revoked'),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'valid':
+            return queryset.valid()
+        if self.value() == 'expired':
+            return queryset.expired()
+        if self.value() == 'revoked':
+            return queryset.revoked()
+        return queryset
+
+
 @admin.register(Certificate, site=admin_site)
 class CertificateAdmin(admin.ModelAdmin):
     """Admin model for certificates."""
     verbose_name = 'Issued Certificates'
     list_display = ['id', '__str__', 'get_template',
-                    'user', 'valid_from', 'valid_to']
+                    'user', 'valid_from', 'valid_to', 'status']
     list_display_links = ['__str__']
+    list_filter = [ValidityListFilter]
+    list_select_related = ['csr__template', 'user']
     readonly_fields = cert_readonly_fields()
     actions = ['view_certificate', 'download_certificate']
 
+    def get_queryset(self, request):
+        # Load the revocations so that the status column doesn't query each row
+        return super().get_queryset(request).select_related('revoked')
+
+    def status(self, obj):
+        """Return the revocation status of a certificate."""
+        return obj.get_status().status
+
     def view_certificate(self, request, queryset):
         """View a text version of the certificate."""
         if len(queryset) > 1:
@@ -139,3 +171,7 @@ class RevokedAdmin(admin.ModelAdmin):
 class CRLLocationAdmin(admin.ModelAdmin):
     """Admin model for CRLLocation objects."""
     list_display = ['url', 'deleted', 'count']
+
+    def get_queryset(self, request):
+        # Count the certificates of all the locations in one query
+        return CRLLocation.with_counts(super().get_queryset(request))
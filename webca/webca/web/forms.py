@@ -4,7 +4,7 @@ from webca.crypto.constants import REV_USER
 from webca.crypto.utils import import_csr, public_key_type
 from webca.utils import dict_as_tuples
 from webca.web.fields import SubjectAltNameCertificateField
-from webca.web.models import Template
+from webca.web.models import EXTENDED_STATUS, Template
 from webca.web.validators import (valid_country_code, valid_pem_csr,
                                   validate_csr_bits, validate_csr_key_usage)
 
@@ -35,6 +35,49 @@ class TemplateSelectorForm(forms.Form):
             self.fields['template'].choices = [('', 'There are no available templates')]
 
 
+class RequestFilterForm(forms.Form):
+    """
+    Form used to filter the list of requests of a user.
+
+    Arguments:
+        template_choices: list of Template that can be chosen
+    """
+    status = forms.ChoiceField(
+        choices=[('', 'Any')] + list(EXTENDED_STATUS.items()),
+        required=False,
+        label='Status',
+    )
+    template = forms.TypedChoiceField(
+        coerce=int,
+        empty_value=None,
+        required=False,
+        label='Template',
+    )
+    expires = forms.IntegerField(
+        min_value=1,
+        max_value=3650,
+        required=False,
+        label='Expires in (days)',
+    )
+
+    def __init__(self, *args, **kwargs):
+        template_choices = kwargs.pop('template_choices', [])
+        super().__init__(*args, **kwargs)
+        self.fields['template'].choices = (
+            [('', 'Any')] + Template.get_form_choices(template_choices))
+
+    def get_filters(self):
+        """Return the filters as keyword arguments of
+        `RequestQuerySet.filter_listing` or {} if the form is not valid."""
+        if not self.is_valid():
+            return {}
+        return {
+            'status': self.cleaned_data['status'],
+            'template': self.cleaned_data['template'],
+            'expires_in': self.cleaned_data['expires'],
+        }
+
+
 class RequestNewForm(forms.Form):
     """
     Form used to create a certificate request.
@@ -1,28 +1,28 @@
 """
 Middleware for the web app.
 """
-from webca.web.models import Template
-from webca.web.rules import PERM_USE_TEMPLATE
+from django.contrib.auth.middleware import get_user
+from django.utils.functional import SimpleLazyObject
+
+from webca.web.template_access import template_access
+
+
+def _templates_of(user):
+    """Add the lazy `templates` attribute to `user`."""
+    if user.is_authenticated:
+        user.templates = SimpleLazyObject(
+            lambda: template_access.get_templates(user))
+    return user
+
 
 class TemplatePermissionsMiddleware:
-    """Adds the templates property to the User object in the request."""
+    """Adds the templates property to the User object in the request.
+
+    Neither the user nor the templates are loaded until they are used.
+    """
     def __init__(self, get_response):
         self.get_response = get_response
-        # One-time configuration and initialization.
 
     def __call__(self, request):
-        # Code to be executed for each request before
-        # the view (and later middleware) are called.
-        if request.user.is_authenticated:
-            available = []
-            for template in Template.get_enabled():
-                if request.user.has_perm(PERM_USE_TEMPLATE, template):
-                    available.append(template)
-            setattr(request.user, 'templates', available)
-
-        response = self.get_response(request)
-
-        # Code to be executed for each request/response after
-        # the view is called.
-
-        return response
+        request.user = SimpleLazyObject(lambda: _templates_of(get_user(request)))
+        return self.get_response(request)
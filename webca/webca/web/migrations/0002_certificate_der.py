@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:05
+
+from asn1crypto import pem
+from django.db import migrations, models
+
+from webca.crypto.utils import certificate_metadata
+
+
+def backfill_der(apps, schema_editor):
+    """Store the DER and the metadata of the existing certificates."""
+    db_alias = schema_editor.connection.alias
+    Certificate = apps.get_model('web', 'Certificate')
+    for cert in Certificate.objects.using(db_alias).all().iterator():
+        _, _, der = pem.unarmor(cert.x509.encode('ascii'))
+        cert.der = der
+        for name, value in certificate_metadata(der).items():
+            setattr(cert, name, value)
+        cert.save(using=db_alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='certificate',
+            name='der',
+            field=models.BinaryField(default=b'', help_text='DER of the signed certificate'),
+        ),
+        migrations.AddField(
+            model_name='certificate',
+            name='issuer_key_hash',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-1 hash of the issuer public key', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='certificate',
+            name='issuer_name_hash',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-1 hash of the issuer name', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='certificate',
+            name='serial_number',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Serial number as a zero-padded hex string that sorts like an integer', max_length=40),
+        ),
+        migrations.RunPython(backfill_der, migrations.RunPython.noop),
+    ]
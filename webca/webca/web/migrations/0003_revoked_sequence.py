@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:06
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_sequence(apps, schema_editor):
+    """Number the existing revocations in the order they were made."""
+    Revoked = apps.get_model('web', 'Revoked')
+    Revoked.objects.update(sequence=F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0002_certificate_der'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='revoked',
+            name='sequence',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False, help_text='Increases every time a revocation is saved'),
+        ),
+        migrations.RunPython(backfill_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0003_revoked_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='request',
+            name='status',
+            field=models.SmallIntegerField(choices=[(1, 'Processing'), (5, 'Issuing'), (2, 'Issued'), (3, 'Rejected'), (4, 'Error')], default=1, help_text='Status of this request'),
+        ),
+    ]
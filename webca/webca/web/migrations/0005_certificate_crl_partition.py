@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0004_request_issuing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='certificate',
+            name='crl_partition',
+            field=models.SmallIntegerField(blank=True, editable=False, help_text='Partitioned CRL where this certificate is published', null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0005_certificate_crl_partition'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='certificate',
+            name='valid_from',
+            field=models.DateTimeField(db_index=True, help_text='The certificate is valid from this date'),
+        ),
+        migrations.AlterField(
+            model_name='certificate',
+            name='valid_to',
+            field=models.DateTimeField(db_index=True, help_text='The certificate is valid until this date'),
+        ),
+        migrations.AddIndex(
+            model_name='certificate',
+            index=models.Index(fields=['user', 'valid_to'], name='web_certifi_user_id_9374f0_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:40
+
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def get_digest(location_ids):
+    ids = ','.join(str(x) for x in sorted(set(location_ids)))
+    return hashlib.sha256(ids.encode('ascii')).hexdigest()
+
+
+def add_point_sets(apps, schema_editor):
+    """Replace the certificates of each location with a set per certificate."""
+    db_alias = schema_editor.connection.alias
+    Certificate = apps.get_model('web', 'Certificate')
+    CRLPointSet = apps.get_model('web', 'CRLPointSet')
+    Through = apps.get_model('web', 'CRLLocation').certificates.through
+    locations = {}
+    for cert_id, location_id in Through.objects.using(db_alias).values_list(
+            'certificate_id', 'crllocation_id'):
+        locations.setdefault(cert_id, set()).add(location_id)
+    certificates = {}
+    for cert_id, location_ids in locations.items():
+        certificates.setdefault(frozenset(location_ids), []).append(cert_id)
+    for location_ids, cert_ids in certificates.items():
+        point_set = CRLPointSet.objects.using(db_alias).create(
+            digest=get_digest(location_ids))
+        point_set.locations.set(location_ids)
+        # In batches to stay under the limit of query parameters
+        for start in range(0, len(cert_ids), 500):
+            Certificate.objects.using(db_alias).filter(
+                id__in=cert_ids[start:start + 500]).update(crl_points=point_set)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0006_certificate_validity_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CRLPointSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(editable=False, help_text='SHA-256 of the ids of the locations', max_length=64, unique=True)),
+                ('locations', models.ManyToManyField(help_text='Locations in this set', related_name='point_sets', to='web.CRLLocation')),
+            ],
+            options={
+                'verbose_name': 'CRL Point Set',
+            },
+        ),
+        migrations.AddField(
+            model_name='certificate',
+            name='crl_points',
+            field=models.ForeignKey(blank=True, editable=False, help_text='CRL locations in the CDP extension of this certificate', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='certificates', to='web.CRLPointSet'),
+        ),
+        migrations.RunPython(add_point_sets, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='crllocation',
+            name='certificates',
+        ),
+    ]
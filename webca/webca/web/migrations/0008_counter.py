@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:52
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def add_revocations_counter(apps, schema_editor):
+    """Continue the sequence of the revocations from the last one."""
+    db_alias = schema_editor.connection.alias
+    Counter = apps.get_model('web', 'Counter')
+    Revoked = apps.get_model('web', 'Revoked')
+    last = Revoked.objects.using(db_alias).aggregate(last=Max('sequence'))['last']
+    Counter.objects.using(db_alias).create(name='revocations', value=last or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0007_crl_point_set'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(add_revocations_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0008_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='request',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the CA service started issuing this request', null=True),
+        ),
+    ]
@@ -1,14 +1,20 @@
 """Models for the public web."""
+import hashlib
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+
+from asn1crypto import pem
 from django.conf import settings
 from django.contrib.auth.models import Group, User
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 from OpenSSL import crypto
 
 from webca.crypto import constants as c
-from webca.crypto.utils import (components_to_name, name_to_components,
+from webca.crypto.utils import (certificate_metadata, components_to_name,
+                                int_to_hex, name_to_components, pad_serial,
                                 public_key_type)
 from webca.utils import dict_as_tuples, subject_display, tuples_as_dict
 from webca.web import validators
@@ -62,14 +68,95 @@ class CAUser(models.Model):
         return len(self.keys)
 
 
+# Extended status of a request, see `Request.extended_status`
+EXTENDED_STATUS = OrderedDict([
+    ('pending', 'Pending approval'),
+    ('approved', 'Approved'),
+    ('issuing', 'Issuing'),
+    ('issued', 'Issued'),
+    ('expired', 'Expired'),
+    ('revoked', 'Revoked'),
+    ('rejected', 'Rejected'),
+    ('error', 'Error'),
+])
+
+
+class RequestQuerySet(models.QuerySet):
+    """Queries of the requests listed to the users."""
+
+    def with_extended_status(self, now=None):
+        """Compute the extended status of the requests in the query.
+
+        The certificate and template are loaded in the same query so that
+        listing the requests doesn't need more queries.
+        """
+        now = now or timezone.now()
+        issued = models.Q(status=Request.STATUS_ISSUED)
+        return self.select_related('template', 'certificate').annotate(
+            extended_status_code=models.Case(
+                models.When(
+                    issued & (models.Q(certificate__valid_to__lt=now) |
+                              models.Q(certificate__valid_from__gt=now)),
+                    then=models.Value('expired'),
+                ),
+                models.When(
+                    issued & models.Q(certificate__revoked__isnull=False),
+                    then=models.Value('revoked'),
+                ),
+                models.When(issued, then=models.Value('issued')),
+                models.When(
+                    status=Request.STATUS_PROCESSING,
+                    approved=True,
+                    then=models.Value('approved'),
+                ),
+                models.When(
+                    status=Request.STATUS_PROCESSING,
+                    then=models.Value('pending'),
+                ),
+                models.When(
+                    status=Request.STATUS_ISSUING,
+                    then=models.Value('issuing'),
+                ),
+                models.When(
+                    status=Request.STATUS_REJECTED,
+                    then=models.Value('rejected'),
+                ),
+                default=models.Value('error'),
+                output_field=models.CharField(),
+            )
+        )
+
+    def filter_listing(self, status=None, template=None, expires_in=None, now=None):
+        """Filter the requests by extended status, template id and
+        whether their certificate expires in `expires_in` days.
+
+        `with_extended_status` must be called before filtering by status.
+        """
+        queryset = self
+        if status:
+            queryset = queryset.filter(extended_status_code=status)
+        if template:
+            queryset = queryset.filter(template_id=template)
+        if expires_in:
+            now = now or timezone.now()
+            queryset = queryset.filter(
+                status=Request.STATUS_ISSUED,
+                certificate__valid_to__gte=now,
+                certificate__valid_to__lte=now + timedelta(days=expires_in),
+            )
+        return queryset
+
+
 class Request(models.Model):
     """A certificate request from an end user."""
     STATUS_PROCESSING = 1
     STATUS_ISSUED = 2
     STATUS_REJECTED = 3
     STATUS_ERROR = 4
+    STATUS_ISSUING = 5
     STATUS = [
         (STATUS_PROCESSING, 'Processing'),
+        (STATUS_ISSUING, 'Issuing'),
         (STATUS_ISSUED, 'Issued'),
         (STATUS_REJECTED, 'Rejected'),
         (STATUS_ERROR, 'Error'),
@@ -114,6 +201,14 @@ class Request(models.Model):
         blank=True,
         help_text='Internal messages about this request',
     )
+    claimed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='When the CA service started issuing this request',
+    )
+
+    objects = RequestQuerySet.as_manager()
 
     class Meta:
         ordering = ['-id']
@@ -197,18 +292,62 @@ class Request(models.Model):
         """Return the request as a OpenSSL.crypto.X509Req object."""
         return crypto.load_certificate_request(crypto.FILETYPE_PEM, self.csr)
 
+    @staticmethod
+    def claim(request_id):
+        """Mark an approved request as being issued.
+
+        The status is changed with a single UPDATE so only one
+        process can claim a request. Returns if the claim succeeded.
+        """
+        claimed = Request.objects.filter(
+            pk=request_id,
+            status=Request.STATUS_PROCESSING,
+            approved=True,
+        ).update(status=Request.STATUS_ISSUING, claimed_at=timezone.now())
+        return claimed == 1
+
+    @staticmethod
+    def release(request_ids):
+        """Give up the claims of requests that were not issued, so that
+        they are issued later."""
+        return Request.objects.filter(
+            pk__in=request_ids,
+            status=Request.STATUS_ISSUING,
+        ).update(status=Request.STATUS_PROCESSING, claimed_at=None)
+
+    @staticmethod
+    def release_stale(age):
+        """Give up the claims older than `age` seconds.
+
+        They were left by a service that stopped while issuing them.
+        Claims made before `claimed_at` existed are always stale.
+        Returns the number of requests released.
+        """
+        stale = (models.Q(claimed_at__isnull=True) |
+                 models.Q(claimed_at__lt=timezone.now() - timedelta(seconds=age)))
+        return Request.objects.filter(
+            stale,
+            status=Request.STATUS_ISSUING,
+        ).update(status=Request.STATUS_PROCESSING, claimed_at=None)
+
     @property
     def extended_status(self):
         """Return the extended status of this request.
         1. Processing
         2. Pending approval
         3. Approved
-        4. Rejected
-        5. Issued
-        6. Expired
-        7. Revoked
-        8. Error
+        4. Issuing
+        5. Rejected
+        6. Issued
+        7. Expired
+        8. Revoked
+        9. Error
+
+        It's computed in the query by `RequestQuerySet.with_extended_status`.
         """
+        code = getattr(self, 'extended_status_code', None)
+        if code is not None:
+            return EXTENDED_STATUS[code]
         if self.status == self.STATUS_ISSUED and self.certificate.is_expired:
             return 'Expired'
         if self.status == self.STATUS_ISSUED and self.certificate.is_revoked:
@@ -218,12 +357,61 @@ class Request(models.Model):
         if self.status == self.STATUS_PROCESSING and self.approved:
             return 'Approved'
         if (self.status == self.STATUS_PROCESSING or self.status == self.STATUS_ISSUED or
-            self.status == self.STATUS_ERROR or self.status == self.STATUS_REJECTED):
+            self.status == self.STATUS_ERROR or self.status == self.STATUS_REJECTED or
+            self.status == self.STATUS_ISSUING):
             return self.get_status_display()
 
 
+# Status of a certificate as answered by `Certificate.lookup_status`.
+# `revocation_date` and `reason` are None unless the certificate is revoked.
+# `der` and `certificate` are None if the certificate is unknown.
+CertificateStatus = namedtuple('CertificateStatus', [
+    'serial', 'status', 'revocation_date', 'reason', 'der', 'certificate',
+])
+
+
+def valid_certificates(now=None, prefix=''):
+    """Return a Q that selects the certificates that are valid at `now`:
+    within their validity period and not revoked.
+
+    `prefix` is the path to the certificate from the model being queried,
+    like 'certificates__'.
+    """
+    now = now or timezone.now()
+    return models.Q(**{
+        prefix + 'valid_from__lte': now,
+        prefix + 'valid_to__gte': now,
+        prefix + 'revoked__isnull': True,
+    })
+
+
+class CertificateQuerySet(models.QuerySet):
+    """Queries of the certificates by their validity.
+
+    The states are computed in the database like `Certificate.is_expired`
+    and `Certificate.is_revoked` do in Python.
+    """
+
+    def valid(self, now=None):
+        """Certificates within their validity period and not revoked."""
+        return self.filter(valid_certificates(now))
+
+    def expired(self, now=None):
+        """Certificates out of their validity period."""
+        now = now or timezone.now()
+        return self.filter(models.Q(valid_from__gt=now) | models.Q(valid_to__lt=now))
+
+    def revoked(self):
+        """Revoked certificates."""
+        return self.filter(revoked__isnull=False)
+
+
 class Certificate(models.Model):
     """An issued certificate."""
+    STATUS_GOOD = 'good'
+    STATUS_REVOKED = 'revoked'
+    STATUS_UNKNOWN = 'unknown'
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.DO_NOTHING,
@@ -236,24 +424,71 @@ class Certificate(models.Model):
         help_text='PEM of the signed certificate',
         validators=[validators.valid_pem_cer],
     )
+    der = models.BinaryField(
+        editable=False,
+        default=b'',
+        help_text='DER of the signed certificate',
+    )
     serial = models.CharField(
         max_length=100,
         help_text='Serial number of the certificate as an hex string',
         db_index=True,
     )
+    serial_number = models.CharField(
+        max_length=c.SERIAL_WIDTH,
+        editable=False,
+        blank=True,
+        db_index=True,
+        help_text='Serial number as a zero-padded hex string that sorts like an integer',
+    )
+    issuer_name_hash = models.CharField(
+        max_length=40,
+        editable=False,
+        blank=True,
+        help_text='SHA-1 hash of the issuer name',
+    )
+    issuer_key_hash = models.CharField(
+        max_length=40,
+        editable=False,
+        blank=True,
+        help_text='SHA-1 hash of the issuer public key',
+    )
     subject = models.CharField(
         max_length=255,
         help_text='Subject of this certificate',
     )
     valid_from = models.DateTimeField(
+        db_index=True,
         help_text='The certificate is valid from this date',
     )
     valid_to = models.DateTimeField(
+        db_index=True,
         help_text='The certificate is valid until this date',
     )
+    crl_partition = models.SmallIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Partitioned CRL where this certificate is published',
+    )
+    crl_points = models.ForeignKey(
+        'CRLPointSet',
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.PROTECT,
+        related_name='certificates',
+        help_text='CRL locations in the CDP extension of this certificate',
+    )
+
+    objects = CertificateQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Issued certificate'
+        indexes = [
+            # The certificates of a user that have not expired
+            models.Index(fields=['user', 'valid_to']),
+        ]
 
     def __str__(self):
         return subject_display(self.subject)
@@ -261,9 +496,63 @@ class Certificate(models.Model):
     def __repr__(self):
         return '<Certificate %s>' % str(self)
 
+    def save(self, *args, **kwargs):
+        # Keep the DER and the metadata in sync with the PEM
+        der = self.get_der(cached=False)
+        if bytes(self.der) != der:
+            self.der = der
+            for name, value in certificate_metadata(der).items():
+                setattr(self, name, value)
+        super().save(*args, **kwargs)
+
     def get_certificate(self):
         """Return the certificate as a OpenSSL.crypto.X509 object."""
-        return crypto.load_certificate(crypto.FILETYPE_PEM, self.x509)
+        return crypto.load_certificate(crypto.FILETYPE_ASN1, self.get_der())
+
+    def get_der(self, cached=True):
+        """Return the DER bytes of the certificate."""
+        if cached and self.der:
+            return bytes(self.der)
+        _, _, der = pem.unarmor(self.x509.encode('ascii'))
+        return der
+
+    def get_status(self):
+        """Return the `CertificateStatus` of this certificate.
+
+        No query is made if the revocation was loaded with
+        `select_related('revoked')`.
+        """
+        if self.is_revoked:
+            return CertificateStatus(
+                self.serial, Certificate.STATUS_REVOKED,
+                self.revoked.date, self.revoked.reason,
+                self.get_der(), self,
+            )
+        return CertificateStatus(
+            self.serial, Certificate.STATUS_GOOD,
+            None, None, self.get_der(), self,
+        )
+
+    @staticmethod
+    def lookup_status(serials):
+        """Return the status of a list of certificates with a single query.
+
+        `serials` may be ints or hex strings. Returns a dictionary of
+        hex serial -> `CertificateStatus` with an entry for every serial.
+        Serials that were not issued by the CA have STATUS_UNKNOWN.
+        """
+        serials = [serial if isinstance(serial, int) else int(serial, 16)
+                   for serial in serials]
+        certificates = Certificate.objects.filter(
+            serial_number__in=[pad_serial(serial) for serial in serials],
+        ).select_related('revoked')
+        statuses = {cert.serial: cert.get_status() for cert in certificates}
+        for serial in serials:
+            serial = int_to_hex(serial)
+            if serial not in statuses:
+                statuses[serial] = CertificateStatus(
+                    serial, Certificate.STATUS_UNKNOWN, None, None, None, None)
+        return statuses
 
     def get_template(self):
         """Return the template used to sign this certificate."""
@@ -278,8 +567,15 @@ class Certificate(models.Model):
 
     @property
     def is_revoked(self):
-        """Return if the certificate has been revoked."""
-        return hasattr(self, 'revoked')
+        """Return if the certificate has been revoked.
+
+        The revocation index is used unless the revocation was loaded
+        with `select_related('revoked')`.
+        """
+        if Certificate.revoked.is_cached(self):
+            return hasattr(self, 'revoked')
+        from webca.web.revocation_index import revocation_index
+        return revocation_index.is_revoked(self.serial)
 
     @property
     def is_valid(self):
@@ -584,6 +880,12 @@ class Revoked(models.Model):
         choices=dict_as_tuples(c.REV_REASON),
         default=c.REV_UNSPECIFIED
     )
+    sequence = models.BigIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        help_text='Increases every time a revocation is saved',
+    )
 
     def __str__(self):
         return '{} ({})'.format(
@@ -594,10 +896,116 @@ class Revoked(models.Model):
     def __repr__(self):
         return '<Revoked %s>' % str(self.certificate)
 
+    def save(self, *args, **kwargs):
+        # The readers of the revocations look for the ones with a sequence
+        # greater than the last one they saw (see RevocationCursor). The
+        # counter stays locked until the revocation is committed, so the
+        # sequences are committed in order.
+        with transaction.atomic(using=kwargs.get('using')):
+            self.sequence = Counter.next_value(
+                Counter.REVOCATIONS, using=kwargs.get('using'))
+            super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Revoked certificate'
 
 
+class RevocationCursor:
+    """Follow the revocations by their sequence.
+
+    `read` returns the revocations saved since the last call. The
+    sequences are committed in order, but the last `window` sequences
+    are read again anyway in case one was committed late. The ones
+    already read are skipped.
+    """
+
+    def __init__(self, sequence=0, window=None):
+        if window is None:
+            window = settings.REVOCATION_SEQUENCE_WINDOW
+        self.window = window
+        self.sequence = sequence
+        self.seen = set()
+
+    def mark(self, sequence):
+        """Take the revocation with `sequence` as read."""
+        self.seen.add(sequence)
+        self.sequence = max(self.sequence, sequence)
+        if len(self.seen) > 2 * self.window:
+            self._prune()
+
+    def skip(self, queryset, sequence):
+        """Take the revocations of `queryset` up to `sequence` as read."""
+        self.sequence = max(self.sequence, sequence)
+        for seen in queryset.filter(
+                sequence__gt=self.sequence - self.window,
+                sequence__lte=sequence).values_list('sequence', flat=True):
+            self.mark(seen)
+
+    def _prune(self):
+        # Sequences below the window are never read again
+        low = self.sequence - self.window
+        self.seen = {sequence for sequence in self.seen if sequence > low}
+
+    def read(self, queryset, *fields):
+        """Return a list with the `fields` and the sequence of the
+        revocations of `queryset` that have not been read, ordered by
+        sequence."""
+        revocations = queryset.filter(
+            sequence__gt=self.sequence - self.window,
+        ).order_by('sequence').values_list(*(fields + ('sequence',)))
+        rows = []
+        for row in revocations:
+            if row[-1] in self.seen:
+                continue
+            self.mark(row[-1])
+            rows.append(row)
+        self._prune()
+        return rows
+
+
+class Counter(models.Model):
+    """A named counter."""
+    REVOCATIONS = 'revocations'
+    # Increased every time a revocation is deleted
+    REVOCATION_DELETIONS = 'revocation_deletions'
+
+    name = models.CharField(
+        max_length=50,
+        unique=True,
+    )
+    value = models.BigIntegerField(
+        default=0,
+    )
+
+    def __str__(self):
+        return '{}={}'.format(self.name, self.value)
+
+    @staticmethod
+    def next_value(name, using=None):
+        """Increase the counter `name` and return its new value.
+
+        Called in a transaction, the counter is locked until it's committed.
+        """
+        counters = Counter.objects.using(using).filter(name=name)
+        with transaction.atomic(using=using):
+            if not counters.update(value=models.F('value') + 1):
+                try:
+                    with transaction.atomic(using=using):
+                        Counter.objects.using(using).create(name=name, value=1)
+                    return 1
+                except IntegrityError:
+                    # Created at the same time by another process
+                    counters.update(value=models.F('value') + 1)
+            return counters.values_list('value', flat=True).get()
+
+    @staticmethod
+    def get_value(name, using=None):
+        """Return the value of the counter `name`, 0 if it doesn't exist."""
+        value = Counter.objects.using(using).filter(
+            name=name).values_list('value', flat=True).first()
+        return value or 0
+
+
 class CRLLocation(models.Model):
     """Represents a URL that points to a CRL location."""
     
@@ -608,10 +1016,6 @@ class CRLLocation(models.Model):
         default=False,
         help_text='Has this URL been deleted?',
     )
-    certificates = models.ManyToManyField(
-        Certificate,
-        help_text='Certificates using this location',
-    )
 
     def __str__(self):
         return 'CRL: {}'.format(self.url)
@@ -624,9 +1028,26 @@ class CRLLocation(models.Model):
 
     @property
     def count(self):
-        """Return the number of valid certificates that have this location in their CRL extension."""
-        certs = [x for x in self.certificates.all() if x.is_valid]
-        return len(certs)
+        """Return the number of valid certificates that have this location in their CRL extension.
+
+        It's read from `valid_count` if the location was loaded with `with_counts`.
+        """
+        if hasattr(self, 'valid_count'):
+            return self.valid_count
+        return Certificate.objects.filter(crl_points__locations=self).valid().count()
+
+    @staticmethod
+    def with_counts(queryset=None, now=None):
+        """Annotate the locations with the number of valid certificates as `valid_count`.
+
+        The certificates are counted through their `CRLPointSet` in one grouped query.
+        """
+        if queryset is None:
+            queryset = CRLLocation.objects.all()
+        return queryset.annotate(valid_count=models.Count(
+            'point_sets__certificates',
+            filter=valid_certificates(now, prefix='point_sets__certificates__'),
+        ))
 
     @staticmethod
     def get_locations():
@@ -634,6 +1055,64 @@ class CRLLocation(models.Model):
         return CRLLocation.objects.filter(deleted=False)
 
 
+class CRLPointSet(models.Model):
+    """The set of CRL locations in the CDP extension of issued certificates.
+
+    Sets are never changed once created, so all the certificates issued
+    with the same locations share the same set and issuing a certificate
+    doesn't add any rows.
+    """
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+        editable=False,
+        help_text='SHA-256 of the ids of the locations',
+    )
+    locations = models.ManyToManyField(
+        CRLLocation,
+        related_name='point_sets',
+        help_text='Locations in this set',
+    )
+
+    def __str__(self):
+        return 'CRL points: {}'.format(
+            ', '.join(location.url for location in self.locations.all()))
+
+    def __repr__(self):
+        return '<CRLPointSet %s>' % self.digest
+
+    class Meta:
+        verbose_name = 'CRL Point Set'
+
+    @staticmethod
+    def get_digest(location_ids):
+        """Return the digest of a set of location ids."""
+        ids = ','.join(str(x) for x in sorted(set(location_ids)))
+        return hashlib.sha256(ids.encode('ascii')).hexdigest()
+
+    @staticmethod
+    def for_locations(locations):
+        """Return the set of `locations` or None if it's empty.
+
+        The set is created if it didn't exist.
+        """
+        ids = [location.id for location in locations]
+        if not ids:
+            return None
+        digest = CRLPointSet.get_digest(ids)
+        point_set = CRLPointSet.objects.filter(digest=digest).first()
+        if point_set is not None:
+            return point_set
+        try:
+            with transaction.atomic():
+                point_set = CRLPointSet.objects.create(digest=digest)
+                point_set.locations.set(ids)
+        except IntegrityError:
+            # Created at the same time by another process
+            point_set = CRLPointSet.objects.get(digest=digest)
+        return point_set
+
+
 """
 TODO: define policies
 class PolicyInformation(models.Model):
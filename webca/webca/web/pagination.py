@@ -0,0 +1,80 @@
+"""
+Keyset pagination of the listings shown to the users.
+
+The pages are ordered by descending id and delimited by the ids of
+their first and last rows, so getting any page costs the same
+whatever its position, unlike OFFSET.
+"""
+from django.conf import settings
+
+
+class KeysetPage:
+    """A page of rows ordered by descending id.
+
+    `next_id` and `previous_id` are the values of the `after` and
+    `before` parameters that get the next and the previous pages, or
+    None if there are no more rows in that direction.
+    """
+
+    def __init__(self, rows, next_id=None, previous_id=None):
+        self.rows = rows
+        self.next_id = next_id
+        self.previous_id = previous_id
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __bool__(self):
+        return bool(self.rows)
+
+    @property
+    def has_other_pages(self):
+        """Is there any page before or after this one?"""
+        return self.next_id is not None or self.previous_id is not None
+
+
+def _parse_id(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def paginate(queryset, params, size=None):
+    """Return the `KeysetPage` of `queryset` selected by `params`.
+
+    `params` is a dictionary like `request.GET`. Its `after` parameter
+    selects the rows with an id lower than it and `before` the rows with
+    an id greater than it. Invalid values are ignored.
+
+    A single query is made, which reads one more row than `size` to know
+    if there are more rows after the page.
+    """
+    size = size or settings.WEB_LIST_PAGE_SIZE
+    after = _parse_id(params.get('after'))
+    before = _parse_id(params.get('before'))
+    if before is not None and after is None:
+        rows = list(queryset.filter(id__gt=before).order_by('id')[:size + 1])
+        more = len(rows) > size
+        rows = rows[:size]
+        rows.reverse()
+        return KeysetPage(
+            rows,
+            # The rows after the page exist, at least the one with `before`
+            next_id=rows[-1].id if rows else None,
+            previous_id=rows[0].id if rows and more else None,
+        )
+    if after is not None:
+        queryset = queryset.filter(id__lt=after)
+    rows = list(queryset.order_by('-id')[:size + 1])
+    more = len(rows) > size
+    rows = rows[:size]
+    return KeysetPage(
+        rows,
+        next_id=rows[-1].id if rows and more else None,
+        previous_id=rows[0].id if rows and after is not None else None,
+    )
@@ -0,0 +1,155 @@
+"""
+In-memory index of the revoked certificates.
+
+Each process keeps its own index so that the revocation status of a
+certificate can be answered without a query.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+
+from webca.web.models import RevocationCursor, Revoked
+
+MASK = (1 << 64) - 1
+
+
+def _split(serial):
+    """Split a serial (int or hex string) into its high and low 64 bits."""
+    if not isinstance(serial, int):
+        serial = int(serial, 16)
+    return serial >> 64, serial & MASK
+
+
+class RevocationIndex:
+    """Sorted index of the serials of the revoked certificates.
+
+    Serials are kept in two arrays with their high and low 64 bits,
+    sorted by (high, low), and looked up with a binary search.
+    The revocation dates and reasons are kept in arrays too.
+    Serials issued by the CA are `constants.SERIAL_BYTES` long so
+    they always fit in 128 bits.
+
+    The index is updated with the revocations that have not been seen
+    yet, see `RevocationCursor`. That's done at most every
+    `interval` seconds or when `invalidate` is called. Since deleted
+    revocations can't be seen that way, the index is fully reloaded
+    every `reload` seconds.
+    """
+
+    def __init__(self, interval=None, reload=None):
+        if interval is None:
+            interval = settings.REVOCATION_INDEX_INTERVAL
+        if reload is None:
+            reload = settings.REVOCATION_INDEX_RELOAD
+        self.interval = interval
+        self.reload = reload
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self.high = array('Q')
+        self.low = array('Q')
+        self.dates = array('d')
+        self.reasons = array('b')
+        self.cursor = RevocationCursor()
+        self.loaded_at = 0
+        self.refreshed_at = 0
+        self.stale = True
+
+    def __len__(self):
+        return len(self.high)
+
+    def _find(self, high, low):
+        """Return the position of a serial or where it should be inserted,
+        and whether it was found."""
+        start = bisect_left(self.high, high)
+        end = bisect_right(self.high, high, start)
+        pos = bisect_left(self.low, low, start, end)
+        return pos, pos < end and self.low[pos] == low
+
+    def _add(self, serial, date, reason):
+        high, low = _split(serial)
+        pos, found = self._find(high, low)
+        if found:
+            self.dates[pos] = date.timestamp()
+            self.reasons[pos] = reason
+            return
+        self.high.insert(pos, high)
+        self.low.insert(pos, low)
+        self.dates.insert(pos, date.timestamp())
+        self.reasons.insert(pos, reason)
+
+    def load(self):
+        """Load all the revocations."""
+        rows = []
+        cursor = RevocationCursor()
+        for serial, date, reason, sequence in Revoked.objects.values_list(
+                'certificate__serial', 'date', 'reason', 'sequence'):
+            rows.append((_split(serial), date.timestamp(), reason))
+            cursor.mark(sequence)
+        rows.sort()
+        with self._lock:
+            self._clear()
+            for (high, low), date, reason in rows:
+                self.high.append(high)
+                self.low.append(low)
+                self.dates.append(date)
+                self.reasons.append(reason)
+            self.cursor = cursor
+            self.loaded_at = self.refreshed_at = time.time()
+            self.stale = False
+
+    def refresh(self):
+        """Add the revocations made since the last refresh.
+
+        Does nothing if the index was refreshed less than `interval`
+        seconds ago, unless it has been invalidated.
+        """
+        now = time.time()
+        if now - self.loaded_at > self.reload:
+            self.load()
+            return
+        if not self.stale and now - self.refreshed_at < self.interval:
+            return
+        with self._lock:
+            revocations = self.cursor.read(
+                Revoked.objects.all(), 'certificate__serial', 'date', 'reason')
+            for serial, date, reason, _ in revocations:
+                self._add(serial, date, reason)
+            self.refreshed_at = now
+            self.stale = False
+
+    def invalidate(self, reload=False):
+        """Check for new revocations in the next lookup.
+
+        With `reload` the whole index is loaded again, which is needed
+        to notice deleted revocations.
+        """
+        self.stale = True
+        if reload:
+            self.loaded_at = 0
+
+    def get(self, serial):
+        """Return a (date, reason) tuple if the certificate is revoked or None."""
+        self.refresh()
+        high, low = _split(serial)
+        if high > MASK:
+            return None
+        with self._lock:
+            pos, found = self._find(high, low)
+            if not found:
+                return None
+            date = datetime.fromtimestamp(self.dates[pos], pytz.utc)
+            return date, self.reasons[pos]
+
+    def is_revoked(self, serial):
+        """Return if the certificate with this serial has been revoked."""
+        return self.get(serial) is not None
+
+
+revocation_index = RevocationIndex()
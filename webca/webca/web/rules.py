@@ -12,12 +12,8 @@ PERM_USE_TEMPLATE = 'web.use_template'
 @rules.Predicate
 def use_template(user, template):
     """Check if the user is member of a group allowed to use the template."""
-    user_groups = user.groups.all()
-    allowed = template.allowed_groups.all()
-    for group in allowed:
-        if group in user_groups:
-            return True
-    return False
+    from webca.web.template_access import template_access
+    return template.id in template_access.group_ids(user)
 
 # Rules
 rules.add_perm(PERM_USE_TEMPLATE, use_template)
@@ -2,11 +2,19 @@
 Model signals.
 """
 
-from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
 from django.dispatch import receiver
 
-from webca.web.models import CAUser
+from webca.ca_ocsp.cache import get_response_cache
+from webca.ca_service.profiles import profile_cache
+from webca.utils import notify
+from webca.web.models import (CAUser, Counter, CRLLocation, Request, Revoked,
+                              Template)
+from webca.web.revocation_index import revocation_index
+from webca.web.template_access import template_access
 
 
 @receiver(post_save, sender=User)
@@ -17,3 +25,74 @@ def save_ca_user(sender, instance, **kwargs):
     except CAUser.DoesNotExist:
         CAUser.objects.create(user=instance)
     instance.ca_user.save()
+
+
+@receiver(post_save, sender=Revoked)
+@receiver(post_delete, sender=Revoked)
+def evict_ocsp_response(sender, instance, **kwargs):
+    """Remove the cached OCSP responses of a revoked or unrevoked certificate."""
+    serial = instance.certificate.serial
+    transaction.on_commit(lambda: get_response_cache().evict(serial))
+
+
+@receiver(post_save, sender=Revoked)
+def invalidate_revocation_index(sender, instance, **kwargs):
+    """Pick up the revocation in the index of this process.
+
+    The index is invalidated again after the commit in case
+    it was refreshed in the meantime.
+    """
+    revocation_index.invalidate()
+    transaction.on_commit(revocation_index.invalidate)
+
+
+@receiver(post_delete, sender=Revoked)
+def reload_revocation_index(sender, instance, **kwargs):
+    """Reload the index of this process, since deletions can't be
+    picked up incrementally."""
+    revocation_index.invalidate(reload=True)
+    transaction.on_commit(lambda: revocation_index.invalidate(reload=True))
+
+
+@receiver(post_delete, sender=Revoked)
+def count_revocation_deletion(sender, instance, using, **kwargs):
+    """Tell the readers of the revocations that one has been deleted,
+    since they only see the new ones."""
+    Counter.next_value(Counter.REVOCATION_DELETIONS, using=using)
+
+
+@receiver(post_save, sender=Request)
+def notify_request(sender, instance, **kwargs):
+    """Wake up the CA service if the request can be issued."""
+    if instance.status == Request.STATUS_PROCESSING and instance.approved:
+        notify.notify_on_commit(notify.REQUESTS)
+
+
+@receiver(post_save, sender=Revoked)
+def notify_revocation(sender, instance, **kwargs):
+    """Wake up the CA service to update the CRL and OCSP responses."""
+    notify.notify_on_commit(notify.REVOCATIONS)
+
+
+@receiver(post_save, sender=Template)
+@receiver(post_delete, sender=Template)
+@receiver(m2m_changed, sender=Template.allowed_groups.through)
+def templates_changed(sender, **kwargs):
+    """Resolve again the templates that users can use."""
+    if kwargs.get('action', 'post_').startswith('post_'):
+        template_access.templates_changed()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(post_delete, sender=Group)
+def groups_changed(sender, **kwargs):
+    """Resolve again the templates that users can use."""
+    if kwargs.get('action', 'post_').startswith('post_'):
+        template_access.groups_changed()
+
+
+@receiver(post_save, sender=CRLLocation)
+@receiver(post_delete, sender=CRLLocation)
+def crl_locations_changed(sender, **kwargs):
+    """Compile again the issuance profiles with the new CRL locations."""
+    profile_cache.locations_changed()
@@ -0,0 +1,138 @@
+"""
+Cache of the templates that each user can use.
+
+Each process keeps the enabled templates and the ids of the templates
+allowed to the users it has seen, so that they can be known without
+a query per template.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+
+from webca.config import constants as parameters
+from webca.config.models import ConfigurationObject as Config
+from webca.web.models import Template
+
+# Version of a cache that has not loaded the templates yet
+_UNKNOWN = object()
+
+
+class TemplateAccess:
+    """Resolve the templates a user is allowed to use.
+
+    A user can use the enabled templates that are allowed to any of
+    their groups. Superusers can use all of them.
+
+    The results are kept until the TEMPLATES_VERSION or GROUPS_VERSION
+    parameters change, which happens every time a template or the
+    membership of a group is saved (see `webca.web.signals`). They are
+    read from the configuration cache, so checking them doesn't need
+    any query.
+    """
+
+    def __init__(self, size=None):
+        if size is None:
+            size = settings.TEMPLATE_ACCESS_CACHE_SIZE
+        self.size = size
+        self._lock = threading.Lock()
+        self._templates_version = _UNKNOWN
+        self._templates = []
+        self._users = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def versions():
+        """Return the current (templates version, groups version)."""
+        return (
+            Config.get_value(parameters.TEMPLATES_VERSION),
+            Config.get_value(parameters.GROUPS_VERSION),
+        )
+
+    def enabled(self, version=None):
+        """Return the list of enabled templates."""
+        if version is None:
+            version = self.versions()[0]
+        with self._lock:
+            if self._templates_version == version:
+                return self._templates
+        templates = Template.get_enabled()
+        with self._lock:
+            self._templates_version = version
+            self._templates = templates
+        return templates
+
+    def _resolve(self, user):
+        """Return (ids of the templates allowed to the groups of `user`,
+        ids of the templates `user` can use)."""
+        versions = self.versions()
+        key = versions + (user.is_active and user.is_superuser,)
+        with self._lock:
+            entry = self._users.get(user.pk)
+            if entry is not None and entry[0] == key:
+                self._users.move_to_end(user.pk)
+                self.hits += 1
+                return entry[1]
+        group_ids = set(Template.objects.filter(
+            allowed_groups__user=user,
+        ).values_list('id', flat=True).distinct())
+        enabled = {template.id for template in self.enabled(versions[0])}
+        if key[2]:
+            allowed = enabled
+        else:
+            allowed = group_ids & enabled
+        with self._lock:
+            self.misses += 1
+            self._users[user.pk] = (key, (group_ids, allowed))
+            self._users.move_to_end(user.pk)
+            while len(self._users) > self.size:
+                self._users.popitem(last=False)
+        return group_ids, allowed
+
+    def group_ids(self, user):
+        """Return the set of ids of the templates allowed to the groups
+        of `user`, enabled or not."""
+        return self._resolve(user)[0]
+
+    def allowed_ids(self, user):
+        """Return the set of ids of the templates `user` can use."""
+        return self._resolve(user)[1]
+
+    def get_templates(self, user):
+        """Return the list of templates `user` can use."""
+        allowed = self.allowed_ids(user)
+        if not allowed:
+            return []
+        return [template
+                for template in self.enabled()
+                if template.id in allowed]
+
+    def invalidate(self):
+        """Forget everything cached in this process."""
+        with self._lock:
+            self._templates_version = _UNKNOWN
+            self._templates = []
+            self._users = OrderedDict()
+
+    def templates_changed(self):
+        """Tell every process that the templates have changed."""
+        self.invalidate()
+        Config.set_value(parameters.TEMPLATES_VERSION, uuid.uuid4().hex)
+
+    def groups_changed(self):
+        """Tell every process that the groups of the users have changed."""
+        self.invalidate()
+        Config.set_value(parameters.GROUPS_VERSION, uuid.uuid4().hex)
+
+    def stats(self):
+        """Return a dictionary with the hit/miss counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'users': len(self._users),
+        }
+
+
+template_access = TemplateAccess()
@@ -1,3 +1,637 @@
-from django.test import TestCase
+"""
+Test the web application.
+"""
+import importlib
+import pickle
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import pytz
+from django.contrib.auth.models import Group, User
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from OpenSSL import crypto
+
+from webca.ca_service.profiles import profile_cache
+from webca.ca_service.service import CAService
+from webca.config.cache import config_cache
+from webca.crypto import certs
+from webca.crypto import constants as c
+from webca.crypto.utils import export_certificate, new_serial, pad_serial
+from webca.utils import notify
+from webca.web.middleware import TemplatePermissionsMiddleware
+from webca.web.models import (Certificate, Counter, CRLLocation,
+                              CRLPointSet, Request, RevocationCursor,
+                              Revoked, Template)
+from webca.web.pagination import paginate
+from webca.web.revocation_index import RevocationIndex
+from webca.web.rules import PERM_USE_TEMPLATE
+from webca.web.template_access import template_access
+
+
+class ServiceWithoutCA(CAService):
+    """A CA service that doesn't need the CA certificates."""
+
+    def refresh_certificates(self):
+        pass
+
+
+class CertificateTest(TestCase):
+    """Test the DER and the metadata stored with the certificates."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.net')
+        template = Template.objects.create(
+            name='test', days=1, enabled=True, key_usage=['digitalSignature'])
+        # bulk_create doesn't call save() so no CSR is needed
+        Request.objects.bulk_create([
+            Request(user=self.user, subject='/CN=test', template=template)
+        ])
+        self.request = Request.objects.get()
+        self.key, self.cert = certs.create_ca_certificate(
+            [('CN', 'test')], bits=512)
+
+    def new_certificate(self, cert):
+        now = timezone.now()
+        return Certificate(
+            user=self.user, csr=self.request, subject='/CN=test',
+            x509=export_certificate(cert),
+            valid_from=now, valid_to=now + timedelta(days=1))
+
+    def check_metadata(self, certificate, cert):
+        der = crypto.dump_certificate(crypto.FILETYPE_ASN1, cert)
+        self.assertEqual(bytes(certificate.der), der)
+        self.assertEqual(certificate.serial, '%x' % cert.get_serial_number())
+        self.assertEqual(certificate.serial_number,
+                         pad_serial(cert.get_serial_number()))
+        self.assertEqual(len(certificate.issuer_name_hash), 40)
+
+    def test_save(self):
+        """The DER and the metadata follow the PEM."""
+        certificate = self.new_certificate(self.cert)
+        certificate.save()
+        certificate.refresh_from_db()
+        self.check_metadata(certificate, self.cert)
+        _, other = certs.create_ca_certificate([('CN', 'other')], bits=512)
+        certificate.x509 = export_certificate(other)
+        certificate.save()
+        certificate.refresh_from_db()
+        self.check_metadata(certificate, other)
+
+    def test_backfill(self):
+        """The migration stores the DER of the existing certificates."""
+        # bulk_create doesn't call save() so the DER is not stored
+        Certificate.objects.bulk_create([self.new_certificate(self.cert)])
+        self.assertEqual(bytes(Certificate.objects.get().der), b'')
+        migration = importlib.import_module(
+            'webca.web.migrations.0002_certificate_der')
+        state = MigrationLoader(connection).project_state(
+            ('web', '0002_certificate_der'))
+        migration.backfill_der(
+            state.apps, SimpleNamespace(connection=connection))
+        self.check_metadata(Certificate.objects.get(), self.cert)
+
+
+class RevocationIndexTest(TestCase):
+    """Test the in-memory revocation index."""
+
+    def build_index(self):
+        index = RevocationIndex(interval=3600, reload=3600)
+        # Pretend it was just loaded so that lookups don't query
+        index.loaded_at = index.refreshed_at = time.time()
+        index.stale = False
+        return index
+
+    def test_lookup(self):
+        """Revoked serials are found, the rest are not."""
+        index = self.build_index()
+        when = datetime(2018, 1, 1, tzinfo=pytz.utc)
+        serials = [new_serial() for _ in range(50)] + [1, 1 << 64, (1 << 64) + 1]
+        for serial in serials:
+            index._add(serial, when, c.REV_KEYCOMPROMISE)
+        self.assertEqual(len(index), len(serials))
+        for serial in serials:
+            self.assertEqual(index.get(serial), (when, c.REV_KEYCOMPROMISE))
+            self.assertTrue(index.is_revoked('%x' % serial))
+        self.assertFalse(index.is_revoked(2))
+        self.assertFalse(index.is_revoked((1 << 64) + 2))
+        self.assertFalse(index.is_revoked(1 << 130))
+
+    def test_update(self):
+        """Adding a serial again updates its reason."""
+        index = self.build_index()
+        when = datetime(2018, 1, 1, tzinfo=pytz.utc)
+        index._add(10, when, c.REV_UNSPECIFIED)
+        index._add(10, when, c.REV_SUPERSEDED)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.get(10)[1], c.REV_SUPERSEDED)
+
+    def test_load(self):
+        """Loading an empty table."""
+        index = RevocationIndex()
+        self.assertFalse(index.is_revoked(1))
+        self.assertFalse(index.stale)
+        self.assertEqual(len(index), 0)
+
+
+class RevocationSequenceTest(TestCase):
+    """Test how the revocations are numbered and followed."""
+
+    def setUp(self):
+        user = User.objects.create_user('test', 'test@test.net')
+        template = Template.objects.create(
+            name='test', days=1, enabled=True, key_usage=['digitalSignature'])
+        # bulk_create doesn't call save() so no CSR or PEM is needed
+        Request.objects.bulk_create([
+            Request(user=user, subject='/CN=test', template=template)
+            for _ in range(5)
+        ])
+        now = timezone.now()
+        Certificate.objects.bulk_create([
+            Certificate(user=user, csr=request, subject='/CN=test',
+                        serial='%x' % (request.id + 0x1000),
+                        valid_from=now, valid_to=now + timedelta(days=1))
+            for request in Request.objects.order_by('id')
+        ])
+        self.certificates = list(Certificate.objects.order_by('id'))
+
+    def test_counter(self):
+        """The counter is created the first time and then increased."""
+        self.assertEqual(Counter.next_value('test'), 1)
+        self.assertEqual(Counter.next_value('test'), 2)
+        self.assertEqual(Counter.next_value('other'), 1)
+        self.assertEqual(Counter.objects.get(name='test').value, 2)
+
+    def test_save(self):
+        """Every save gets a greater sequence, also saving again."""
+        first = Revoked.objects.create(certificate=self.certificates[0])
+        second = Revoked.objects.create(certificate=self.certificates[1])
+        self.assertLess(first.sequence, second.sequence)
+        first.reason = c.REV_SUPERSEDED
+        first.save()
+        self.assertGreater(first.sequence, second.sequence)
+        self.assertEqual(
+            Counter.objects.get(name=Counter.REVOCATIONS).value, first.sequence)
+
+    def test_cursor(self):
+        """Late sequences inside the window are read, and only once."""
+        cursor = RevocationCursor(window=10)
+        Revoked.objects.bulk_create([
+            Revoked(certificate=self.certificates[0], sequence=5),
+            Revoked(certificate=self.certificates[1], sequence=8),
+        ])
+        rows = cursor.read(Revoked.objects.all(), 'certificate__serial')
+        self.assertEqual([row[-1] for row in rows], [5, 8])
+        self.assertEqual(cursor.sequence, 8)
+        self.assertEqual(cursor.read(Revoked.objects.all()), [])
+        Revoked.objects.bulk_create([
+            Revoked(certificate=self.certificates[2], sequence=7),
+            Revoked(certificate=self.certificates[3], sequence=9),
+        ])
+        rows = cursor.read(Revoked.objects.all(), 'certificate__serial')
+        self.assertEqual(rows, [
+            (self.certificates[2].serial, 7),
+            (self.certificates[3].serial, 9),
+        ])
+        self.assertEqual(cursor.sequence, 9)
+
+    def test_refresh(self):
+        """The index reads the new revocations from the database."""
+        index = RevocationIndex(interval=0, reload=3600)
+        self.assertFalse(index.is_revoked(self.certificates[0].serial))
+        Revoked.objects.create(
+            certificate=self.certificates[0], reason=c.REV_KEYCOMPROMISE)
+        index.invalidate()
+        self.assertTrue(index.is_revoked(self.certificates[0].serial))
+        self.assertEqual(
+            index.get(int(self.certificates[0].serial, 16))[1], c.REV_KEYCOMPROMISE)
+        # A revocation committed after a later one is not missed
+        late = Counter.next_value(Counter.REVOCATIONS)
+        Revoked.objects.create(certificate=self.certificates[1])
+        index.invalidate()
+        self.assertTrue(index.is_revoked(self.certificates[1].serial))
+        Revoked.objects.bulk_create([
+            Revoked(certificate=self.certificates[2], sequence=late),
+        ])
+        index.invalidate()
+        self.assertTrue(index.is_revoked(self.certificates[2].serial))
+        self.assertFalse(index.is_revoked(self.certificates[3].serial))
+        self.assertEqual(len(index), 3)
+
+    def test_deletions(self):
+        """The CRL entries are loaded again after a deletion, even if
+        there are as many revocations as before."""
+        service = ServiceWithoutCA(worker=True)
+        serial = [int(cert.serial, 16) for cert in self.certificates]
+        Revoked.objects.create(certificate=self.certificates[0])
+        Revoked.objects.create(certificate=self.certificates[1])
+        entries = service.update_crl_entries(timezone.now())
+        self.assertEqual(entries.serials, [serial[0], serial[1]])
+        self.assertEqual(service.read_new_revocations(service.get_crl_config()), 2)
+        Revoked.objects.get(certificate=self.certificates[0]).delete()
+        Revoked.objects.create(certificate=self.certificates[2])
+        self.assertEqual(Counter.get_value(Counter.REVOCATION_DELETIONS), 1)
+        entries = service.update_crl_entries(timezone.now())
+        self.assertEqual(entries.serials, [serial[1], serial[2]])
+        # Both the deletion and the new revocation have to be published
+        self.assertEqual(service.read_new_revocations(service.get_crl_config()), 2)
+
+
+@override_settings(CRL_DEBOUNCE=10, CRL_MIN_INTERVAL=60)
+class CRLDebounceTest(TestCase):
+    """Test when the CRLs are published after new revocations."""
+
+    def setUp(self):
+        self.service = ServiceWithoutCA(worker=True)
+
+    def due(self, new, seconds):
+        return self.service._revocations_due(
+            new, datetime.fromtimestamp(seconds, pytz.utc))
+
+    def test_nothing_changed(self):
+        """Without revocations nothing is published."""
+        for seconds in [1000, 1100, 5000]:
+            self.assertFalse(self.due(0, seconds))
+
+    def test_quiet_period(self):
+        """The revocations are published once none has come for a while."""
+        self.assertFalse(self.due(1, 1000))
+        self.assertFalse(self.due(2, 1005))
+        self.assertFalse(self.due(0, 1010))
+        self.assertTrue(self.due(0, 1015))
+
+    def test_max_delay(self):
+        """Revocations that keep coming are published after a while."""
+        for seconds in range(1000, 1060, 5):
+            self.assertFalse(self.due(1, seconds))
+        self.assertTrue(self.due(1, 1060))
+
+    def test_min_interval(self):
+        """The CRLs are not published too often."""
+        self.assertFalse(self.due(1, 1000))
+        self.assertTrue(self.due(0, 1010))
+        crl_config = self.service.get_crl_config()
+        self.service._crl_published(
+            crl_config, datetime.fromtimestamp(1010, pytz.utc))
+        self.assertFalse(self.due(0, 1030))
+        self.assertFalse(self.due(1, 1030))
+        self.assertFalse(self.due(0, 1050))
+        self.assertTrue(self.due(0, 1070))
+        self.service._crl_published(
+            crl_config, datetime.fromtimestamp(1070, pytz.utc))
+        self.assertFalse(self.due(0, 2000))
+
+
+class RequestClaimTest(TestCase):
+    """Test how the CA service claims requests."""
+
+    def setUp(self):
+        user = User.objects.create_user('test', 'test@test.net')
+        template = Template.objects.create(
+            name='test', days=1, enabled=True, key_usage=['digitalSignature'])
+        # bulk_create doesn't call save() so no CSR is needed
+        Request.objects.bulk_create([
+            Request(user=user, subject='/CN=test', template=template,
+                    approved=True),
+            Request(user=user, subject='/CN=test', template=template),
+        ])
+        self.approved, self.pending = Request.objects.order_by('id')
+
+    def test_claim(self):
+        """Only one claim succeeds."""
+        self.assertTrue(Request.claim(self.approved.id))
+        self.assertFalse(Request.claim(self.approved.id))
+        self.approved.refresh_from_db()
+        self.assertEqual(self.approved.status, Request.STATUS_ISSUING)
+
+    def test_claim_not_approved(self):
+        """Requests pending approval can't be claimed."""
+        self.assertFalse(Request.claim(self.pending.id))
+
+    def test_release(self):
+        """Released requests can be claimed again."""
+        self.assertTrue(Request.claim(self.approved.id))
+        self.assertEqual(Request.release([self.approved.id, self.pending.id]), 1)
+        self.approved.refresh_from_db()
+        self.assertEqual(self.approved.status, Request.STATUS_PROCESSING)
+        self.assertIsNone(self.approved.claimed_at)
+        self.assertTrue(Request.claim(self.approved.id))
+
+    def test_release_stale(self):
+        """Only the claims older than the timeout are released."""
+        self.assertTrue(Request.claim(self.approved.id))
+        self.assertEqual(Request.release_stale(60), 0)
+        Request.objects.filter(pk=self.approved.id).update(
+            claimed_at=timezone.now() - timedelta(seconds=120))
+        self.assertEqual(Request.release_stale(60), 1)
+        self.approved.refresh_from_db()
+        self.assertEqual(self.approved.status, Request.STATUS_PROCESSING)
+
+    def test_issue_failed(self):
+        """A request that fails to be issued is not left claimed."""
+        class FailingService(ServiceWithoutCA):
+            def _process_request(self, request):
+                raise ValueError('test')
+
+        service = FailingService(worker=True)
+        self.assertEqual(service.process_requests(), 1)
+        self.approved.refresh_from_db()
+        self.assertEqual(self.approved.status, Request.STATUS_ERROR)
+        self.assertIn('ValueError', self.approved.admin_comment)
+
+
+class ListingTest(TestCase):
+    """Test the listings of requests shown to the users."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.net')
+        self.template = Template.objects.create(
+            name='test', days=1, enabled=True, key_usage=['digitalSignature'])
+        self.other = Template.objects.create(
+            name='other', days=1, enabled=True, key_usage=['digitalSignature'])
+        now = timezone.now()
+        # (template, status, approved, valid days, revoked)
+        rows = [
+            (self.template, Request.STATUS_PROCESSING, None, None, False),
+            (self.template, Request.STATUS_PROCESSING, True, None, False),
+            (self.template, Request.STATUS_ISSUING, True, None, False),
+            (self.other, Request.STATUS_ISSUED, True, 10, False),
+            (self.other, Request.STATUS_ISSUED, True, 100, False),
+            (self.template, Request.STATUS_ISSUED, True, -1, False),
+            (self.template, Request.STATUS_ISSUED, True, 10, True),
+            (self.template, Request.STATUS_REJECTED, False, None, False),
+            (self.template, Request.STATUS_ERROR, True, None, False),
+        ]
+        # bulk_create doesn't call save() so no CSR or PEM is needed
+        Request.objects.bulk_create([
+            Request(user=self.user, subject='/CN=test', template=template,
+                    status=status, approved=approved)
+            for template, status, approved, _, _ in rows
+        ])
+        requests = Request.objects.order_by('id')
+        Certificate.objects.bulk_create([
+            Certificate(user=self.user, csr=request, subject='/CN=test',
+                        serial='%x' % request.id,
+                        valid_from=now - timedelta(days=10),
+                        valid_to=now + timedelta(days=days))
+            for request, (_, _, _, days, _) in zip(requests, rows)
+            if days is not None
+        ])
+        Revoked.objects.bulk_create([
+            Revoked(certificate=Certificate.objects.get(csr=request))
+            for request, (_, _, _, _, revoked) in zip(requests, rows)
+            if revoked
+        ])
+
+    def test_extended_status(self):
+        """The status computed in the query is the same as the property."""
+        listed = Request.objects.with_extended_status()
+        self.assertEqual(len(listed), 9)
+        for request in listed:
+            expected = Request.objects.select_related(
+                'certificate__revoked').get(pk=request.pk)
+            self.assertEqual(request.extended_status, expected.extended_status)
+        self.assertEqual(
+            [r.extended_status_code for r in listed.order_by('id')],
+            ['pending', 'approved', 'issuing', 'issued', 'issued',
+             'expired', 'revoked', 'rejected', 'error'])
+
+    def test_filters(self):
+        """Requests are filtered by status, template and expiration."""
+        listed = Request.objects.with_extended_status()
+        self.assertEqual(listed.filter_listing(status='issued').count(), 2)
+        self.assertEqual(listed.filter_listing(status='pending').count(), 1)
+        self.assertEqual(listed.filter_listing(template=self.other.id).count(), 2)
+        self.assertEqual(listed.filter_listing(expires_in=30).count(), 2)
+        self.assertEqual(listed.filter_listing(
+            status='issued', expires_in=30).count(), 1)
+
+    def test_pagination(self):
+        """Pages are walked in both directions."""
+        queryset = Request.objects.with_extended_status()
+        ids = list(queryset.values_list('id', flat=True))
+        page = paginate(queryset, {}, size=4)
+        self.assertEqual([r.id for r in page], ids[:4])
+        self.assertIsNone(page.previous_id)
+        page = paginate(queryset, {'after': page.next_id}, size=4)
+        self.assertEqual([r.id for r in page], ids[4:8])
+        page = paginate(queryset, {'after': page.next_id}, size=4)
+        self.assertEqual([r.id for r in page], ids[8:])
+        self.assertIsNone(page.next_id)
+        page = paginate(queryset, {'before': page.previous_id}, size=4)
+        self.assertEqual([r.id for r in page], ids[4:8])
+        page = paginate(queryset, {'before': page.previous_id}, size=4)
+        self.assertEqual([r.id for r in page], ids[:4])
+        self.assertIsNone(page.previous_id)
+        page = paginate(queryset, {'after': 'x'}, size=4)
+        self.assertEqual([r.id for r in page], ids[:4])
+
+    def test_validity(self):
+        """Certificates are filtered by validity in the query."""
+        self.assertEqual(Certificate.objects.valid().count(), 2)
+        self.assertEqual(Certificate.objects.expired().count(), 1)
+        self.assertEqual(Certificate.objects.revoked().count(), 1)
+        for certificate in Certificate.objects.select_related('revoked'):
+            self.assertEqual(
+                Certificate.objects.valid().filter(pk=certificate.pk).exists(),
+                certificate.is_valid)
+
+    def test_location_count(self):
+        """Locations count their valid certificates."""
+        location = CRLLocation.objects.create(url='http://test/crl')
+        other = CRLLocation.objects.create(url='http://other/crl')
+        Certificate.objects.update(
+            crl_points=CRLPointSet.for_locations([location]))
+        Certificate.objects.filter(valid_to__gt=timezone.now() + timedelta(days=50)).update(
+            crl_points=CRLPointSet.for_locations([other, location]))
+        self.assertEqual(location.count, 2)
+        self.assertEqual(other.count, 1)
+        with self.assertNumQueries(1):
+            counts = [x.count for x in CRLLocation.with_counts().order_by('id')]
+        self.assertEqual(counts, [2, 1])
+
+    def test_point_sets(self):
+        """Point sets are shared by the certificates with the same locations."""
+        first = CRLLocation.objects.create(url='http://first/crl')
+        second = CRLLocation.objects.create(url='http://second/crl')
+        point_set = CRLPointSet.for_locations([first, second])
+        with self.assertNumQueries(1):
+            self.assertEqual(CRLPointSet.for_locations([second, first]), point_set)
+        self.assertNotEqual(CRLPointSet.for_locations([first]), point_set)
+        self.assertIsNone(CRLPointSet.for_locations([]))
+        self.assertEqual(set(point_set.locations.all()), {first, second})
+
+    def test_queries(self):
+        """A page is listed with one query."""
+        queryset = Request.objects.with_extended_status()
+        with self.assertNumQueries(1):
+            for request in paginate(queryset, {}, size=20):
+                request.extended_status
+                request.template.name
+
+
+@override_settings(CA_SERVICE_NOTIFY_PORT=18411)
+class NotifyTest(TestCase):
+    """Test the CA service notifications."""
+
+    def test_notify(self):
+        """Notifications wake up the listener."""
+        listener = notify.Listener()
+        try:
+            self.assertEqual(listener.wait(0), set())
+            notify.notify(notify.REQUESTS)
+            notify.notify(notify.REVOCATIONS)
+            notify.notify(notify.REQUESTS)
+            time.sleep(0.1)
+            self.assertEqual(listener.wait(1),
+                             {notify.REQUESTS, notify.REVOCATIONS})
+        finally:
+            listener.close()
+
+    def test_no_listener(self):
+        """Notifying without a listener doesn't fail."""
+        notify.notify(notify.REQUESTS)
+
+    def test_database_error(self):
+        """Database errors sending a notification are only logged."""
+        # SQLite has no pg_notify
+        with mock.patch.object(notify, '_use_postgres', return_value=True):
+            with self.assertLogs('webca.utils.notify', 'WARNING'):
+                notify.notify(notify.REVOCATIONS)
+
+
+class TemplateAccessTest(TestCase):
+    """Test the resolution of the templates users can use."""
+
+    def setUp(self):
+        self.users = Group.objects.create(name='users')
+        self.admins = Group.objects.create(name='admins')
+        self.user = User.objects.create_user('test', 'test@test.net')
+        self.user.groups.add(self.users)
+        self.allowed = Template.objects.create(
+            name='allowed', days=1, enabled=True, key_usage=['digitalSignature'])
+        self.allowed.allowed_groups.add(self.users)
+        self.other = Template.objects.create(
+            name='other', days=1, enabled=True, key_usage=['digitalSignature'])
+        self.other.allowed_groups.add(self.admins)
+        self.disabled = Template.objects.create(
+            name='disabled', days=1, enabled=False, key_usage=['digitalSignature'])
+        self.disabled.allowed_groups.add(self.users)
+        # Let the configuration be cached although this is a transaction
+        config_cache.clear()
+
+    def test_templates(self):
+        """The templates are resolved once."""
+        self.assertEqual(template_access.get_templates(self.user), [self.allowed])
+        with self.assertNumQueries(0):
+            self.assertEqual(template_access.get_templates(self.user), [self.allowed])
+            self.assertTrue(self.user.has_perm(PERM_USE_TEMPLATE, self.allowed))
+            self.assertFalse(self.user.has_perm(PERM_USE_TEMPLATE, self.other))
+
+    def test_disabled_permission(self):
+        """Disabled templates are not listed, but the permission to use
+        them only depends on the groups."""
+        self.assertNotIn(self.disabled, template_access.get_templates(self.user))
+        self.assertTrue(self.user.has_perm(PERM_USE_TEMPLATE, self.disabled))
+
+    def test_groups_changed(self):
+        """Changing the groups of a user changes the templates."""
+        template_access.get_templates(self.user)
+        self.user.groups.add(self.admins)
+        self.assertEqual(template_access.get_templates(self.user),
+                         [self.allowed, self.other])
+
+    def test_templates_changed(self):
+        """Changing a template changes the templates of the users."""
+        template_access.get_templates(self.user)
+        self.other.allowed_groups.add(self.users)
+        self.assertEqual(template_access.get_templates(self.user),
+                         [self.allowed, self.other])
+        self.allowed.enabled = False
+        self.allowed.save()
+        self.assertEqual(template_access.get_templates(self.user), [self.other])
+
+    def test_superuser(self):
+        """Superusers can use every enabled template."""
+        admin = User.objects.create_superuser('admin', 'admin@test.net', 'admin')
+        self.assertEqual(template_access.get_templates(admin),
+                         [self.allowed, self.other])
+
+    def test_middleware(self):
+        """The templates are only resolved when they are used."""
+        request = RequestFactory().get('/')
+        request._cached_user = self.user
+        middleware = TemplatePermissionsMiddleware(lambda request: request)
+        with self.assertNumQueries(0):
+            request = middleware(request)
+            templates = request.user.templates
+        self.assertEqual(list(templates), [self.allowed])
+        self.assertIn(self.allowed, templates)
+
+
+class ProfileTest(TestCase):
+    """Test the compiled issuance profiles."""
+
+    def setUp(self):
+        self.template = Template.objects.create(
+            name='test', days=1, enabled=True, key_usage=['digitalSignature'],
+            ext_key_usage=['clientAuth'])
+        self.location = CRLLocation.objects.create(url='http://test/crl')
+        # Let the configuration be cached although this is a transaction
+        config_cache.clear()
+        profile_cache.invalidate()
+
+    def tearDown(self):
+        profile_cache.invalidate()
+
+    def test_profile(self):
+        """Profiles have the same answers as the template."""
+        profile = profile_cache.get(self.template, 'http://ocsp.test/')
+        self.assertEqual(
+            [str(ext) for ext in profile.get_extensions()],
+            [str(ext) for ext in self.template.get_extensions()])
+        self.assertEqual(profile.allowed_key_types(), self.template.allowed_key_types())
+        for key_type in [c.KEY_RSA, c.KEY_DSA, c.KEY_EC]:
+            self.assertEqual(profile.min_bits_for(key_type),
+                             self.template.min_bits_for(key_type))
+        self.assertIn('http://test/crl', str(profile.get_cdp()))
+        self.assertIn('http://ocsp.test/', str(profile.get_aia()))
+        self.assertEqual(
+            profile.point_set_id, CRLPointSet.for_locations([self.location]).id)
+
+    def test_hit(self):
+        """Profiles are compiled once."""
+        profile = profile_cache.get(self.template)
+        with self.assertNumQueries(0):
+            self.assertIs(profile_cache.get(self.template), profile)
+            self.assertIs(profile.get_cdp(3), profile.get_cdp(3))
+        self.assertIsNone(profile.get_aia())
+
+    def test_changes(self):
+        """Profiles are compiled again when their inputs change."""
+        profile = profile_cache.get(self.template)
+        self.template.days = 2
+        self.template.save()
+        profile = profile_cache.get(self.template)
+        self.assertEqual(profile.version, self.template.version)
+        self.assertIsNot(profile_cache.get(self.template, 'http://ocsp.test/'), profile)
+        CRLLocation.objects.create(url='http://other/crl')
+        profile = profile_cache.get(self.template)
+        self.assertEqual(profile.locations, ['http://test/crl', 'http://other/crl'])
+
+    def test_pickle(self):
+        """Profiles can be sent to other processes."""
+        profile = profile_cache.get(self.template, 'http://ocsp.test/')
+        profile.get_extensions()
+        copy = pickle.loads(pickle.dumps(profile))
+        self.assertEqual(
+            [ext.get_data() for ext in copy.get_extensions()],
+            [ext.get_data() for ext in profile.get_extensions()])
+        self.assertEqual(str(copy.get_aia()), str(profile.get_aia()))
+        profile_cache.invalidate()
+        profile_cache.add(copy)
+        self.assertIs(profile_cache.get(self.template, 'http://ocsp.test/'), copy)
@@ -13,8 +13,10 @@ from django.urls import reverse
 
 from webca.crypto import constants as c
 from webca.crypto.utils import export_certificate, export_csr
-from webca.web.forms import RequestNewForm, TemplateSelectorForm
+from webca.web.forms import (RequestFilterForm, RequestNewForm,
+                             TemplateSelectorForm)
 from webca.web.models import Certificate, Request, Template
+from webca.web.pagination import paginate
 from webca.web.views import WebCAAuthView
 
 
@@ -60,16 +62,17 @@ def download_certificate(request, request_id, pem=True):
         return http.HttpResponseRedirect(reverse('request:index'))
 
     try:
-        x509 = request.certificate.get_certificate()
+        certificate = request.certificate
     except Certificate.DoesNotExist:
         return http.HttpResponseRedirect(reverse('request:index'))
 
+    # The stored PEM and DER are served as they are
     if pem:
-        content = export_certificate(x509, pem=True)
+        content = certificate.x509
         content_type = 'application/x-pem-file'
         extension = '.cer'
     else:
-        content = export_certificate(x509, pem=False)
+        content = certificate.get_der()
         content_type = 'application/pkix-cert'
         extension = '.cer'
 
@@ -115,6 +118,15 @@ def view_examples(request):
     return render(request, 'webca/web/requests/examples.html', context)
 
 
+def _filter_query(params):
+    """Return the query string of the filters in `params` without the
+    pagination parameters, to build the links to other pages."""
+    params = params.copy()
+    params.pop('after', None)
+    params.pop('before', None)
+    return params.urlencode()
+
+
 class IndexView(WebCAAuthView):
     """Index view for the requests section."""
     form_class = TemplateSelectorForm
@@ -128,9 +140,20 @@ class IndexView(WebCAAuthView):
 
     def get(self, request, *args, **kwargs):
         """Display welcome page."""
-        request_list = Request.objects.filter(user=request.user)
+        filter_form = RequestFilterForm(
+            request.GET,
+            template_choices=request.user.templates,
+        )
+        request_list = paginate(
+            Request.objects.filter(
+                user=request.user,
+            ).with_extended_status().filter_listing(**filter_form.get_filters()),
+            request.GET,
+        )
         self.context.update({
             'request_list': request_list,
+            'filter_form': filter_form,
+            'filter_query': _filter_query(request.GET),
             'templates': request.user.templates,
             'templates_form': self.form_class(
                 template_choices=request.user.templates,
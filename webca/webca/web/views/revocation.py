@@ -9,6 +9,7 @@ from django.urls import reverse
 
 from webca.web.forms import RevocationForm
 from webca.web.models import Certificate, Request, Revoked
+from webca.web.pagination import paginate
 from webca.web.views import WebCAAuthView
 
 
@@ -24,11 +25,13 @@ class IndexView(WebCAAuthView):
 
     def get(self, request, *args, **kwargs):
         """Show the welcome page."""
-        certificates = Certificate.objects.filter(
-            Q(user=request.user),
-            Q(csr__status=Request.STATUS_ISSUED),
+        certificates = paginate(
+            Certificate.objects.filter(
+                Q(user=request.user),
+                Q(csr__status=Request.STATUS_ISSUED),
+            ).valid(),
+            request.GET,
         )
-        certificates = [c for c in certificates if c.is_valid]
         self.context.update({
             'certificates': certificates,
         })
@@ -75,9 +78,13 @@ class RevocationView(WebCAAuthView):
             Q(user=request.user),
             Q(csr__status=Request.STATUS_ISSUED),
             Q(pk=certificate_id),
-        ).first()
+        ).select_related('revoked').first()
         if not certificate:
             return http.HttpResponseRedirect(reverse('revoke:index'))
+        if certificate.get_status().status == Certificate.STATUS_REVOKED:
+            messages.add_message(request, messages.ERROR,
+                                 'The certificate was already revoked.')
+            return http.HttpResponseRedirect(reverse('revoke:index'))
         form = self.form_class(
             request.POST,
         )